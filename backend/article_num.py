@@ -0,0 +1,112 @@
+# backend/article_num.py
+# 条番号の正規化：「第七百九条」「第709条」「709」「第三百九十八条の二」などを
+# 整数タプル (709,) / (398, 2) に揃える。
+from __future__ import annotations
+import re
+from typing import Optional, Tuple
+
+_KANJI_DIGITS = {"〇": 0, "零": 0, "一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_KANJI_UNITS = {"十": 10, "百": 100, "千": 1000}
+_NUM_CHARS = "0-9０-９〇零一二三四五六七八九十百千万"
+
+# 「第七百九条の二」「709条の2」「七百九」…（文字列全体が条番号なら「第」「条」は省略可）
+_ARTICLE_RE = re.compile(rf"第?\s*([{_NUM_CHARS}]+)\s*条?((?:\s*[のノ\-‐－]\s*[{_NUM_CHARS}]+)*)")
+# 文中から拾う場合は「条」必須（「一般」「二重請求」などを条番号と誤認しない）
+_ARTICLE_IN_TEXT_RE = re.compile(rf"第?([{_NUM_CHARS}]+)条((?:の[{_NUM_CHARS}]+)*)")
+_BRANCH_RE = re.compile(rf"[のノ\-‐－]\s*([{_NUM_CHARS}]+)")
+
+ArticleNum = Tuple[int, ...]
+
+
+def kanji_to_int(s: str) -> Optional[int]:
+    """漢数字（位取り・一桁並べ両対応）またはアラビア数字を int に。解釈できなければ None。"""
+    s = (s or "").strip().translate(str.maketrans("０１２３４５６７８９", "0123456789"))
+    if not s:
+        return None
+    if s.isdigit():
+        return int(s)
+    total, section, digit = 0, 0, None
+    for ch in s:
+        if ch in _KANJI_DIGITS:
+            # 「二〇一」のような一桁並べ表記にも対応
+            digit = _KANJI_DIGITS[ch] if digit is None else digit * 10 + _KANJI_DIGITS[ch]
+        elif ch in _KANJI_UNITS:
+            section += (1 if digit is None else digit) * _KANJI_UNITS[ch]
+            digit = None
+        elif ch == "万":
+            total += (section + (digit or 0)) * 10000
+            section, digit = 0, None
+        else:
+            return None
+    return total + section + (digit or 0)
+
+
+def int_to_kanji(n: int) -> str:
+    if n == 0:
+        return "〇"
+    out = ""
+    if n >= 10000:
+        out += int_to_kanji(n // 10000) + "万"
+        n %= 10000
+    for unit, ch in ((1000, "千"), (100, "百"), (10, "十")):
+        q, n = divmod(n, unit)
+        if q:
+            out += ("" if q == 1 else "一二三四五六七八九"[q - 1]) + ch
+    if n:
+        out += "一二三四五六七八九"[n - 1]
+    return out
+
+
+def parse_article(s: str) -> Optional[ArticleNum]:
+    """条番号らしき文字列を (本条, 枝番...) に。例: '第三百九十八条の二' -> (398, 2)"""
+    s = str(s or "").strip()
+    m = _ARTICLE_RE.fullmatch(s) or _ARTICLE_IN_TEXT_RE.search(s)
+    if not m:
+        return None
+    main = kanji_to_int(m.group(1))
+    if main is None:
+        return None
+    nums = [main]
+    for b in _BRANCH_RE.findall(m.group(2) or ""):
+        v = kanji_to_int(b)
+        if v is None:
+            break
+        nums.append(v)
+    return tuple(nums)
+
+
+def parse_article_title(title: str) -> Optional[ArticleNum]:
+    """ArticleTitle 用の厳密版。「第三十八条から第八十四条まで」のような範囲（削除条）は None。"""
+    m = _ARTICLE_IN_TEXT_RE.fullmatch(str(title or "").strip())
+    return parse_article(m.group(0)) if m else None
+
+
+BRANCH_BASE = 1000  # 枝番は各段 999 まで
+
+
+def article_code(nums: ArticleNum) -> int:
+    """(398, 2) -> 398_002_000 のように、並べると条文順になる整数に詰める（枝番は2段まで）。"""
+    b = list(nums[1:3]) + [0] * (3 - len(nums[:3]))
+    return (nums[0] * BRANCH_BASE + b[0]) * BRANCH_BASE + b[1]
+
+
+def code_main(code: int) -> int:
+    return code // (BRANCH_BASE * BRANCH_BASE)
+
+
+def is_main_article(code: int) -> bool:
+    """枝番の無い本条（第七百九条など）か"""
+    return code % (BRANCH_BASE * BRANCH_BASE) == 0
+
+
+def article_label(nums: ArticleNum) -> str:
+    """(398, 2) -> '第三百九十八条の二'（e-Gov の ArticleTitle と同じ表記）"""
+    return f"第{int_to_kanji(nums[0])}条" + "".join(f"の{int_to_kanji(b)}" for b in nums[1:])
+
+
+def article_caption(doc: dict) -> str:
+    """本文先頭の「（見出し）」または article 欄の「第…条（見出し）」から見出しを取り出す。"""
+    m = re.match(r"（([^（）\n]+)）\s*(?:\n|$)", doc.get("text", "") or "")
+    if not m:
+        m = re.search(r"条[^（\n]*（([^（）\n]+)）", doc.get("article", "") or "")
+    return m.group(1).strip() if m else ""
@@ -0,0 +1,104 @@
+# backend/bench/amend.py
+# 1 条だけ改正された時の再構築コスト。ネットワーク不要（data/ingested の取り込み済み JSON を使う）。
+#   BM25   : 変わった 1 条のトークン化 / 全件 build() / 差分 update() の時間（中央値）。
+#            --scale で文書を複製してコーパスを大きくする（民法だけの手元で 4 法令分の件数を見る時は 2）
+#   load   : 一時ディレクトリに取り込み JSON を写し、STORE.load() → 1 条書き換え → STORE.load() の時間（埋め込み無し）
+# 使い方（backend/ で）:
+#   python bench/amend.py --scale 1 --scale 2
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+BACKEND = Path(__file__).resolve().parent.parent
+AMEND = "ただし、この限りでない。"
+
+
+def _median_ms(fn, repeat: int) -> float:
+    ts = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        ts.append((time.perf_counter() - t) * 1000)
+    return round(float(np.median(ts)), 2)
+
+
+def _live_docs(ingested: Path) -> List[Dict[str, Any]]:
+    docs = []
+    for p in sorted(ingested.glob("*.json")):
+        docs += [d for d in json.loads(p.read_text(encoding="utf-8")) if not d.get("deleted")]
+    return docs
+
+
+def bench_bm25(ingested: Path, scales: List[int], repeat: int) -> List[Dict[str, Any]]:
+    from bm25 import SparseBM25
+    from jp_tokenize import ja_tokens_corpus, normalize_text
+    docs = _live_docs(ingested)
+    tokens = ja_tokens_corpus([normalize_text(d["text"]) for d in docs])
+    out = []
+    for scale in scales:
+        tok = [list(t) for t in tokens] * scale
+        prev = SparseBM25.build(tok)
+        i = len(tok) // 2
+        text = normalize_text(docs[i % len(docs)]["text"] + AMEND)
+        new = list(tok)
+        new[i] = ja_tokens_corpus([text])[0]
+        rows = np.arange(len(new))
+        rows[i] = -1
+        out.append({
+            "docs": len(tok),
+            "tokenize_1_ms": _median_ms(lambda: ja_tokens_corpus([text + str(time.perf_counter_ns())]), repeat),
+            "build_ms": _median_ms(lambda: SparseBM25.build(new), repeat),
+            "update_ms": _median_ms(lambda: SparseBM25.update(prev, new, rows), repeat),
+        })
+    return out
+
+
+def bench_load(ingested: Path) -> Dict[str, Any]:
+    """別プロセスで一時ディレクトリの STORE を 2 回ロード（索引の置き場を本物から切り離す）"""
+    tmp = Path(tempfile.mkdtemp(prefix="rag-amend-"))
+    try:
+        shutil.copytree(ingested, tmp / "ingested")
+        env = {**os.environ, "RAG_INGESTED_DIR": str(tmp / "ingested"), "RAG_INDEX_DIR": str(tmp / "index"),
+               "RAG_EMBEDDINGS": "off"}
+        code = f"""
+import json, time
+from pathlib import Path
+from store import STORE
+t = time.perf_counter(); STORE.load(); cold = (time.perf_counter() - t) * 1000
+p = sorted(Path({str(tmp / "ingested")!r}).glob("*.json"))[0]
+docs = json.loads(p.read_text(encoding="utf-8"))
+i = next(j for j in range(len(docs) // 2, len(docs)) if not docs[j].get("deleted"))
+docs[i]["text"] += {AMEND!r}
+docs[i].pop("hash", None)
+p.write_text(json.dumps(docs, ensure_ascii=False), encoding="utf-8")
+t = time.perf_counter(); STORE.load(); amend = (time.perf_counter() - t) * 1000
+print(json.dumps({{"docs": len(STORE.docs), "cold_ms": round(cold, 1), "amend_ms": round(amend, 1),
+                  "reused": STORE.last_load.get("reused")}}))
+"""
+        import subprocess
+        r = subprocess.run([sys.executable, "-c", code], cwd=BACKEND, env=env, capture_output=True, text=True, check=True)
+        return json.loads(r.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    from store import INGESTED_DIR
+    ap = argparse.ArgumentParser(description="1 条改正時の再構築コスト（BM25 の build / update と STORE.load）")
+    ap.add_argument("--ingested", type=Path, default=INGESTED_DIR)
+    ap.add_argument("--scale", type=int, action="append", help="文書の複製数（複数指定可。既定 1）")
+    ap.add_argument("--repeat", type=int, default=7)
+    args = ap.parse_args()
+    result = {"bm25": bench_bm25(args.ingested, args.scale or [1], args.repeat), "load": bench_load(args.ingested)}
+    print(json.dumps(result, ensure_ascii=False, indent=1))
@@ -0,0 +1,248 @@
+# backend/bench/run.py
+# 検索のベンチマーク兼、関連度の回帰チェック。ネットワーク不要（LLM ルータ・検索語拡張の出力は queries.jsonl に固定）。
+#   モード   router   : ルータの出力（条文ヒント・検索語・トピック）＋ LLM 検索語をすべて渡す（本番と同じ）
+#            no_hints : 条文ヒントだけ外す（ヒント加点で当たりが決まらないので、検索エンジン自体の比較はこれで）
+#            local    : 質問文だけ（LLM 無し）
+#            local_router : ルータは router.route_local（LLM 無し、API キーが無い時の経路）。LLM 検索語も無し
+#            hybrid   : 本番の RAG_ROUTER=hybrid と同じ。route_local の confidence が閾値以上ならそれ、足りなければ
+#                       フィクスチャの llm_route。LLM 検索語は渡す。ローカルで済んだ割合を routed に出す
+#   指標     recall@k（期待条文のうち上位 k 件に入った割合）/ MRR / 段ごとの遅延分位点 / tracemalloc のピーク / スループット
+# 使い方（backend/ で）:
+#   RAG_EMBEDDINGS=off python bench/run.py --out /tmp/bench.json
+#   python bench/run.py --compare bench/baseline.json --fail-on-regression   # 関連度が基準より落ちたら終了コード 1
+from __future__ import annotations
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np
+
+BENCH_DIR = Path(__file__).resolve().parent
+QUERIES_PATH = BENCH_DIR / "queries.jsonl"
+MODES = ("router", "no_hints", "local", "local_router", "hybrid")
+KS = (1, 5, 10, 30)
+TOP_K = 30
+
+
+def load_queries(path: Path = QUERIES_PATH) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+def _route(q: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    """モードごとのルータ出力（router キーに local / llm）"""
+    if mode in ("local_router", "hybrid"):
+        from router import MIN_CONFIDENCE, route_local
+        r = route_local(q["query"])
+        if mode == "local_router" or r["confidence"] >= MIN_CONFIDENCE:
+            return r
+    return {**q.get("route", {}), "router": "llm"}
+
+
+def _args(q: Dict[str, Any], mode: str):
+    """retrieve_candidates_batch に渡す (law_hints, search_terms, civil_topics, llm_keywords)"""
+    if mode == "local":
+        return [], [], [], []
+    r = _route(q, mode)
+    if mode == "local_router":
+        return r["law_hints"], r["search_terms"], r["civil_topics"], []
+    hints = r.get("law_hints", []) if mode in ("router", "hybrid") else []
+    return hints, r.get("search_terms", []), r.get("civil_topics", []), q.get("llm_keywords", [])
+
+
+def _expected_keys(snap, q: Dict[str, Any]) -> set:
+    """期待条文を (法令キー, article_code) の集合に。コーパスに無い条は警告して外す。"""
+    from article_num import article_code, parse_article
+    law = q.get("law", "civilcode")
+    keys = set()
+    for a in q["expected"]:
+        nums = parse_article(a)
+        code = article_code(nums) if nums else -1
+        if code < 0 or not len(snap.find_articles(code, law)):
+            print(f"[WARN] {q['id']}: expected article not in corpus: {law} {a}", file=sys.stderr)
+            continue
+        keys.add((law, code))
+    return keys
+
+
+def _result_key(d: Dict[str, Any]):
+    return (d["id"].split(":", 1)[0], d.get("article_code"))
+
+
+def _relevance(results: List[Dict[str, Any]], expected: set) -> Dict[str, Any]:
+    keys = [_result_key(d) for d in results]
+    ranks = sorted(keys.index(e) + 1 for e in expected if e in keys)
+    out = {f"recall@{k}": sum(r <= k for r in ranks) / len(expected) for k in KS}
+    out["rr"] = 1.0 / ranks[0] if ranks else 0.0
+    out["ranks"] = ranks
+    return out
+
+
+def _pct(xs: List[float]) -> Dict[str, float]:
+    a = np.asarray(xs, dtype=np.float64) * 1000
+    return {"p50": round(float(np.percentile(a, 50)), 3), "p90": round(float(np.percentile(a, 90)), 3),
+            "p99": round(float(np.percentile(a, 99)), 3), "mean": round(float(a.mean()), 3)}
+
+
+def run_mode(search, snap, queries, mode: str, repeat: int) -> Dict[str, Any]:
+    per_query, stage_samples, totals = [], {}, []
+    for q in queries:
+        expected = _expected_keys(snap, q)
+        hints, st, ct, kw = _args(q, mode)
+        results = None
+        for _ in range(repeat):
+            timings: Dict[str, float] = {}
+            t = time.perf_counter()
+            results = search.retrieve_candidates_batch([q["query"]], [hints], [st], [ct], [kw], top_k=TOP_K, timings=timings)[0]
+            totals.append(time.perf_counter() - t)
+            for stage, sec in timings.items():
+                stage_samples.setdefault(stage, []).append(sec)
+        rel = _relevance(results, expected) if expected else None
+        per_query.append({"id": q["id"], **(rel or {"skipped": True}),
+                          "top5": [d["id"] for d in results[:5]]})
+        if mode == "hybrid":
+            per_query[-1]["router"] = _route(q, mode)["router"]
+    scored = [p for p in per_query if not p.get("skipped")]
+    summary = {f"recall@{k}": round(float(np.mean([p[f"recall@{k}"] for p in scored])), 4) for k in KS}
+    summary["mrr"] = round(float(np.mean([p["rr"] for p in scored])), 4)
+    out = {
+        "relevance": summary,
+        "latency_ms": {"total": _pct(totals), **{s: _pct(v) for s, v in stage_samples.items()}},
+        "queries": per_query,
+    }
+    if mode == "hybrid":
+        local = sum(p["router"] == "local" for p in per_query)
+        out["routed"] = {"local": local, "llm": len(per_query) - local, "local_share": round(local / len(per_query), 4)}
+    return out
+
+
+def run_alloc(search, queries, mode: str = "no_hints") -> Dict[str, Any]:
+    """1 クエリずつ tracemalloc のピーク（検索中に確保された最大量）を測る。遅延の計測とは別に回す。"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for q in queries:
+            hints, st, ct, kw = _args(q, mode)
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            search.retrieve_candidates_batch([q["query"]], [hints], [st], [ct], [kw], top_k=TOP_K)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    kb = np.asarray(peaks, dtype=np.float64) / 1024
+    return {"mode": mode, "peak_kb_p50": round(float(np.median(kb)), 1), "peak_kb_max": round(float(kb.max()), 1)}
+
+
+def run_throughput(search, queries, repeat: int, mode: str = "no_hints") -> Dict[str, Any]:
+    args = [_args(q, mode) for q in queries]
+    texts = [q["query"] for q in queries]
+    t = time.perf_counter()
+    for _ in range(repeat):
+        for text, (h, st, ct, kw) in zip(texts, args):
+            search.retrieve_candidates_batch([text], [h], [st], [ct], [kw], top_k=TOP_K)
+    seq = time.perf_counter() - t
+    hints, st, ct, kw = (list(x) for x in zip(*args))
+    t = time.perf_counter()
+    for _ in range(repeat):
+        search.retrieve_candidates_batch(texts, hints, st, ct, kw, top_k=TOP_K)
+    batch = time.perf_counter() - t
+    n = len(queries) * repeat
+    return {"mode": mode, "sequential_qps": round(n / seq, 1), "batch_qps": round(n / batch, 1), "batch_size": len(queries)}
+
+
+def _config(store) -> Dict[str, Any]:
+    import search
+    import vector_index
+    import quantize
+    return {
+        "python": platform.python_version(),
+        "n_docs": len(store.docs),
+        "index_key": store.last_load.get("key"),
+        "embeddings": store.embeddings is not None,
+        "vector_index": vector_index.VECTOR_INDEX_KIND if store.embeddings is not None else None,
+        "embed_dtype": quantize.EMBED_DTYPE if store.embeddings is not None else None,
+        "fusion_depth": search.FUSION_DEPTH,
+        "graph_hops": search.GRAPH_HOPS,
+        "rrf_k": search.K,
+        "rrf_weights": list(search.RRF_WEIGHTS),
+        "hint_bonus": search.HINT_BONUS,
+        "edge_weights": [float(w) for w in search.EDGE_WEIGHTS],
+    }
+
+
+def run(queries, modes=MODES, repeat: int = 3) -> Dict[str, Any]:
+    from store import STORE
+    import search
+    t = time.perf_counter()
+    STORE.load()
+    load_ms = (time.perf_counter() - t) * 1000
+    snap = STORE.snapshot()
+    out: Dict[str, Any] = {"config": {**_config(STORE), "index_load_ms": round(load_ms, 1), "n_queries": len(queries)}}
+    # 1 周目は捨てる（トークナイザのキャッシュ・遅延 import を温める）
+    for q in queries:
+        search.retrieve_candidates_batch([q["query"]], *[[x] for x in _args(q, "router")], top_k=TOP_K)
+    out["modes"] = {m: run_mode(search, snap, queries, m, repeat) for m in modes}
+    out["alloc"] = run_alloc(search, queries)
+    out["throughput"] = run_throughput(search, queries, repeat)
+    return out
+
+
+def compare(cur: Dict[str, Any], base: Dict[str, Any], tol: float = 0.0) -> List[str]:
+    """基準と比べた表を出し、関連度が tol を超えて落ちた指標を返す。"""
+    regressions = []
+    print(f"{'mode':<9} {'metric':<10} {'base':>8} {'now':>8} {'delta':>8}", file=sys.stderr)
+    for m, res in cur["modes"].items():
+        b = base.get("modes", {}).get(m)
+        if not b:
+            continue
+        for metric, v in res["relevance"].items():
+            bv = b["relevance"].get(metric)
+            if bv is None:
+                continue
+            print(f"{m:<9} {metric:<10} {bv:>8.4f} {v:>8.4f} {v - bv:>+8.4f}", file=sys.stderr)
+            if v < bv - tol:
+                regressions.append(f"{m} {metric}: {bv:.4f} -> {v:.4f}")
+        bl, cl = b["latency_ms"]["total"]["p50"], res["latency_ms"]["total"]["p50"]
+        print(f"{m:<9} {'p50 ms':<10} {bl:>8.2f} {cl:>8.2f} {cl - bl:>+8.2f}", file=sys.stderr)
+    return regressions
+
+
+def _print_summary(res: Dict[str, Any]) -> None:
+    for m, r in res["modes"].items():
+        rel, lat = r["relevance"], r["latency_ms"]["total"]
+        print(f"{m:<9} " + " ".join(f"{k}={v:.3f}" for k, v in rel.items())
+              + f"  p50={lat['p50']:.2f}ms p90={lat['p90']:.2f}ms"
+              + (f"  routed={r['routed']}" if "routed" in r else ""), file=sys.stderr)
+    print(f"alloc {res['alloc']}  throughput {res['throughput']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="検索のベンチマーク（固定クエリ・LLM 出力はフィクスチャ）")
+    ap.add_argument("--queries", type=Path, default=QUERIES_PATH)
+    ap.add_argument("--modes", default=",".join(MODES), help="カンマ区切り: " + ",".join(MODES))
+    ap.add_argument("--repeat", type=int, default=3, help="遅延を測る回数（クエリごと）")
+    ap.add_argument("--out", type=Path, help="結果 JSON の保存先（省略時は標準出力）")
+    ap.add_argument("--compare", type=Path, help="基準の結果 JSON（bench/baseline.json など）")
+    ap.add_argument("--tolerance", type=float, default=0.0, help="関連度の低下をどこまで許すか")
+    ap.add_argument("--fail-on-regression", action="store_true")
+    args = ap.parse_args()
+
+    result = run(load_queries(args.queries), [m for m in args.modes.split(",") if m], args.repeat)
+    _print_summary(result)
+    text = json.dumps(result, ensure_ascii=False, indent=1)
+    if args.out:
+        args.out.write_text(text, encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        regressions = compare(result, json.loads(args.compare.read_text(encoding="utf-8")), args.tolerance)
+        for r in regressions:
+            print(f"[REGRESSION] {r}", file=sys.stderr)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
@@ -0,0 +1,195 @@
+# backend/bm25.py
+# 転置索引（CSR: 語 → (文書id, 寄与値)）による BM25。
+# rank_bm25.BM25Okapi と同じ式・同じ IDF 下限（epsilon * 平均IDF）でスコアを出すが、
+# クエリ語ごとに全文書を舐めず、該当語のポスティングだけを bincount で足し込む。
+# 語ごとの重みを直接受け取り、複数チャネルを 1 回の疎行列×ベクトルでまとめて採点できる。
+# 条文の改正（一部の文書だけ変わる）では update() で前回の索引のポスティング（語・文書・tf）を流用し、
+# 変わった文書だけ数え直す（IDF・平均文書長・寄与値は全体に掛かるので配列演算で引き直す）。
+from __future__ import annotations
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Sequence, Tuple
+
+import numpy as np
+
+K1, B, EPSILON = 1.5, 0.75, 0.25  # rank_bm25.BM25Okapi の既定値
+
+
+class SparseBM25:
+    def __init__(self, vocab: Dict[str, int], indptr, doc_ids, impacts, idf, doc_len, avgdl: float,
+                 k1: float = K1, b: float = B, epsilon: float = EPSILON, tf=None):
+        self.vocab = vocab              # 語 -> 語id
+        self.indptr = indptr            # int64[V+1]  語idごとのポスティング範囲
+        self.doc_ids = doc_ids          # int32[P]    ポスティングの文書id
+        self.impacts = impacts          # float32[P]  idf * tf(k1+1)/(tf + k1(1-b+b*dl/avgdl))
+        self.idf = idf                  # float32[V]
+        self.doc_len = doc_len          # int32[N]
+        self.tf = tf                    # int32[P]    ポスティングの語数（update() 用。古い索引には無い）
+        self.avgdl = avgdl
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.n_docs = len(doc_len)
+
+    # ---------- 構築 ----------
+    @classmethod
+    def build(cls, tokenized: Sequence[Sequence[str]], k1: float = K1, b: float = B, epsilon: float = EPSILON) -> "SparseBM25":
+        vocab: Dict[str, int] = {}
+        terms, docs, tfs = _count(tokenized, range(len(tokenized)), vocab)
+        return cls._from_postings(vocab, terms, docs, tfs, len(tokenized), _doc_len(tokenized), k1, b, epsilon)
+
+    @classmethod
+    def update(cls, prev: "SparseBM25", tokenized: Sequence[Sequence[str]], prev_rows,
+               k1: float = K1, b: float = B, epsilon: float = EPSILON) -> "SparseBM25":
+        """前回の索引からの差分構築。prev_rows[i] は新しい文書 i の前回の行番号（新規・変更は -1）。
+        残った文書のポスティングは前回の配列から行番号を付け替えて使い、数え直すのは -1 の文書だけ。
+        語id は前回のまま（消えた語は df=0 で残る。採点・IDF の下限には効かない）。build() と同じ点数になる。"""
+        if prev.tf is None:
+            return cls.build(tokenized, k1, b, epsilon)
+        prev_rows = np.asarray(prev_rows, dtype=np.int64)
+        new_row = np.full(prev.n_docs, -1, dtype=np.int64)
+        kept = np.flatnonzero(prev_rows >= 0)
+        new_row[prev_rows[kept]] = kept
+        old_terms = np.repeat(np.arange(len(prev.indptr) - 1, dtype=np.int64), np.diff(prev.indptr))
+        old_docs = new_row[prev.doc_ids]
+        keep = old_docs >= 0
+        vocab = dict(prev.vocab)
+        terms, docs, tfs = _count(tokenized, np.flatnonzero(prev_rows < 0), vocab)
+        return cls._from_postings(
+            vocab,
+            np.concatenate([old_terms[keep], terms]),
+            np.concatenate([old_docs[keep].astype(np.int32), docs]),
+            np.concatenate([np.asarray(prev.tf)[keep], tfs]),
+            len(tokenized), _doc_len(tokenized), k1, b, epsilon,
+        )
+
+    @classmethod
+    def _from_postings(cls, vocab: Dict[str, int], terms_a: np.ndarray, docs_a: np.ndarray, tf_a: np.ndarray,
+                       n: int, doc_len: np.ndarray, k1: float, b: float, epsilon: float) -> "SparseBM25":
+        v = len(vocab)
+        # 語id 順（安定ソート。build() は文書id 順に並べて渡すので語の中も文書id 順。update() は前回分が語id 順に
+        # 並んだまま先に来るのでほぼ整列済み。語の中の文書の並びは採点には効かない）
+        order = np.argsort(terms_a, kind="stable")
+        terms_a, docs_a, tf_a = terms_a[order], docs_a[order], tf_a[order]
+        df = np.bincount(terms_a, minlength=v)
+        indptr = np.zeros(v + 1, dtype=np.int64)
+        np.cumsum(df, out=indptr[1:])
+
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        live = df > 0
+        if live.any():
+            # 文書の半数超に出る語は IDF が負になるので、平均IDF の epsilon 倍で下支え（BM25Okapi と同じ）
+            idf = np.where(idf < 0, epsilon * idf[live].mean(), idf)
+        avgdl = float(doc_len.mean()) if n else 0.0
+        tf_f = tf_a.astype(np.float64)
+        norm = k1 * (1 - b + b * doc_len[docs_a] / avgdl) if n else np.zeros(0)
+        impacts = idf[terms_a] * (tf_f * (k1 + 1) / (tf_f + norm))
+        return cls(vocab, indptr, docs_a, impacts.astype(np.float32), idf.astype(np.float32),
+                   doc_len, avgdl, k1, b, epsilon, tf_a)
+
+    # ---------- 採点 ----------
+    def query_vector(self, weighted_terms: Mapping[str, float]) -> Tuple[np.ndarray, np.ndarray]:
+        """{語: 重み} を (語id配列, 重み配列) に。語彙外の語は捨てる。"""
+        ids, ws = [], []
+        for t, w in weighted_terms.items():
+            j = self.vocab.get(t)
+            if j is not None and w:
+                ids.append(j)
+                ws.append(w)
+        return np.asarray(ids, dtype=np.int64), np.asarray(ws, dtype=np.float64)
+
+    def score_many(self, channels: Sequence[Mapping[str, float]]) -> np.ndarray:
+        """チャネル（{語: 重み}）ごとの全文書スコアを (チャネル数, 文書数) で返す。"""
+        n, c = self.n_docs, len(channels)
+        if c == 0 or n == 0:
+            return np.zeros((c, n))
+        term_ids, weights, chan = [], [], []
+        for ci, terms in enumerate(channels):
+            ids, ws = self.query_vector(terms)
+            term_ids.append(ids)
+            weights.append(ws)
+            chan.append(np.full(len(ids), ci, dtype=np.int64))
+        term_ids = np.concatenate(term_ids)
+        weights = np.concatenate(weights)
+        chan = np.concatenate(chan)
+
+        # 各語のポスティング範囲 [indptr[t], indptr[t+1]) を一本の添字列に展開
+        starts = self.indptr[term_ids]
+        lengths = self.indptr[term_ids + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros((c, n))
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        pos = np.arange(total, dtype=np.int64) + offsets
+
+        rows = np.repeat(chan, lengths) * n + self.doc_ids[pos]
+        vals = self.impacts[pos] * np.repeat(weights, lengths)
+        return np.bincount(rows, weights=vals, minlength=c * n).reshape(c, n)
+
+    def score(self, weighted_terms: Mapping[str, float]) -> np.ndarray:
+        return self.score_many([weighted_terms])[0]
+
+    def get_scores(self, query: Iterable[str]) -> np.ndarray:
+        # rank_bm25 互換（トークン列。繰り返しはその回数だけ重みになる）
+        return self.score(Counter(query))
+
+    # ---------- 永続化 ----------
+    def save(self, d: Path) -> None:
+        np.save(d / "bm25_indptr.npy", self.indptr)
+        np.save(d / "bm25_doc_ids.npy", self.doc_ids)
+        np.save(d / "bm25_impacts.npy", self.impacts)
+        np.save(d / "bm25_idf.npy", self.idf)
+        np.save(d / "bm25_doc_len.npy", self.doc_len)
+        if self.tf is not None:
+            np.save(d / "bm25_tf.npy", self.tf)
+        terms = [""] * len(self.vocab)
+        for t, j in self.vocab.items():
+            terms[j] = t
+        meta = {"k1": self.k1, "b": self.b, "epsilon": self.epsilon, "avgdl": self.avgdl, "terms": terms}
+        (d / "bm25.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, d: Path) -> "SparseBM25":
+        meta = json.loads((d / "bm25.json").read_text(encoding="utf-8"))
+        arr = lambda name: np.load(d / name, mmap_mode="r")
+        vocab = {t: j for j, t in enumerate(meta["terms"])}
+        tf = arr("bm25_tf.npy") if (d / "bm25_tf.npy").exists() else None
+        return cls(vocab, arr("bm25_indptr.npy"), arr("bm25_doc_ids.npy"), arr("bm25_impacts.npy"),
+                   arr("bm25_idf.npy"), arr("bm25_doc_len.npy"), meta["avgdl"],
+                   meta["k1"], meta["b"], meta["epsilon"], tf)
+
+
+def _doc_len(tokenized: Sequence[Sequence[str]]) -> np.ndarray:
+    return np.fromiter((len(t) for t in tokenized), dtype=np.int32, count=len(tokenized))
+
+
+def _count(tokenized: Sequence[Sequence[str]], rows: Iterable[int], vocab: Dict[str, int]):
+    """rows の文書のポスティング (語id, 文書id, tf)。新しい語は vocab に足す。"""
+    terms: List[int] = []
+    docs: List[int] = []
+    tfs: List[int] = []
+    for d in rows:
+        for t, tf in Counter(tokenized[d]).items():
+            terms.append(vocab.setdefault(t, len(vocab)))
+            docs.append(d)
+            tfs.append(tf)
+    return np.asarray(terms, dtype=np.int64), np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.int32)
+
+
+def weighted_terms(*channels: Tuple[Iterable[str], float]) -> Dict[str, float]:
+    """[(トークン列, 重み), ...] を {語: 重みの合計} に。トークンを重み回数だけ繰り返すのと同値。"""
+    out: Dict[str, float] = {}
+    for tokens, w in channels:
+        if not w:
+            continue
+        for t in tokens:
+            out[t] = out.get(t, 0.0) + w
+    return out
+
+
+def topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """降順上位 k 件の添字（argpartition で O(n)、上位だけ並べ替え）"""
+    n = scores.shape[-1]
+    if k >= n:
+        return np.argsort(scores)[::-1]
+    part = np.argpartition(scores, n - k)[n - k:]
+    return part[np.argsort(scores[part])[::-1]]
@@ -0,0 +1,155 @@
+# backend/bulk_ingest.py
+# 複数法令をまとめて取り込む。
+#   取得 : 1 つの AsyncClient を共有し、同時実行数を制限して並列に取得（429/5xx/通信失敗は指数バックオフで再試行）
+#          生 XML は data/raw/<法令ID>.xml に保存し、ETag / Last-Modified で条件付き取得（304 ならキャッシュを使う）
+#   解析 : 法令ごとにプロセスプールで iterparse → 既存ファイルと差分 → data/ingested/<キー>_egov.json
+# 使い方:
+#   python bulk_ingest.py                          # LAWS の全法令
+#   python bulk_ingest.py civilcode landlease      # キーまたは法令ID を指定
+#   python bulk_ingest.py --fixtures tests/xml     # <法令ID>.xml を読むだけ（ネットワーク無し）
+#   EGOV_BASE_URL=http://127.0.0.1:8080 python bulk_ingest.py   # 手元の代用サーバ
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from ingest_egov import LAWS, ingest, ingested_path
+
+BASE_URL = os.getenv("EGOV_BASE_URL", "https://laws.e-gov.go.jp/api/1/lawdata")
+RAW_DIR = Path(os.getenv("EGOV_RAW_DIR") or Path(__file__).parent / "data" / "raw")
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def resolve_laws(names: List[str]) -> Dict[str, str]:
+    """キー（civilcode）でも法令ID（129AC0000000089）でも受け付け、{キー: 法令ID} にする。"""
+    if not names:
+        return dict(LAWS)
+    by_id = {v: k for k, v in LAWS.items()}
+    out = {}
+    for n in names:
+        if n in LAWS:
+            out[n] = LAWS[n]
+        elif n in by_id:
+            out[by_id[n]] = n
+        else:
+            # 未登録の法令ID はそのまま id 接頭辞にする
+            out[n] = n
+    return out
+
+
+def _meta_path(law_id: str) -> Path:
+    return RAW_DIR / f"{law_id}.meta.json"
+
+
+async def _fetch_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, law_key: str, law_id: str,
+                     retries: int) -> Dict[str, Any]:
+    xml_path = RAW_DIR / f"{law_id}.xml"
+    headers = {}
+    if xml_path.exists() and _meta_path(law_id).exists():
+        meta = json.loads(_meta_path(law_id).read_text(encoding="utf-8"))
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    res = {"law": law_key, "law_id": law_id, "path": str(xml_path)}
+    async with sem:
+        for attempt in range(retries + 1):
+            try:
+                r = await client.get(f"{BASE_URL}/{law_id}", headers=headers)
+                if r.status_code not in RETRY_STATUS:
+                    break
+                err = f"HTTP {r.status_code}"
+            except httpx.TransportError as e:
+                r, err = None, f"{type(e).__name__}: {e}"
+            if attempt == retries:
+                return {**res, "status": "failed", "error": err}
+            # 指数バックオフ＋ジッタ（Retry-After が秒数で来ればそれに従う）
+            ra = r.headers.get("Retry-After", "") if r is not None else ""
+            await asyncio.sleep(float(ra) if ra.isdigit() else 0.5 * 2 ** attempt * (0.5 + random.random()))
+    if r.status_code == 304:
+        return {**res, "status": "not_modified"}
+    if r.status_code >= 400:
+        return {**res, "status": "failed", "error": f"HTTP {r.status_code}"}
+    tmp = xml_path.with_suffix(f".xml.{os.getpid()}.tmp")
+    tmp.write_bytes(r.content)
+    os.replace(tmp, xml_path)
+    meta = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    _meta_path(law_id).write_text(json.dumps(meta), encoding="utf-8")
+    return {**res, "status": "fetched", "bytes": len(r.content)}
+
+
+async def fetch_all(laws: Dict[str, str], concurrency: int = 4, retries: int = 3, timeout: float = 60) -> List[Dict[str, Any]]:
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits, follow_redirects=True) as client:
+        return await asyncio.gather(*[_fetch_one(client, sem, k, i, retries) for k, i in laws.items()])
+
+
+def from_fixtures(laws: Dict[str, str], fixtures: Path) -> List[Dict[str, Any]]:
+    out = []
+    for k, i in laws.items():
+        p = fixtures / f"{i}.xml"
+        if not p.exists():
+            p = fixtures / f"{k}.xml"
+        status = "fixture" if p.exists() else "failed"
+        out.append({"law": k, "law_id": i, "path": str(p), "status": status,
+                    **({} if p.exists() else {"error": f"missing {p.name}"})})
+    return out
+
+
+def _parse_one(law_key: str, xml_path: str) -> Dict[str, Any]:
+    # プロセスプールの中で動く（iterparse → 差分 → 保存）
+    # 1 法令の失敗（e-Gov のエラー応答・壊れた XML）で他の法令の結果まで捨てないよう、例外はここで結果にする
+    try:
+        return {"diff": ingest(Path(xml_path), ingested_path(law_key), law_key)}
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+
+
+def parse_all(fetched: List[Dict[str, Any]], workers: Optional[int] = None, force: bool = False) -> List[Dict[str, Any]]:
+    """取得できた法令を解析する。not_modified は取り込みファイルがあれば飛ばす（force で再解析）。"""
+    todo = [f for f in fetched if f["status"] in ("fetched", "fixture")
+            or (f["status"] == "not_modified" and (force or not ingested_path(f["law"]).exists()))]
+    workers = workers if workers is not None else min(len(todo), os.cpu_count() or 1)
+    if workers <= 1:
+        parsed = [_parse_one(f["law"], f["path"]) for f in todo]
+    else:
+        # サーバのスレッドから呼ばれても安全なように spawn で起こす
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+            parsed = list(ex.map(_parse_one, [f["law"] for f in todo], [f["path"] for f in todo]))
+    for f, p in zip(todo, parsed):
+        f.update(p)
+    return fetched
+
+
+def bulk_ingest(names: List[str] | None = None, fixtures: Optional[Path] = None, concurrency: int = 4,
+                retries: int = 3, workers: Optional[int] = None, force: bool = False) -> Dict[str, Any]:
+    laws = resolve_laws(list(names or []))
+    fetched = from_fixtures(laws, fixtures) if fixtures else asyncio.run(fetch_all(laws, concurrency, retries))
+    results = parse_all(fetched, workers, force)
+    # 解析に失敗した法令があっても、書き換わった法令があれば再ロードさせる（ファイルと索引をずらさない）
+    written = any(r.get("diff", {}).get("written") for r in results if r["status"] != "failed")
+    return {"laws": results, "written": written}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="e-Gov から複数法令をまとめて取り込む")
+    ap.add_argument("laws", nargs="*", help="法令キー（civilcode 等）または法令ID。省略時は全法令")
+    ap.add_argument("--fixtures", type=Path, help="<法令ID>.xml を置いたディレクトリ（取得しない）")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--retries", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=None, help="解析プロセス数（1 で同一プロセス）")
+    ap.add_argument("--force", action="store_true", help="304 でも解析し直す")
+    args = ap.parse_args()
+    out = bulk_ingest(args.laws, args.fixtures, args.concurrency, args.retries, args.workers, args.force)
+    for r in out["laws"]:
+        print(f"{r['law']:<18} {r['law_id']}  {r['status']:<12} {r.get('diff') or r.get('error') or ''}")
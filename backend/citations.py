@@ -0,0 +1,118 @@
+# backend/citations.py
+# 回答本文から引用された条文を拾い、検索候補（hits）の id に対応付ける（llm_pick_used_articles の置き換え）。
+# ANSWER_SYSTEM で「第七百九条（不法行為による損害賠償）」の形の出典を必須にしているので、
+#   条番号（第七百九条 / 709条 / 第三百九十八条の二 / 第X条から第Y条まで） → article_code（article_num）
+#   括弧内の条見出し（（不法行為による損害賠償）） → article_index
+# で引き、候補に同じ (法令, 条番号) があればその id を本文に現れた順に返す。
+# 直前に法令名があればその法令の条だけ（「借地借家法第十条」）。候補に無い法令（「民事執行法第百五十一条」など）は拾わない。
+# 環境変数:
+#   RAG_CITATION_FALLBACK=empty   本文から 1 件も拾えなかった時だけ LLM に選ばせる（既定）
+#                        =off     LLM は使わない
+#                        =always  従来どおり常に LLM に選ばせる
+from __future__ import annotations
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from article_num import article_code, parse_article
+from llm import llm_pick_used_articles, llm_pick_used_articles_async
+from metrics import timed
+from store import STORE, law_key
+
+CITATION_FALLBACK = os.getenv("RAG_CITATION_FALLBACK", "empty").lower()
+
+_NUM_CHARS = "0-9０-９〇一二三四五六七八九十百千"
+_ART = rf"第?[{_NUM_CHARS}]+条(?![件理約例])(?:の[{_NUM_CHARS}]+)*"   # 「3条件」「条約」は条番号ではない
+_CITE_RE = re.compile(rf"({_ART})(?:から({_ART})まで)?")
+_CAPTION_RE = re.compile(r"[（(]([^（）()\n]{2,40})[）)]")
+_OTHER_LAW = ("法", "令", "則")   # 直前がこれで候補の法令名でもなければ他法令の条（crossref と同じ判定）
+DEFAULT_LAW = "civilcode"          # 法令名が付いていない条番号は、候補にあれば民法を優先
+MAX_RANGE = 30
+
+
+def _code(s: str) -> int:
+    nums = parse_article(s)
+    return article_code(nums) if nums else -1
+
+
+def _law_before(answer: str, pos: int, titles: Dict[str, str]) -> Tuple[bool, Optional[str]]:
+    """(拾ってよいか, 法令キー)。法令名が無ければ (True, None)。"""
+    head = answer[max(0, pos - 20):pos]
+    for title, law in titles.items():
+        if head.endswith(title):
+            return True, law
+    return not head.endswith(_OTHER_LAW), None
+
+
+@timed("citations")
+def extract_citations(answer: str, hits: List[Dict[str, Any]], snap=None) -> List[str]:
+    """answer の中で引用されている条文の、hits 内の id（本文に現れた順・重複なし）。"""
+    if not answer or not hits:
+        return []
+    snap = snap or STORE.snapshot()
+    by_key: Dict[Tuple[str, int], str] = {}
+    codes_by_law: Dict[str, List[int]] = {}
+    titles: Dict[str, str] = {}
+    for h in hits:
+        law, code = law_key(h), h.get("article_code", -1)
+        if code is None or code < 0:
+            continue
+        by_key.setdefault((law, code), h["id"])
+        codes_by_law.setdefault(law, []).append(code)
+        if h.get("title"):
+            titles.setdefault(h["title"], law)
+
+    def resolve(law: Optional[str], code: int) -> Optional[str]:
+        if law is not None:
+            return by_key.get((law, code))
+        return by_key.get((DEFAULT_LAW, code)) or next((by_key[(l, code)] for l in codes_by_law if (l, code) in by_key), None)
+
+    found: List[Tuple[int, str]] = []
+    for m in _CITE_RE.finditer(answer):
+        ok, law = _law_before(answer, m.start(), titles)
+        if not ok:
+            continue
+        lo = _code(m.group(1))
+        hi = _code(m.group(2)) if m.group(2) else lo
+        if lo < 0:
+            continue
+        if hi > lo:
+            # 範囲は候補に入っている条だけ（上限つき）
+            laws = [law] if law is not None else list(codes_by_law)
+            inside = sorted({c for l in laws for c in codes_by_law.get(l, ()) if lo <= c <= hi})[:MAX_RANGE]
+        else:
+            inside = [lo]
+        for c in inside:
+            i = resolve(law, c)
+            if i is not None:
+                found.append((m.start(), i))
+
+    # 条番号を書き違えても見出しが合っていれば拾う（「第七百十条（不法行為による損害賠償）」など）
+    for m in _CAPTION_RE.finditer(answer):
+        cap = m.group(1).strip()
+        for law in codes_by_law:
+            row = snap.article_index.get(law, {}).get(cap)
+            i = by_key.get((law, int(snap.article_codes[row]))) if row is not None else None
+            if i is not None:
+                found.append((m.start(), i))
+
+    found.sort(key=lambda x: x[0])
+    return list(dict.fromkeys(i for _, i in found))
+
+
+def pick_used_articles(answer: str, hits: List[Dict[str, Any]]) -> List[str]:
+    if CITATION_FALLBACK == "always":
+        return llm_pick_used_articles(answer, hits)
+    ids = extract_citations(answer, hits)
+    if not ids and CITATION_FALLBACK == "empty":
+        return llm_pick_used_articles(answer, hits)
+    return ids
+
+
+async def pick_used_articles_async(answer: str, hits: List[Dict[str, Any]]) -> List[str]:
+    if CITATION_FALLBACK == "always":
+        return await llm_pick_used_articles_async(answer, hits)
+    ids = extract_citations(answer, hits)
+    if not ids and CITATION_FALLBACK == "empty":
+        return await llm_pick_used_articles_async(answer, hits)
+    return ids
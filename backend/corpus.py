@@ -0,0 +1,160 @@
+# backend/corpus.py
+# 条文コーパスの列指向フォーマット。索引ディレクトリに置き、mmap で開く。
+#   文字列列 : 列ごとに UTF-8 を連結したバッファ（corpus_<列>.npy, uint8）＋ 開始位置（corpus_<列>_off.npy, int64[N+1]）
+#   数値列   : article_num int32 / article_code int64（無しは -1）/ law int16（法令キー表の添字）
+#   その他   : path・paragraphs・suppl など取り込み時の付帯情報は 1 文書 1 JSON の文字列列（extra）
+# 取り出しは DocRecord（__slots__ の軽いビュー）で、触ったフィールドだけ復号する。
+from __future__ import annotations
+import json
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from article_num import article_caption
+
+STR_FIELDS = ("id", "title", "article", "article_label", "text", "hash")
+INT_FIELDS = ("article_num", "article_code")
+# 検索結果などに載せる基本フィールド（extra は含めない）
+CORE_FIELDS = STR_FIELDS[:5] + INT_FIELDS
+
+
+class Corpus(Sequence):
+    def __init__(self, strings: Dict[str, tuple], ints: Dict[str, np.ndarray], law: np.ndarray, laws: List[str]):
+        self._strings = strings   # 列名 -> (uint8 バッファ, int64 開始位置)
+        self._ints = ints
+        self.law = law            # int16[N] 法令キー表の添字
+        self.laws = laws          # 法令キー（"civilcode" など）
+        self._n = len(law)
+
+    # ---------- 構築 ----------
+    @classmethod
+    def from_docs(cls, docs: Sequence[Dict[str, Any]], hashes: Optional[List[str]] = None) -> "Corpus":
+        n = len(docs)
+        cols: Dict[str, List[str]] = {f: [] for f in STR_FIELDS + ("caption", "extra")}
+        ints = {f: np.full(n, -1, dtype=np.int32 if f == "article_num" else np.int64) for f in INT_FIELDS}
+        laws: Dict[str, int] = {}
+        law = np.zeros(n, dtype=np.int16)
+        for i, d in enumerate(docs):
+            for f in STR_FIELDS:
+                cols[f].append(str(d.get(f) or ""))
+            if hashes is not None:
+                cols["hash"][i] = hashes[i]
+            cols["caption"].append(article_caption(d))
+            extra = {k: v for k, v in d.items() if k not in STR_FIELDS and k not in INT_FIELDS}
+            cols["extra"].append(json.dumps(extra, ensure_ascii=False, separators=(",", ":")) if extra else "")
+            for f in INT_FIELDS:
+                if d.get(f) is not None:
+                    ints[f][i] = int(d[f])
+            law[i] = laws.setdefault(str(d.get("id", "")).split(":", 1)[0], len(laws))
+        strings = {}
+        for f, vals in cols.items():
+            enc = [v.encode("utf-8") for v in vals]
+            off = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in enc], out=off[1:])
+            strings[f] = (np.frombuffer(b"".join(enc), dtype=np.uint8), off)
+        return cls(strings, ints, law, list(laws))
+
+    # ---------- 永続化 ----------
+    def save(self, d: Path) -> None:
+        for f, (buf, off) in self._strings.items():
+            np.save(d / f"corpus_{f}.npy", buf)
+            np.save(d / f"corpus_{f}_off.npy", off)
+        for f, arr in self._ints.items():
+            np.save(d / f"corpus_{f}.npy", arr)
+        np.save(d / "corpus_law.npy", self.law)
+        (d / "corpus.json").write_text(json.dumps({"n": self._n, "laws": self.laws}, ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, d: Path) -> "Corpus":
+        meta = json.loads((d / "corpus.json").read_text(encoding="utf-8"))
+        arr = lambda name: np.load(d / name, mmap_mode="r")
+        strings = {f: (arr(f"corpus_{f}.npy"), np.asarray(arr(f"corpus_{f}_off.npy")))
+                   for f in STR_FIELDS + ("caption", "extra")}
+        ints = {f: arr(f"corpus_{f}.npy") for f in INT_FIELDS}
+        corpus = cls(strings, ints, np.asarray(arr("corpus_law.npy")), meta["laws"])
+        if len(corpus) != meta["n"]:
+            raise ValueError("corpus size mismatch")
+        return corpus
+
+    # ---------- 参照 ----------
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [DocRecord(self, j) for j in range(*i.indices(self._n))]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return DocRecord(self, int(i))
+
+    def __iter__(self) -> Iterator["DocRecord"]:
+        return (DocRecord(self, i) for i in range(self._n))
+
+    def str_at(self, field: str, i: int) -> str:
+        buf, off = self._strings[field]
+        return bytes(buf[off[i]:off[i + 1]]).decode("utf-8")
+
+    def column(self, field: str) -> List[str]:
+        """文字列列を丸ごと復号（埋め込み作成や差分照合など、全件が要る時だけ）"""
+        buf, off = self._strings[field]
+        raw = bytes(buf)
+        return [raw[off[i]:off[i + 1]].decode("utf-8") for i in range(self._n)]
+
+    def int_column(self, field: str) -> np.ndarray:
+        return self._ints[field]
+
+    def extra(self, i: int) -> Dict[str, Any]:
+        s = self.str_at("extra", i)
+        return json.loads(s) if s else {}
+
+
+class DocRecord(Mapping):
+    """Corpus の 1 行への読み取り専用ビュー。dict と同じく d["text"] / d.get("article_code") で引ける。"""
+    __slots__ = ("_c", "_i")
+
+    def __init__(self, corpus: Corpus, i: int):
+        self._c = corpus
+        self._i = i
+
+    def __getitem__(self, key: str):
+        c, i = self._c, self._i
+        if key in STR_FIELDS:
+            return c.str_at(key, i)
+        if key in INT_FIELDS:
+            v = int(c.int_column(key)[i])
+            return v if v >= 0 else None
+        extra = c.extra(i)
+        if key in extra:
+            return extra[key]
+        raise KeyError(key)
+
+    def _keys(self) -> List[str]:
+        return list(CORE_FIELDS) + ["hash"] + list(self._c.extra(self._i))
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def to_dict(self, full: bool = True) -> Dict[str, Any]:
+        """JSON で返す用の dict。full=False なら基本フィールドだけ（検索結果用。付帯情報の JSON は復号しない）"""
+        c, i = self._c, self._i
+        out: Dict[str, Any] = {f: c.str_at(f, i) for f in STR_FIELDS[:5]}
+        for f in INT_FIELDS:
+            v = int(c.int_column(f)[i])
+            out[f] = v if v >= 0 else None
+        if full:
+            out["hash"] = c.str_at("hash", i)
+            out.update(c.extra(i))
+        return out
+
+    def copy(self) -> Dict[str, Any]:
+        return self.to_dict()
+
+    def __repr__(self) -> str:
+        return f"DocRecord({self._c.str_at('id', self._i)!r})"
@@ -0,0 +1,138 @@
+# backend/crossref.py
+# 条文どうしの参照グラフ。本文の「前条」「前二条」「次条」「第五百四十一条の規定」「第X条から第Y条まで」
+# （準用規定も同じ書き方）を拾い、同じ法令の条文への有向辺にする。
+# 「民事執行法第百五十一条」「同法第…」のような他法令の条は張らない（コーパスに無いことが多く、あっても別物）。
+# 隣接は CSR（indptr / indices / kind）。索引には本文から拾った辺だけ保存し、
+# 逆向きの辺と手で張った辺（store.PAIR_BONUS）は読み込み時に with_edges で足す。
+from __future__ import annotations
+import re
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+from article_num import article_code, kanji_to_int, parse_article
+
+# 辺の種類（search の EDGE_WEIGHTS の添字）
+REF, BACKREF, PAIR = 0, 1, 2
+_NUM_CHARS = "0-9０-９〇一二三四五六七八九十百千"
+MAX_RANGE = 30   # 「第X条から第Y条まで」で張る上限（削除条の一括表記などで辺が膨らまないように）
+
+_REF_RE = re.compile(
+    rf"前([{_NUM_CHARS}]*)条|次条"
+    rf"|第([{_NUM_CHARS}]+条(?:の[{_NUM_CHARS}]+)*)(?:から第([{_NUM_CHARS}]+条(?:の[{_NUM_CHARS}]+)*)まで)?"
+)
+_OTHER_LAW = ("法", "令", "則")   # 直前がこれなら他法令（「同法」、附則・規則を含む）の条
+
+
+def _code(s: str) -> int:
+    nums = parse_article(s)
+    return article_code(nums) if nums else -1
+
+
+def extract_refs(text: str, own: int, codes: np.ndarray) -> np.ndarray:
+    """1 条分の本文から参照先の article_code を返す。codes はその法令の article_code（昇順・重複なし）。"""
+    out = []
+    pos = int(np.searchsorted(codes, own)) if own >= 0 else -1
+    for m in _REF_RE.finditer(text):
+        tok = m.group(0)
+        if tok.startswith("前") or tok == "次条":
+            if pos < 0:
+                continue
+            if tok == "次条":
+                out.extend(codes[pos + 1:pos + 2])
+            else:
+                k = kanji_to_int(m.group(1)) if m.group(1) else 1
+                out.extend(codes[max(pos - (k or 1), 0):pos])
+            continue
+        if text[:m.start()].endswith(_OTHER_LAW):
+            continue
+        lo = _code(m.group(2))
+        if lo < 0:
+            continue
+        if m.group(3):
+            hi = _code(m.group(3))
+            if hi >= lo:
+                i, j = np.searchsorted(codes, lo, side="left"), np.searchsorted(codes, hi, side="right")
+                out.extend(codes[i:min(j, i + MAX_RANGE)])
+                continue
+        out.append(lo)
+    return np.asarray([c for c in dict.fromkeys(out) if c != own], dtype=np.int64)
+
+
+class RefGraph:
+    def __init__(self, n: int, indptr: np.ndarray, indices: np.ndarray, kind: np.ndarray):
+        self.n = n
+        self.indptr = indptr      # int64[n+1]  文書 i の辺は indices[indptr[i]:indptr[i+1]]
+        self.indices = indices    # int64[nnz]  参照先の文書
+        self.kind = kind          # int8[nnz]   REF / BACKREF / PAIR
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, n: int, src, dst, kind) -> "RefGraph":
+        src, dst, kind = (np.asarray(a, dtype=t) for a, t in ((src, np.int64), (dst, np.int64), (kind, np.int8)))
+        keep = src != dst
+        src, dst, kind = src[keep], dst[keep], kind[keep]
+        order = np.lexsort((kind, dst, src))
+        src, dst, kind = src[order], dst[order], kind[order]
+        # 同じ (元, 先, 種類) の重複は 1 本に
+        uniq = np.ones(len(src), dtype=bool)
+        uniq[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1]) | (kind[1:] != kind[:-1])
+        src, dst, kind = src[uniq], dst[uniq], kind[uniq]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(n, indptr, dst, kind)
+
+    @classmethod
+    def build(cls, corpus, article_sorted: Dict[str, Tuple[np.ndarray, np.ndarray]]) -> "RefGraph":
+        """コーパスの本文から参照辺（REF）を拾う。article_sorted は IndexSnapshot.article_sorted（法令ごとの昇順コードと添字）。"""
+        codes = np.asarray(corpus.int_column("article_code"), dtype=np.int64)
+        uniq = {law: np.unique(c) for law, (c, _) in article_sorted.items()}
+        src, dst = [], []
+        for i, text in enumerate(corpus.column("text")):
+            law = corpus.laws[corpus.law[i]]
+            if law not in article_sorted:
+                continue
+            sorted_codes, order = article_sorted[law]
+            for c in extract_refs(text, int(codes[i]), uniq[law]):
+                lo, hi = np.searchsorted(sorted_codes, [c, c + 1])
+                dst.extend(order[lo:hi].tolist())
+                src.extend([i] * int(hi - lo))
+        return cls.from_edges(len(corpus), src, dst, np.full(len(src), REF))
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        src = np.repeat(np.arange(self.n, dtype=np.int64), np.diff(self.indptr))
+        return src, np.asarray(self.indices), np.asarray(self.kind)
+
+    def with_edges(self, pair_src=(), pair_dst=()) -> "RefGraph":
+        """逆向き（参照されている条 → 参照している条, BACKREF）と手で張った辺（PAIR）を足したグラフ。"""
+        src, dst, kind = self.edges()
+        ref = kind == REF
+        return RefGraph.from_edges(
+            self.n,
+            np.concatenate([src, dst[ref], np.asarray(pair_src, dtype=np.int64)]),
+            np.concatenate([dst, src[ref], np.asarray(pair_dst, dtype=np.int64)]),
+            np.concatenate([kind, np.full(int(ref.sum()), BACKREF), np.full(len(pair_src), PAIR)]),
+        )
+
+    def gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """rows の各文書から出る辺を一括で。(rows 内の位置, 行き先, 種類)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lens = self.indptr[rows + 1] - starts
+        pos = np.repeat(starts - np.cumsum(lens) + lens, lens) + np.arange(lens.sum())
+        return np.repeat(np.arange(len(rows)), lens), self.indices[pos], self.kind[pos]
+
+    def save(self, d: Path) -> None:
+        np.save(d / "graph_indptr.npy", self.indptr)
+        np.save(d / "graph_indices.npy", self.indices)
+        np.save(d / "graph_kind.npy", self.kind)
+
+    @classmethod
+    def load(cls, d: Path) -> "RefGraph":
+        arr = lambda name: np.load(d / name, mmap_mode="r")
+        indptr = arr("graph_indptr.npy")
+        return cls(len(indptr) - 1, indptr, arr("graph_indices.npy"), arr("graph_kind.npy"))
@@ -1,5 +1,4 @@
 from __future__ import annotations
-from sentence_transformers import SentenceTransformer
 import numpy as np
 from functools import lru_cache
 
@@ -7,9 +6,11 @@ MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
 @lru_cache(maxsize=1)
 def _load_model():
+    # torch を引くので import は実際に使う時まで遅らせる（索引キャッシュ命中時は不要）
+    from sentence_transformers import SentenceTransformer
     return SentenceTransformer(MODEL_NAME)
 
 def embed(texts: list[str]) -> np.ndarray:
     model = _load_model()
     vecs = model.encode(texts, normalize_embeddings=True, show_progress_bar=False)
-    return np.asarray(vecs)
\ No newline at end of file
+    return np.asarray(vecs, dtype=np.float32)
@@ -0,0 +1,230 @@
+# backend/index_cache.py
+# DocStore の索引（列指向コーパス / トークン列 / BM25 転置索引 / 条文の参照グラフ / 埋め込み行列）をディスクに永続化する。
+# コーパスの内容ハッシュ＋モデル/トークナイザのバージョンをキーにし、
+# キーが変わった時だけ再構築する。BM25 の配列と埋め込みは .npy を mmap で開くので
+# 複数の uvicorn ワーカーが同じページキャッシュを共有できる。
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bm25 import SparseBM25
+from corpus import Corpus
+from crossref import RefGraph
+from embeddings import MODEL_NAME
+from jp_tokenize import TOKENIZER_VERSION
+import vector_index
+from quantize import EMBED_DTYPE, QuantizedMatrix
+
+INDEX_DIR = Path(os.getenv("RAG_INDEX_DIR") or Path(__file__).parent / "data" / "index")
+INDEX_VERSION = 5   # 保存形式を変えたら上げる
+KEEP_ARTIFACTS = 2  # 古い索引は直近これだけ残す
+
+
+def corpus_key(paths: List[Path]) -> str:
+    h = hashlib.sha256()
+    h.update(f"index-v{INDEX_VERSION}|{TOKENIZER_VERSION}|{MODEL_NAME}".encode("utf-8"))
+    for p in paths:
+        h.update(p.name.encode("utf-8"))
+        h.update(p.read_bytes())
+    return h.hexdigest()[:20]
+
+
+def _artifact_dir(key: str) -> Path:
+    return INDEX_DIR / key
+
+
+def load_index(key: str) -> Optional[Dict[str, Any]]:
+    """キーに一致する索引があれば返す。無い/壊れている場合は None。
+    コーパス（corpus.py）・BM25・埋め込みは mmap で開くだけ。トークン列は差分再構築の時だけ load_tokens で読む。
+    """
+    d = _artifact_dir(key)
+    try:
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+        corpus = Corpus.load(d)
+        bm25 = SparseBM25.load(d)
+        graph = RefGraph.load(d)
+    except (OSError, ValueError, KeyError):
+        return None
+    if meta.get("key") != key or len(corpus) != meta.get("n_docs") or bm25.n_docs != len(corpus) or graph.n != len(corpus):
+        return None
+    emb = None
+    emb_path = d / "embeddings.npy"
+    if emb_path.exists():
+        try:
+            emb = np.load(emb_path, mmap_mode="r")
+        except (OSError, ValueError):
+            emb = None
+    return {"corpus": corpus, "bm25": bm25, "graph": graph, "embeddings": emb, "meta": meta}
+
+
+def load_tokens(key: str) -> List[List[str]]:
+    return json.loads((_artifact_dir(key) / "tokens.json").read_text(encoding="utf-8"))
+
+
+def load_latest_index(exclude: str) -> Optional[Dict[str, Any]]:
+    """直近に作られた別キーの索引（差分再構築でトークン・埋め込みを流用する元）。"""
+    if not INDEX_DIR.exists():
+        return None
+    arts = [p for p in INDEX_DIR.iterdir() if p.is_dir() and not p.name.startswith(".") and p.name != exclude]
+    for p in sorted(arts, key=lambda p: p.stat().st_mtime, reverse=True):
+        prev = load_index(p.name)
+        if prev is not None:
+            prev["key"] = p.name
+            return prev
+    return None
+
+
+def save_index(key: str, corpus: Corpus, tokens: List[List[str]], bm25: SparseBM25, graph: RefGraph, embeddings=None) -> None:
+    """一時ディレクトリに書いてから rename で公開する（同時起動したワーカー同士で壊さない）。"""
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    final = _artifact_dir(key)
+    if final.exists():
+        if embeddings is not None and not (final / "embeddings.npy").exists():
+            save_embeddings(key, embeddings)
+        return
+    tmp = INDEX_DIR / f".tmp-{key}-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    corpus.save(tmp)
+    (tmp / "tokens.json").write_text(json.dumps(tokens, ensure_ascii=False), encoding="utf-8")
+    bm25.save(tmp)
+    graph.save(tmp)
+    if embeddings is not None:
+        np.save(tmp / "embeddings.npy", np.ascontiguousarray(embeddings, dtype=np.float32))
+    meta = {
+        "key": key,
+        "version": INDEX_VERSION,
+        "tokenizer": TOKENIZER_VERSION,
+        "model": MODEL_NAME,
+        "n_docs": len(corpus),
+    }
+    # meta.json は最後に書く（これが揃っていれば完成品とみなす）
+    (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    try:
+        os.rename(tmp, final)
+    except OSError:
+        # 他のワーカーが先に書き終えた
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    _prune(keep=key)
+
+
+def save_embeddings(key: str, embeddings) -> None:
+    """埋め込み無しで作られた索引に、後から埋め込みだけ追加する。"""
+    d = _artifact_dir(key)
+    tmp = d / f".embeddings-{os.getpid()}.npy"
+    np.save(tmp, np.ascontiguousarray(embeddings, dtype=np.float32))
+    os.replace(tmp, d / "embeddings.npy")
+
+
+def load_or_embed(name: str, texts: List[str]) -> np.ndarray:
+    """索引とは別の小さな埋め込み（ルータの例文など）。モデル名と本文のハッシュを名前に入れて INDEX_DIR/<name>-<hash>.npy に置き、
+    起動のたびに埋め込み直さない。書けなければ作ったものをそのまま返す。"""
+    h = hashlib.sha256(MODEL_NAME.encode("utf-8"))
+    for t in texts:
+        h.update(b"\0" + t.encode("utf-8"))
+    path = INDEX_DIR / f"{name}-{h.hexdigest()[:16]}.npy"
+    try:
+        vecs = np.load(path)
+        if len(vecs) == len(texts):
+            return vecs
+    except (OSError, ValueError):
+        pass
+    from embeddings import embed
+    vecs = np.ascontiguousarray(embed(texts), dtype=np.float32)
+    try:
+        INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = INDEX_DIR / f".{name}-{os.getpid()}.npy"
+        np.save(tmp, vecs)
+        os.replace(tmp, path)
+        for old in INDEX_DIR.glob(f"{name}-*.npy"):
+            if old != path:
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return vecs
+
+
+def load_quantized(key: str, embeddings, kind: str = EMBED_DTYPE) -> Optional[QuantizedMatrix]:
+    """圧縮した埋め込みを開く（mmap）。無ければ作って索引ディレクトリに追加する。float32 指定なら None。"""
+    if kind == "float32":
+        return None
+    d = _artifact_dir(key)
+    qm = QuantizedMatrix.load(d, kind) if d.exists() else None
+    if qm is not None and len(qm) == len(embeddings):
+        return qm
+    qm = QuantizedMatrix.from_float(embeddings, kind)
+    if d.exists():
+        tmp = d / f".quantized-{os.getpid()}"
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            tmp.mkdir()
+            qm.save(tmp)
+            for p in tmp.iterdir():
+                os.replace(p, d / p.name)
+            return QuantizedMatrix.load(d, kind) or qm
+        except OSError:
+            pass
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return qm
+
+
+def load_embeddings(key: str):
+    """保存済みの float32 埋め込みを mmap で開き直す（新規に埋め込んだ行列をプロセスに抱えないため）。"""
+    try:
+        return np.load(_artifact_dir(key) / "embeddings.npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+
+def load_vector_index(key: str, embeddings, kind: str = vector_index.VECTOR_INDEX_KIND, quantized=None, prev=None):
+    """索引ディレクトリ内の近似ベクトル索引を開く。無ければ作って保存する（exact は保存物なし）。
+    prev=(前回のキー, 新しい行→前回の行 の配列) を渡すと、IVF は前回のリスト割り当てを引き継ぎ新しい行だけ振り分ける。
+    """
+    if kind == "exact":
+        return vector_index.build_index(embeddings, kind, quantized)
+    d = _artifact_dir(key) / vector_index.index_tag(kind, len(embeddings))
+    index = vector_index.load_index(d, embeddings, kind, quantized) if d.exists() else None
+    if index is not None:
+        return index
+    index = None
+    if prev is not None and kind == "ivf":
+        prev_key, prev_rows = prev
+        pd = _artifact_dir(prev_key)
+        tags = sorted(pd.glob("vector-ivf-*")) if pd.exists() else []
+        if tags:
+            try:
+                # リスト数が既定（√N）から少しずれても、差分更新の間は前回のセントロイドを使い続ける
+                old = vector_index.IVFIndex.load(tags[0], None, nprobe=vector_index.ivf_nprobe())
+                index = old.remap(quantized if quantized is not None else embeddings, prev_rows)
+            except (OSError, ValueError):
+                index = None
+    if index is None:
+        index = vector_index.build_index(embeddings, kind, quantized)
+    if index.exact or not _artifact_dir(key).exists():
+        return index
+    tmp = _artifact_dir(key) / f".{d.name}-{os.getpid()}"
+    try:
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        vector_index.save_index(index, tmp, len(embeddings))
+        os.rename(tmp, d)
+    except OSError:
+        # 他のワーカーが先に書いた／書けない。作ったものはそのまま使う
+        shutil.rmtree(tmp, ignore_errors=True)
+    return index
+
+
+def _prune(keep: str) -> None:
+    arts = [p for p in INDEX_DIR.iterdir() if p.is_dir() and not p.name.startswith(".")]
+    arts.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for p in arts[KEEP_ARTIFACTS:]:
+        if p.name != keep:
+            shutil.rmtree(p, ignore_errors=True)
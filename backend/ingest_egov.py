@@ -2,16 +2,33 @@ from __future__ import annotations
 import httpx
 from lxml import etree
 from pathlib import Path
+import hashlib
+import io
+import os
 import json
+from typing import Any, Dict, Iterator, List, Tuple
 from urllib.parse import quote
+from article_num import parse_article_title, article_code
 
-DATA_DIR = Path(__file__).parent / "data" / "ingested"
+DATA_DIR = Path(os.getenv("RAG_INGESTED_DIR") or Path(__file__).parent / "data" / "ingested")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # 民法: 法令ID 129AC0000000089
 LAW_ID = "129AC0000000089"
 ENDPOINT = f"https://laws.e-gov.go.jp/api/1/lawdata/{LAW_ID}"
 
+# 取り込み対象の法令。キーは文書 id の接頭辞（"civilcode:第七百九条"）と取り込みファイル名に使う
+LAWS = {
+    "civilcode": "129AC0000000089",         # 民法
+    "commercialcode": "132AC0000000048",    # 商法
+    "landlease": "403AC0000000090",         # 借地借家法
+    "consumercontract": "412AC0000000061",  # 消費者契約法
+}
+
+
+def ingested_path(law_key: str) -> Path:
+    return DATA_DIR / f"{law_key}_egov.json"
+
 
 def fetch_civil_code_xml() -> bytes:
     with httpx.Client(timeout=60) as client:
@@ -20,135 +37,191 @@ def fetch_civil_code_xml() -> bytes:
         return r.content
 
 
-def parse_law_xml(xml_bytes: bytes):
-    root = etree.fromstring(xml_bytes)
-    # 既定名前空間のURI（ある場合）
-    ns_uri = root.nsmap.get(None)
+def content_hash(doc: Dict[str, Any]) -> str:
+    # 索引に効く中身（法令名・条・本文）だけのハッシュ。差分取り込みと索引の再利用に使う
+    raw = "\x1f".join([str(doc.get("title", "")), str(doc.get("article", "")), str(doc.get("text", ""))])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+# 編・章・節・款・目（条の所在）。e-Gov の要素名 → 見出しの要素名
+_CONTAINERS = {
+    "Part": "PartTitle",
+    "Chapter": "ChapterTitle",
+    "Section": "SectionTitle",
+    "Subsection": "SubsectionTitle",
+    "Division": "DivisionTitle",
+}
+_TITLES = {v: k for k, v in _CONTAINERS.items()}
+
+
+def _local(el) -> str:
+    # 名前空間付きでも無しでもタグ名だけを見る
+    tag = el.tag
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _sentences(el) -> str:
+    return "".join((s.text or "") for s in el.iter() if _local(s) == "Sentence")
+
+
+def _article_doc(a, law_key: str, law_title: str, path: List[str], suppl: str | None) -> Dict[str, Any] | None:
+    """Article 要素 1 つ分を文書に。子孫は条の中だけなので iter() で一度なめれば足りる。"""
+    cap_text, art_title = "", "(条)"
+    paragraphs = []
+    for el in a.iter():
+        name = _local(el)
+        if name == "ArticleCaption" and not cap_text:
+            cap_text = el.text or ""
+        elif name == "ArticleTitle" and art_title == "(条)":
+            art_title = el.text or "(条)"
+        elif name == "Paragraph":
+            paragraphs.append(el)
+
+    # 本文（Paragraph → Sentence）。号の文も項の文にそのまま連結する（従来の本文と同じ）
+    sentences = []
+    structure = []
+    for p in paragraphs:
+        text = _sentences(p) or (p.text or "").strip()
+        if text:
+            sentences.append(text)
+        items = []
+        for it in p:
+            if _local(it) != "Item":
+                continue
+            title = next((c.text for c in it if _local(c) == "ItemTitle"), None)
+            items.append({"num": title or it.get("Num"), "text": _sentences(it).strip()})
+        structure.append({"num": p.get("Num"), "text": text.strip(), "items": items})
+
+    body = "\n".join([s.strip() for s in sentences if s.strip()])
+    if not body:
+        return None
+
+    article_label = art_title.split("（")[0] if "（" in art_title else art_title
+    # 漢数字の条番号を整数化（「第三十八条から第八十四条まで」のような削除範囲は None）
+    nums = parse_article_title(article_label)
+    doc = {
+        "id": f"{law_key}:{art_title}",
+        "title": law_title,
+        "article": art_title,
+        "article_label": article_label,
+        "article_num": nums[0] if nums else None,
+        "article_code": article_code(nums) if nums else None,
+        "text": f"{cap_text}\n{body}".strip(),
+        "path": list(path),             # 例: ["第三編　債権", "第五章　不法行為"]
+        "paragraphs": structure,        # 項・号の番号と文
+    }
+    if suppl is not None:
+        doc["suppl"] = suppl            # 附則（改正法令番号。制定時の附則は ""）
+    doc["hash"] = content_hash(doc)
+    return doc
+
+
+def _release(el) -> None:
+    # 読み終えた要素と、その前の兄弟要素を捨てる（親に空要素が溜まらないように）
+    el.clear()
+    parent = el.getparent()
+    if parent is not None:
+        while el.getprevious() is not None:
+            del parent[0]
+
+
+def iter_law_articles(source, law_key: str = "civilcode", default_title: str = "民法") -> Iterator[Dict[str, Any]]:
+    """e-Gov の法令 XML（パス / ファイルオブジェクト / bytes）を iterparse で先頭から読み、条ごとに文書を返す。
+    処理し終えた条は clear() して親から外すので、法令全体を木として抱えない。
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    law_title = None
+    seen_law = False
+    path: List[str] = []        # 今いる編・章・節…の見出し
+    depth: List[str] = []       # 開いているコンテナ要素（見出しの無いコンテナも積む）
+    suppl: str | None = None
+    for event, el in etree.iterparse(source, events=("start", "end"), huge_tree=True):
+        name = _local(el)
+        if event == "start":
+            if name == "Law":
+                seen_law = True
+            elif name in _CONTAINERS:
+                depth.append(name)
+                path.append("")
+            elif name == "SupplProvision":
+                suppl = el.get("AmendLawNum") or ""
+                path, depth = [], []
+            continue
 
-    # nsが取れるならprefix付き、ダメならlocal-name()にフォールバックするヘルパ
-    def xp(expr_no_ns: str, tag: str):
-        # expr_no_ns は "Law" や "Article" などのタグ名
-        if ns_uri:
+        if name == "LawTitle" and law_title is None:
+            law_title = el.text
+        elif name in _TITLES and depth and depth[-1] == _TITLES[name]:
+            path[-1] = (el.text or "").strip()
+        elif name in _CONTAINERS and depth:
+            depth.pop()
+            path.pop()
+            _release(el)
+        elif name == "SupplProvision":
+            suppl = None
+        elif name == "Article":
+            doc = _article_doc(el, law_key, law_title or default_title, [t for t in path if t], suppl)
+            _release(el)
+            if doc is not None:
+                yield doc
+    if not seen_law:
+        raise ValueError("Law node not found in e-Gov XML")
 
-            return f".//ns:{tag}"
-        else:
-            return f".//*[local-name()='{tag}']"
 
-    ns = {"ns": ns_uri} if ns_uri else None
+def parse_law_xml(xml_bytes: bytes, law_key: str = "civilcode"):
+    return list(iter_law_articles(xml_bytes, law_key))
 
-    # Lawノード
-    law_nodes = root.xpath(xp("//", "Law"), namespaces=ns) if ns else root.xpath("//*[local-name()='Law']")
-    if not law_nodes:
-        raise ValueError("Law node not found in e-Gov XML")
-    law = law_nodes[0]
-
-    # タイトル
-    title_node = law.xpath(xp(".", "LawTitle"), namespaces=ns) if ns else law.xpath(".//*[local-name()='LawTitle']")
-    law_title = title_node[0].text if title_node else "民法"
-
-    # 条文
-    articles = law.xpath(xp(".", "Article"), namespaces=ns) if ns else law.xpath(".//*[local-name()='Article']")
-
-    docs = []
-    for i, a in enumerate(articles):
-        # 見出し・条番号
-        cap = a.xpath(xp(".", "ArticleCaption"), namespaces=ns) if ns else a.xpath(".//*[local-name()='ArticleCaption']")
-        ttl = a.xpath(xp(".", "ArticleTitle"), namespaces=ns) if ns else a.xpath(".//*[local-name()='ArticleTitle']")
-        cap_text = cap[0].text if cap else ""
-        art_title = ttl[0].text if ttl else "(条)"
-
-        # 本文（Paragraph → Sentence）
-        paragraphs = a.xpath(xp(".", "Paragraph"), namespaces=ns) if ns else a.xpath(".//*[local-name()='Paragraph']")
-        sentences = []
-        for p in paragraphs:
-            sent_nodes = p.xpath(xp(".", "Sentence"), namespaces=ns) if ns else p.xpath(".//*[local-name()='Sentence']")
-            if sent_nodes:
-                text = "".join([(s.text or "") for s in sent_nodes])
-            else:
-                text = (p.text or "").strip()
-            if text:
-                sentences.append(text)
-
-        body = "\n".join([s.strip() for s in sentences if s.strip()])
-        if not body:
-            continue
 
-        article_num = art_title
-        doc_id = f"civilcode:{article_num}"
-        """
-        url = f"https://laws.e-gov.go.jp/law/{LAW_ID}#/{article_num}"
-        docs.append({
-            "id": doc_id,
-            "title": law_title,
-            "article": article_num,
-            "text": f"{cap_text}\n{body}".strip(),
-            "url": url,
-        })"""
-        article_label = article_num.split("（")[0] if "（" in article_num else article_num
-        #url = f"/laws/civilcode/{article_num}"
-        #url = f"/laws/civilcode?q={quote(article_label)}"
-
-        docs.append({
-            #"article_num":(i+1),
-            "id": doc_id,
-            "title": law_title,
-            "article": art_title,
-            "article_label": article_label,
-            "text": f"{cap_text}\n{body}".strip(),
-            #"url": url,
-        })
-    return docs
-    root = etree.fromstring(xml_bytes)
-    ns = {"ns": root.nsmap.get(None, None)}
-    # LawBody/Item/Article ... はスキーマにより階層が深いことがある
-    law_nodes = root.xpath("//Law", namespaces=ns) or root.xpath("//*[local-name()='Law']")
-    law = law_nodes[0]
-    title_node = law.xpath(".//LawTitle", namespaces=ns) or law.xpath(".//*[local-name()='LawTitle']")
-    law_title = title_node[0].text if title_node else "民法"
-
-    articles = law.xpath(".//Article", namespaces=ns) or law.xpath(".//*[local-name()='Article']")
-    docs = []
-    for a in articles:
-        # 見出し・条番号
-        cap = a.xpath("./ArticleCaption", namespaces=ns) or a.xpath("./*[local-name()='ArticleCaption']")
-        ttl = a.xpath("./ArticleTitle", namespaces=ns) or a.xpath("./*[local-name()='ArticleTitle']")
-        cap_text = cap[0].text if cap else ""
-        art_title = ttl[0].text if ttl else "(条)"
-        # 本文（Paragraph → Sentence）を連結
-        paragraphs = a.xpath(".//Paragraph", namespaces=ns) or a.xpath(".//*[local-name()='Paragraph']")
-        sentences = []
-        for p in paragraphs:
-            sent_nodes = p.xpath(".//Sentence", namespaces=ns) or p.xpath(".//*[local-name()='Sentence']")
-            if sent_nodes:
-                text = "".join([s.text or "" for s in sent_nodes])
-            else:
-                text = (p.text or "").strip()
-            if text:
-                sentences.append(text)
-        body = "\n".join([s.strip() for s in sentences if s.strip()])
-        if not body:
+def save_json(docs, path: Path):
+    path.write_text(json.dumps(docs, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+
+
+def merge_docs(old_docs: List[Dict[str, Any]], new_docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """前回の取り込み結果と比べ、消えた条は削除フラグ（tombstone）付きで残す。
+    返り値: (保存する docs, {"added", "changed", "deleted", "unchanged"} の件数)
+    """
+    # 附則の条は本則と同じ id になる。DocStore と同じく先に出た方だけを比べる
+    old_by_id: Dict[str, Dict[str, Any]] = {}
+    for o in old_docs:
+        old_by_id.setdefault(o["id"], o)
+    new_ids = set()
+    diff = {"added": 0, "changed": 0, "deleted": 0, "unchanged": 0}
+    for d in new_docs:
+        if d["id"] in new_ids:
             continue
-        # 1条を1ドキュメントとして格納
-        article_num = art_title
-        doc_id = f"civilcode:{article_num}"
-        url = f"https://laws.e-gov.go.jp/law/{LAW_ID}#/{article_num}"
-        docs.append({
-            "id": doc_id,
-            "title": law_title,
-            "article": article_num,
-            "text": f"{cap_text}\n{body}".strip(),
-            "url": url,
-        })
-    return docs
+        new_ids.add(d["id"])
+        o = old_by_id.get(d["id"])
+        if o is None or o.get("deleted"):
+            diff["added"] += 1
+        elif (o.get("hash") or content_hash(o)) != d["hash"]:
+            diff["changed"] += 1
+        else:
+            diff["unchanged"] += 1
+    merged = list(new_docs)
+    for i, o in old_by_id.items():
+        if i in new_ids:
+            continue
+        if not o.get("deleted"):
+            diff["deleted"] += 1
+        merged.append({**o, "deleted": True})
+    return merged, diff
 
 
-def save_json(docs, path: Path):
-    path.write_text(json.dumps(docs, ensure_ascii=False, indent=2), encoding="utf-8")
+def ingest(source, out: Path, law_key: str = "civilcode") -> Dict[str, int]:
+    """取り込んで既存ファイルと差分を取る。中身が変わった時だけ書き換える（書き換えなければ索引もそのまま）。
+    source は XML の bytes かファイルパス（パスなら木を作らずに流し読み）。
+    """
+    docs = list(iter_law_articles(str(source) if isinstance(source, Path) else source, law_key))
+    old = json.loads(out.read_text(encoding="utf-8")) if out.exists() else []
+    merged, diff = merge_docs(old, docs)
+    diff["written"] = int(bool(diff["added"] or diff["changed"] or diff["deleted"]) or not out.exists())
+    if diff["written"]:
+        save_json(merged, out)
+    return diff
 
 
 if __name__ == "__main__":
     xml_bytes = fetch_civil_code_xml()
-    docs = parse_law_xml(xml_bytes)
-    out = DATA_DIR / "civilcode_egov.json"
-    save_json(docs, out)
-    print(f"Saved {len(docs)} articles to {out}")
\ No newline at end of file
+    out = ingested_path("civilcode")
+    diff = ingest(xml_bytes, out)
+    print(f"{out}: {diff}")
\ No newline at end of file
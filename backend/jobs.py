@@ -0,0 +1,72 @@
+# backend/jobs.py
+# 取り込み・索引の再構築をリクエストスレッドの外で回すための小さなジョブ管理。
+# ワーカーは 1 本（再構築は直列で十分。検索は古いスナップショットで動き続ける）。
+# 同じ種類のジョブが待機中/実行中なら、新しく積まずにそのジョブを返す。
+from __future__ import annotations
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+KEEP_JOBS = 50  # 状態を覚えておく件数
+
+
+class JobRunner:
+    def __init__(self, max_workers: int = 1):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reindex")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[], Any]) -> Dict[str, Any]:
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job["kind"] == kind and job["status"] in ("queued", "running"):
+                    return dict(job)
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "kind": kind,
+                "status": "queued",
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job["id"]] = job
+            while len(self._jobs) > KEEP_JOBS:
+                self._jobs.popitem(last=False)
+        self._pool.submit(self._run, job, fn)
+        return dict(job)
+
+    def _run(self, job: Dict[str, Any], fn: Callable[[], Any]) -> None:
+        with self._lock:
+            job["status"] = "running"
+            job["started"] = time.time()
+        try:
+            result = fn()
+            status, error = "done", None
+        except Exception as e:
+            log.exception("job %s (%s) failed", job["id"], job["kind"])
+            result, status, error = None, "failed", f"{type(e).__name__}: {e}"
+        with self._lock:
+            job.update(status=status, result=result, error=error, finished=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(j) for j in reversed(self._jobs.values())]
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+JOBS = JobRunner()
@@ -1,15 +1,84 @@
 # backend/jp_tokenize.py
+# 検索と索引構築で共有するトークン化。
+#   短い文字列（クエリ・検索語・辞書の語）は LRU キャッシュ、条文本文は素通し
+#   コーパス全体はプロセスプールで並列（RAG_TOKENIZE_WORKERS、既定は CPU 数。1 で直列）
 from sudachipy import tokenizer, dictionary
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from importlib import metadata
+import multiprocessing
+import os
 import re
+import threading
 
-_tokenizer = dictionary.Dictionary().create()
+# Sudachi の Tokenizer はスレッド間で共有できない（同時に使うと "Already borrowed"）。
+# 辞書は共有し、Tokenizer はスレッドごとに作る（検索の to_thread とバックグラウンド再構築が並ぶため）
+_dictionary = dictionary.Dictionary()
+_local = threading.local()
 _mode = tokenizer.Tokenizer.SplitMode.C  # 長めの単位
 
+
+def _dist_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# 索引キャッシュのキーに含める（辞書やモードが変わればトークン列も変わる）
+TOKENIZER_VERSION = f"sudachipy-{_dist_version('SudachiPy')}/dict-{_dist_version('sudachidict-core')}/mode-C"
+
+def _tokenizer():
+    tok = getattr(_local, "tokenizer", None)
+    if tok is None:
+        tok = _local.tokenizer = _dictionary.create()
+    return tok
+
+TOKEN_CACHE_SIZE = int(os.getenv("RAG_TOKEN_CACHE_SIZE", "8192"))
+CACHE_MAX_CHARS = 256        # これより長い文字列（条文本文など）はキャッシュしない
+TOKENIZE_WORKERS = int(os.getenv("RAG_TOKENIZE_WORKERS", "0"))  # 0 = CPU 数
+PARALLEL_MIN_DOCS = 2000     # これ未満はプロセスを起こす方が高くつく
+
+def _ja_tokens(text: str) -> list[str]:
+    return [m.surface() for m in _tokenizer().tokenize(text, _mode) if m.surface().strip()]
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def _ja_tokens_cached(text: str) -> tuple[str, ...]:
+    return tuple(_ja_tokens(text))
+
 def ja_tokens(text: str) -> list[str]:
-    return [m.surface() for m in _tokenizer.tokenize(text, _mode) if m.surface().strip()]
+    if len(text) <= CACHE_MAX_CHARS:
+        return list(_ja_tokens_cached(text))
+    return _ja_tokens(text)
+
+def ja_tokens_batch(texts: list[str]) -> list[list[str]]:
+    # 同一文字列は一度だけ解析する（バッチ検索用）
+    memo: dict[str, list[str]] = {}
+    return [memo[t] if t in memo else memo.setdefault(t, ja_tokens(t)) for t in texts]
+
+def ja_tokens_terms(terms: list[str]) -> list[str]:
+    # 語ごとに（キャッシュ越しに）トークン化して連結。空白を挟んだ連結文字列を解析すると語をまたいだトークンができることがある
+    return [t for term in terms for t in ja_tokens(term)]
+
+def _tokenize_chunk(texts: list[str]) -> list[list[str]]:
+    return [_ja_tokens(t) for t in texts]
+
+def ja_tokens_corpus(texts: list[str], workers: int | None = None) -> list[list[str]]:
+    """索引構築用。件数が多ければプロセスプールで分割して解析する（結果の順序は texts と同じ）。"""
+    workers = workers or TOKENIZE_WORKERS or os.cpu_count() or 1
+    if workers <= 1 or len(texts) < PARALLEL_MIN_DOCS:
+        return _tokenize_chunk(texts)
+    size = -(-len(texts) // (workers * 4))
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    # 再構築はサーバのスレッドから走るので spawn で起こす（各プロセスが辞書を読み込む）
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as ex:
+        return [toks for part in ex.map(_tokenize_chunk, chunks) for toks in part]
+
+def token_cache_info() -> dict:
+    return _ja_tokens_cached.cache_info()._asdict()
 
 def normalize_text(text: str) -> str:
     # 全角カンマを半角に統一 & 空白正規化
     text = text.replace("，", ",")
     text = re.sub(r"\s+", " ", text)
-    return text.strip()
\ No newline at end of file
+    return text.strip()
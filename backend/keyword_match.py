@@ -0,0 +1,79 @@
+# backend/keyword_match.py
+# 複数キーワードの同時照合（Aho–Corasick）。
+#   キーは部分文字列として照合する。空白区切りのキー（"借金 返してくれない"）は
+#   「各部分がこの順に、重ならずに現れる」（間に何が挟まってもよい）で一致とみなす。
+#   構築は 1 回、照合は文字列の長さに比例する 1 パス。英字は大文字小文字を区別しない。
+from __future__ import annotations
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+
+class KeywordMatcher:
+    def __init__(self, keys: Iterable[str]):
+        self.keys: List[str] = list(dict.fromkeys(k for k in keys if k and k.strip()))
+        parts: Dict[str, int] = {}
+        # キーごとの部分文字列 id の並び
+        self._rules: List[Tuple[int, ...]] = [
+            tuple(parts.setdefault(p, len(parts)) for p in k.lower().split()) for k in self.keys
+        ]
+        self._part_len = [len(p) for p in parts]
+        # 先頭の部分文字列 -> それで始まるキーの添字（現れた部分から候補を引く）
+        self._by_first: Dict[int, List[int]] = {}
+        for ki, rule in enumerate(self._rules):
+            self._by_first.setdefault(rule[0], []).append(ki)
+        self._build(list(parts))
+
+    def _build(self, patterns: List[str]) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for pid, p in enumerate(patterns):
+            node = 0
+            for ch in p:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = goto[node][ch] = len(goto)
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(pid)
+        # 失敗遷移を畳み込んだ遷移表（node -> {文字: 次の node}）。照合時に失敗リンクを辿らずに済む
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(g) for g in goto]
+        q = deque(goto[0].values())
+        while q:
+            node = q.popleft()
+            if node:
+                delta[node] = {**delta[fail[node]], **goto[node]}
+            for ch, nxt in goto[node].items():
+                fail[nxt] = delta[fail[node]].get(ch, 0) if node else 0
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                q.append(nxt)
+        self._delta, self._out = delta, out
+
+    def _occurrences(self, text: str) -> Dict[int, List[int]]:
+        """部分文字列 id -> 出現開始位置（昇順）"""
+        delta, out, plen = self._delta, self._out, self._part_len
+        found: Dict[int, List[int]] = {}
+        node = 0
+        for i, ch in enumerate(text.lower()):
+            node = delta[node].get(ch, 0)
+            if out[node]:
+                for pid in out[node]:
+                    found.setdefault(pid, []).append(i - plen[pid] + 1)
+        return found
+
+    def find(self, text: str) -> List[str]:
+        """text に現れるキー（登録順）"""
+        occ = self._occurrences(text)
+        hits = []
+        for ki in sorted(ki for pid in occ for ki in self._by_first.get(pid, ())):
+            pos = 0
+            rule = self._rules[ki]
+            for pid in rule:
+                start = next((s for s in occ.get(pid, ()) if s >= pos), None)
+                if start is None:
+                    break
+                pos = start + self._part_len[pid]
+            else:
+                hits.append(self.keys[ki])
+        return hits
@@ -1,6 +1,23 @@
 # File: backend/legal_concepts.py
 from __future__ import annotations
-from typing import List
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from jp_tokenize import ja_tokens, normalize_text
+from keyword_match import KeywordMatcher
+
+log = logging.getLogger(__name__)
+
+# 辞書の差し替え用ファイル（任意）。{"concepts": {...}, "risk_literals": [...], "risk_flags": {...}, "concept_articles": {...}}
+# ある節だけ下の既定を置き換える。更新時刻を見て自動で読み直す（RELOAD_INTERVAL 秒に 1 回まで確認）
+KEYWORDS_PATH = Path(os.getenv("RAG_KEYWORDS_PATH") or Path(__file__).parent / "data" / "keywords.json")
+RELOAD_INTERVAL = 2.0
 
 # 最小の概念展開辞書（必要に応じて拡張）
 # 口語→民法系の概念語（BM25で効く法的語彙へ寄せる）
@@ -119,18 +136,131 @@ _CONCEPT_MAP = {
     "会社の責任": ["使用者責任", "不法行為", "損害賠償"],
 }
 
+# 概念語 → 民法の条番号（ローカルルータ router.py の law_hints 用）。
+# 「損害賠償」「取消し」のように条を一つに絞れない語は載せない
+_CONCEPT_ARTICLES = {
+    "不法行為": ["709"], "慰謝料": ["710"], "財産以外の損害": ["710"],
+    "名誉毀損": ["723"], "名誉回復": ["723"], "謝罪広告": ["723"],
+    "使用者責任": ["715"], "共同不法行為": ["719"], "過失相殺": ["722"],
+    "詐欺": ["96"], "強迫": ["96"], "錯誤": ["95"],
+    "未成年者取消権": ["5"], "無権代理": ["113"], "表見代理": ["109", "110", "112"],
+    "消滅時効": ["166"], "時効の援用": ["145"],
+    "債務不履行": ["415"], "履行遅滞": ["412"], "遅延損害金": ["419"], "損害賠償の予定": ["420"],
+    "解除": ["541"], "契約不適合責任": ["562", "564"], "追完": ["562"], "代金減額": ["563"],
+    "金銭消費貸借": ["587"], "相殺": ["505"],
+    "保証": ["446"], "連帯保証": ["454"], "極度額": ["465の2"], "求償権": ["459"],
+    "不当利得": ["703"], "事務管理": ["697"], "請負": ["632"], "準委任": ["656"],
+    "賃貸借": ["601"], "敷金": ["622の2"], "原状回復": ["621"], "通常損耗": ["621"],
+    "竹木の枝": ["233"], "越境": ["233"],
+    "財産分与": ["768"], "面会交流": ["766"], "養育費": ["766"], "扶養義務": ["877"], "親権": ["818"],
+    "法定相続分": ["900"], "相続人": ["887"], "代襲相続": ["887"], "遺産分割": ["906"],
+    "遺留分": ["1042"], "侵害額請求": ["1046"], "相続放棄": ["938", "939"], "熟慮期間": ["915"],
+    "限定承認": ["922"], "特別受益": ["903"], "寄与分": ["904の2"],
+}
+
 # 検出したい危険語（これ自体をBM25で強くは使わない）
 _LITERAL_RISK = {"死ね", "殺す", "殺せ"}
 
 
+# 注意喚起（キー → 表示文）
+_RISK_FLAGS = {
+    "時効": "時効・除斥期間の可能性あり。期限徒過は重大。",
+    "出訴期間": "不服申立・訴訟の期間制限。",
+    "差押": "強制執行・保全手続の専門対応が必要。",
+    "登記": "不動産・動産譲渡登記の実体・対抗要件の確認。",
+    "契約書": "契約条項の個別確認が必要。",
+    "相続": "戸籍・遺言・遺留分の個別確認が必要。",
+    "損害賠償": "責任要件・因果関係・損害算定は事実依存。",
+}
+
+
+class _Dictionaries:
+    """辞書一式と、照合するキーをまとめて組んだ照合器。読み直しは参照ごと差し替える。"""
+
+    def __init__(self, concepts: Dict[str, List[str]], risk_literals, risk_flags: Dict[str, str],
+                 concept_articles: Dict[str, List[str]] = _CONCEPT_ARTICLES, mtime: Optional[float] = None):
+        self.concepts = concepts
+        self.concept_articles = concept_articles
+        self.risk_literals = set(risk_literals)
+        self.risk_flags = risk_flags
+        self.mtime = mtime
+        self.matcher = KeywordMatcher([*concepts, *self.risk_literals, *risk_flags])
+        # 展開先の語ごとのトークン列（起動時・読み直し時に一度だけ解析）
+        self.concept_tokens = {v: ja_tokens(normalize_text(v)) for vals in concepts.values() for v in vals}
+        # 1 リクエストで概念展開・危険語・注意喚起が同じ文を引くので、直近の結果を覚えておく
+        self.match = lru_cache(maxsize=256)(self._match)
+
+    def _match(self, text: str) -> frozenset:
+        return frozenset(self.matcher.find(normalize_text(text)))
+
+
+def _load(mtime: Optional[float]) -> _Dictionaries:
+    data = json.loads(KEYWORDS_PATH.read_text(encoding="utf-8")) if mtime is not None else {}
+    return _Dictionaries(
+        data.get("concepts", _CONCEPT_MAP),
+        data.get("risk_literals", _LITERAL_RISK),
+        data.get("risk_flags", _RISK_FLAGS),
+        data.get("concept_articles", _CONCEPT_ARTICLES),
+        mtime,
+    )
+
+
+def _mtime() -> Optional[float]:
+    try:
+        return KEYWORDS_PATH.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+_DICTS = _Dictionaries(_CONCEPT_MAP, _LITERAL_RISK, _RISK_FLAGS)
+_checked = 0.0
+_reload_lock = threading.Lock()
+
+
+def _dicts() -> _Dictionaries:
+    global _DICTS, _checked
+    if time.monotonic() - _checked < RELOAD_INTERVAL:
+        return _DICTS
+    with _reload_lock:
+        if time.monotonic() - _checked >= RELOAD_INTERVAL:
+            _checked = time.monotonic()
+            mtime = _mtime()
+            if mtime != _DICTS.mtime:
+                try:
+                    _DICTS = _load(mtime)
+                    log.info("keywords reloaded: %s", KEYWORDS_PATH if mtime is not None else "defaults")
+                except (OSError, ValueError) as e:
+                    # 壊れたファイルでは落とさず、今の辞書で続ける
+                    log.warning("keywords not reloaded: %s", e)
+    return _DICTS
+
+
 def expand_concepts(text: str) -> List[str]:
-    found = []
-    for key, vals in _CONCEPT_MAP.items():
-        if key in text:
-            found.extend(vals)
+    d = _dicts()
+    hits = d.match(text)
+    found = [v for key, vals in d.concepts.items() if key in hits for v in vals]
     # 重複除去
     return list(dict.fromkeys(found))
 
 
+def concept_tokens(terms: List[str]) -> List[str]:
+    """expand_concepts の結果をトークン列にする（事前計算済みの表を引くだけ）。"""
+    table = _dicts().concept_tokens
+    return [t for v in terms for t in (table.get(v) or ja_tokens(normalize_text(v)))]
+
+
+def concept_articles(terms: List[str]) -> List[str]:
+    """概念語（expand_concepts の結果など）から条番号の候補（重複なし・terms の順）。"""
+    table = _dicts().concept_articles
+    return list(dict.fromkeys(a for v in terms for a in table.get(v, ())))
+
+
 def literal_risk_tokens(text: str) -> set[str]:
-    return {w for w in _LITERAL_RISK if w in text}
+    d = _dicts()
+    return d.risk_literals & d.match(text)
+
+
+def risk_flags(text: str) -> List[str]:
+    d = _dicts()
+    hits = d.match(text.lower())
+    return [v for k, v in d.risk_flags.items() if k in hits]
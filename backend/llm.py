@@ -4,6 +4,13 @@ from typing import List, Dict, Any
 
 # backend/llm.py（追記）
 import json, re
+import logging
+from llm_cache import cached_chat
+from llm_provider import aclose_clients, default_model
+from llm_provider import achat as provider_achat, astream as provider_astream, chat as provider_chat
+from metrics import timed
+
+log = logging.getLogger(__name__)
 
 
 # Avoid HF tokenizers fork warning / potential deadlocks when the server forks
@@ -28,61 +35,45 @@ SYSTEM_PROMPT = (
 
 
 
-# ========== OpenAI互換（OpenAI / DeepSeek / Ollama / TGI） ==========
-def _chat_openai_like(messages: list[dict]) -> str:
-    # openai>=1.x
-    from openai import OpenAI
+def _groq_model() -> str:
+    return default_model("groq")
 
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        #base_url=os.getenv("OPENAI_BASE_URL") or None,  # 無指定なら公式
-    )
+def _openai_model() -> str:
+    return default_model("openai")
 
-    # まずは環境変数があればそれを優先。なければ広く利用可能な安定モデルを既定にする。
-    model = os.getenv("OPENAI_MODEL") or "gpt-5"
-    wants_gpt5 = model.startswith("gpt-5")
+# 同じ質問の言い回しは大量に繰り返されるので、各 chat 関数は応答キャッシュ越しに呼ぶ（llm_cache.py）
+# 接続の使い回し・timeout・再試行・サーキットブレーカー・ヘッジは llm_provider.py
 
+# ========== OpenAI互換（OpenAI / DeepSeek / Ollama / TGI） ==========
+@cached_chat("openai", _openai_model)
+def _chat_openai_like(messages: list[dict]) -> str:
     try:
-        print("model",model)
-  
-        response = client.responses.create(
-            model="gpt-5",
-            input=messages,
-            reasoning={
-                     "effort": "minimal",
-                    #"summary": "auto" # auto, concise, or detailed, gpt-5 series do not support concise 
-            },
-            text={ 
-                    "verbosity": "low",}
-            )
-        print("response", response)
-        #return rsp.choices[0].message.content
-        return response.output_text
+        return provider_chat("openai", messages)
     except Exception as e:
-        err_msg = str(e)
-        raise RuntimeError(f"OpenAI-like chat failed for model '{model}': {err_msg}") from e
+        raise RuntimeError(f"OpenAI-like chat failed for model '{_openai_model()}': {e}") from e
 
-# ========== Groq（SDK版） ==========
+# ========== Groq ==========
+@cached_chat("groq", _groq_model)
 def _chat_groq(messages: list[dict]) -> str:
-    from groq import Groq
-    from groq import BadRequestError
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+    return provider_chat("groq", messages)
+
+# ========== 非同期版 ==========
+@cached_chat("openai", _openai_model)
+async def _achat_openai_like(messages: list[dict]) -> str:
     try:
-        r = client.chat.completions.create(model=model, messages=messages, temperature=0)
-        return r.choices[0].message.content
-    except BadRequestError as e:
-        msg = str(e)
-        if "model_decommissioned" in msg or "has been decommissioned" in msg:
-            for fallback in ("llama-3.3-70b-versatile", "llama-3.1-8b-instant"):
-                if fallback == model:
-                    continue
-                try:
-                    r = client.chat.completions.create(model=fallback, messages=messages, temperature=0)
-                    return r.choices[0].message.content
-                except Exception:
-                    pass
-        raise
+        return await provider_achat("openai", messages)
+    except Exception as e:
+        raise RuntimeError(f"OpenAI-like chat failed for model '{_openai_model()}': {e}") from e
+
+@cached_chat("groq", _groq_model)
+async def _achat_groq(messages: list[dict]) -> str:
+    return await provider_achat("groq", messages)
+
+@cached_chat("groq", _groq_model)
+async def _astream_groq(messages: list[dict]):
+    """Groq の stream=True を使い、届いた差分テキストを順に yield する。"""
+    async for delta in provider_astream("groq", messages):
+        yield delta
 
 # ========== 公開APIに頼らないフォールバック（抽出要約） ==========
 def _extractive_fallback(hits: List[Dict[str, Any]]) -> str:
@@ -106,23 +97,20 @@ def synthesize_answer(query: str, hits: List[Dict[str, Any]]) -> str:
     )
     prov, use_openai_like = _get_provider_flags()
 
-    print("read synthesize answer")
     # 1) 明示プロバイダ
     if prov == "groq" and os.getenv("GROQ_API_KEY"):
-        print("read groq")
         return _chat_groq([
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ])
     if use_openai_like:
-        print("openai like")
         try:
             return _chat_openai_like([
                 {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt},
             ])
         except Exception as e:
-            print(f"openai_like_exception: {e}")
+            log.warning("openai-like chat failed: %s", e)
             # fall back to extractive summary
             pass
 
@@ -147,7 +135,7 @@ def llm_runtime_info() -> dict:
     return info
 
 
-def llm_searchtext(query: str) -> List[str]:
+def _searchtext_messages(query: str) -> list[dict]:
     prompt = (
         "次の[質問]以下の内容を読んで質問の背景を理解し、民法に関して関連する検索ワードを出力してください。"
         "出力は,で区切ってください。また出力は10個までとします。\n\n"
@@ -155,36 +143,50 @@ def llm_searchtext(query: str) -> List[str]:
         "脅迫,相続,遺産\n\n"
         f"[質問]{query}"
     )
+    return [
+        #{"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+def _parse_searchtext(result) -> List[str]:
+    log.debug("llm_result %s", result)
+    if not isinstance(result, str):
+        result = str(result)
+    # unify commas and strip spaces/newlines
+    result = result.replace("，", ",").replace("\n", ",").replace("\r", ",")
+    split = [t.strip() for t in result.split(",") if t.strip()]
+    return split
+
+@timed("llm_searchtext")
+def llm_searchtext(query: str) -> List[str]:
     prov, use_openai_like = _get_provider_flags()
 
     result = ""
 
-    print("read synthesize answer")
     # 1) 明示プロバイダ
     if prov == "groq" and os.getenv("GROQ_API_KEY"):
-        print("read groq")
-        result= _chat_groq([
-            #{"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ])
+        result= _chat_groq(_searchtext_messages(query))
     elif use_openai_like:
-        print("openai like")
         try:
-            result=_chat_openai_like([
-              #  {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt},
-            ])
+            result=_chat_openai_like(_searchtext_messages(query))
         except Exception as e:
-            print(f"openai_like_exception: {e}")
+            log.warning("openai-like chat failed: %s", e)
             # fall back to extractive summary
             pass
-    print("llm_result", result)
-    if not isinstance(result, str):
-        result = str(result)
-    # unify commas and strip spaces/newlines
-    result = result.replace("，", ",").replace("\n", ",").replace("\r", ",")
-    split = [t.strip() for t in result.split(",") if t.strip()]
-    return split
+    return _parse_searchtext(result)
+
+@timed("llm_searchtext")
+async def llm_searchtext_async(query: str) -> List[str]:
+    prov, use_openai_like = _get_provider_flags()
+    result = ""
+    if prov == "groq" and os.getenv("GROQ_API_KEY"):
+        result = await _achat_groq(_searchtext_messages(query))
+    elif use_openai_like:
+        try:
+            result = await _achat_openai_like(_searchtext_messages(query))
+        except Exception as e:
+            log.warning("openai-like chat failed: %s", e)
+    return _parse_searchtext(result)
 
 
 # 追加：Law Router（民法専門。刑法はNOに振り分け）
@@ -211,13 +213,13 @@ def _json_from_text(s: str) -> dict:
         # 末尾カンマ/単引用など軽微な崩れは修正を試みても良いが、まずは素通し
         return {}
 
-def llm_route(query: str) -> dict:
-    msg = [
+def _route_messages(query: str) -> list[dict]:
+    return [
         {"role": "system", "content": ROUTER_SYSTEM},
         {"role": "user",   "content": f"質問: {query}これは民法ではどう扱われる？\n厳格JSONで返答。"}
     ]
-    # Groq固定
-    result = _chat_groq(msg)
+
+def _parse_route(result: str) -> dict:
     data = _json_from_text(result) or {}
     # 最低限の形に正規化
     data.setdefault("domain", "other")
@@ -230,6 +232,15 @@ def llm_route(query: str) -> dict:
             h["article"] = str(h["article"])
     return data
 
+@timed("llm_route")
+def llm_route(query: str) -> dict:
+    # Groq固定
+    return _parse_route(_chat_groq(_route_messages(query)))
+
+@timed("llm_route")
+async def llm_route_async(query: str) -> dict:
+    return _parse_route(await _achat_groq(_route_messages(query)))
+
 
 ANSWER_SYSTEM = (
     "あなたは日本の民法に関するリーガルアシスタント。"
@@ -239,17 +250,41 @@ ANSWER_SYSTEM = (
     "出典条文には条文番号と別名を複数あれば列挙（例：第七百九条（不法行為による損害賠償））。"
 )
 
-def llm_answer_from_context(query: str, hits: List[Dict[str, Any]]) -> str:
+def _answer_messages(query: str, hits: List[Dict[str, Any]]) -> list[dict]:
     ctx = "\n\n".join([f"【{h.get('article','?')}】\n{h['text']}" for h in hits])
     prompt = (
         f"[質問]\n{query}\n\n"
         f"[参照コンテキスト]\n{ctx}\n\n"
         "上記の範囲内だけで回答してください。"
     )
-    return _chat_groq([
+    return [
         {"role": "system", "content": ANSWER_SYSTEM},
         {"role": "user", "content": prompt},
-    ])
+    ]
+
+def _groq_available() -> bool:
+    # 回答・使用条文の選定は Groq 固定。キーが無ければ呼ばない（回答は抽出要約、選定は本文の出典表記だけ）
+    return bool(os.getenv("GROQ_API_KEY"))
+
+@timed("llm_answer")
+def llm_answer_from_context(query: str, hits: List[Dict[str, Any]]) -> str:
+    if not _groq_available():
+        return _extractive_fallback(hits)
+    return _chat_groq(_answer_messages(query, hits))
+
+@timed("llm_answer")
+async def llm_answer_from_context_async(query: str, hits: List[Dict[str, Any]]) -> str:
+    if not _groq_available():
+        return _extractive_fallback(hits)
+    return await _achat_groq(_answer_messages(query, hits))
+
+async def llm_answer_from_context_stream(query: str, hits: List[Dict[str, Any]]):
+    # 回答本文をトークン（差分）単位で流す
+    if not _groq_available():
+        yield _extractive_fallback(hits)
+        return
+    async for delta in _astream_groq(_answer_messages(query, hits)):
+        yield delta
 
 
 def _json_pick(s: str) -> dict|list:
@@ -265,10 +300,7 @@ PICK_SYSTEM = (
     "出力は必ず JSON（配列）で、各要素は候補の id を文字列で返すこと。余計な文章は一切禁止。"
 )
 
-def llm_pick_used_articles(answer_text: str, hits: list[dict]) -> list[str]:
-    """
-    hits: [{'id': 'civilcode:709', 'article': '第709条...', 'text': '…'}, ...]
-    """
+def _pick_messages(answer_text: str, hits: list[dict]) -> list[dict]:
     # 候補をLLMに渡す（id と article だけ掲示）→ JSON配列の id[]
     cand_view = "\n".join([f"- id:{h['id']} / {h.get('article','')}" for h in hits])
     prompt = (
@@ -277,11 +309,28 @@ def llm_pick_used_articles(answer_text: str, hits: list[dict]) -> list[str]:
         f"[回答本文]\n{answer_text}\n\n[候補条文]\n{cand_view}\n\n"
         "JSON配列のみを返し、他のテキストは出力しないでください。例：[\"civilcode:第二百十六条\",\"civilcode:第二百五十八条の二\"]"
     )
-    s = _chat_groq([
+    return [
         {"role":"system","content": PICK_SYSTEM},
         {"role":"user","content": prompt},
-    ])
+    ]
+
+def _parse_pick(s: str) -> list[str]:
     data = _json_pick(s)
     if isinstance(data, list):
         return [str(x) for x in data if isinstance(x,(str,int))]
-    return []
\ No newline at end of file
+    return []
+
+@timed("llm_pick")
+def llm_pick_used_articles(answer_text: str, hits: list[dict]) -> list[str]:
+    """
+    hits: [{'id': 'civilcode:709', 'article': '第709条...', 'text': '…'}, ...]
+    """
+    if not _groq_available():
+        return []
+    return _parse_pick(_chat_groq(_pick_messages(answer_text, hits)))
+
+@timed("llm_pick")
+async def llm_pick_used_articles_async(answer_text: str, hits: list[dict]) -> list[str]:
+    if not _groq_available():
+        return []
+    return _parse_pick(await _achat_groq(_pick_messages(answer_text, hits)))
@@ -0,0 +1,247 @@
+# backend/llm_cache.py
+# LLM 応答キャッシュ。キーは (プロバイダ, モデル, system プロンプト, 正規化したユーザー発話)。
+#   1段目: プロセス内 LRU（TTL 付き）
+#   2段目: SQLite（任意。LLM_CACHE_DB を指定すると再起動後も残り、uvicorn ワーカー間で共有）
+# 環境変数:
+#   LLM_CACHE=off        キャッシュを使わない
+#   LLM_CACHE_TTL=秒     既定 86400
+#   LLM_CACHE_SIZE=件数  プロセス内 LRU の上限（既定 2048）
+#   LLM_CACHE_DB=パス    SQLite ファイル（未指定ならメモリのみ）
+from __future__ import annotations
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+# リクエスト単位でキャッシュを素通りさせる（/search?nocache=1 など）
+CACHE_BYPASS: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextlib.contextmanager
+def bypass_cache(on: bool = True):
+    token = CACHE_BYPASS.set(on)
+    try:
+        yield
+    finally:
+        CACHE_BYPASS.reset(token)
+
+
+def normalize_prompt(text: str) -> str:
+    # 全角/半角・空白の揺れだけ吸収する（意味が変わる正規化はしない）
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class LLMCache:
+    def __init__(self, maxsize: int = 2048, ttl: float = 86400.0, db_path: Optional[str] = None, enabled: bool = True):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.enabled = enabled
+        self._mem: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()      # メモリ側と stats だけ（SQLite を待つ間は持たない）
+        self._db_lock = threading.Lock()   # SQLite の接続（busy timeout で最大 5 秒待つことがある）
+        self._db: Optional[sqlite3.Connection] = None
+        self.stats = {"hits": 0, "misses": 0, "memory_hits": 0, "disk_hits": 0, "bypass": 0, "errors": 0}
+        if enabled and db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, path: str) -> None:
+        try:
+            db = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            self._db = db
+        except sqlite3.Error as e:
+            # 置けなくてもメモリだけで動く
+            log.warning("llm cache db disabled: %s", e)
+
+    @staticmethod
+    def make_key(provider: str, model: str, messages: list[dict]) -> str:
+        norm = [[m.get("role", ""), normalize_prompt(str(m.get("content", "")))] for m in messages]
+        raw = json.dumps([provider, model, norm], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def active(self) -> bool:
+        if not self.enabled:
+            return False
+        if CACHE_BYPASS.get():
+            with self._lock:
+                self.stats["bypass"] += 1
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        hit = self._get_memory(key, now)
+        if hit is None and self._db is not None:
+            hit = self._get_disk(key, now)
+        if hit is None:
+            self._count("misses")
+        return hit
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get の async 版。メモリはその場で引き、SQLite はスレッドに回す（イベントループを止めない）"""
+        now = time.time()
+        hit = self._get_memory(key, now)
+        if hit is None and self._db is not None:
+            hit = await asyncio.to_thread(self._get_disk, key, now)
+        if hit is None:
+            self._count("misses")
+        return hit
+
+    def _count(self, *names: str) -> None:
+        with self._lock:
+            for n in names:
+                self.stats[n] += 1
+
+    def _get_memory(self, key: str, now: float) -> Optional[str]:
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None and now - item[0] < self.ttl:
+                self._mem.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return item[1]
+            if item is not None:
+                del self._mem[key]
+        return None
+
+    def _get_disk(self, key: str, now: float) -> Optional[str]:
+        with self._db_lock:
+            try:
+                row = self._db.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+                self._count("errors")
+        if row is None or now - row[1] >= self.ttl:
+            return None
+        self._remember(key, row[0], row[1])
+        self._count("hits", "disk_hits")
+        return row[0]
+
+    def _remember(self, key: str, value: str, created: float) -> None:
+        with self._lock:
+            self._mem[key] = (created, value)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.maxsize:
+                self._mem.popitem(last=False)
+
+    def put(self, key: str, value: str) -> None:
+        if not value:
+            return  # 空応答は覚えない
+        now = time.time()
+        self._remember(key, value, now)
+        if self._db is not None:
+            self._put_disk(key, value, now)
+
+    async def aput(self, key: str, value: str) -> None:
+        """put の async 版（メモリはその場で、SQLite への書き込みはスレッドで）"""
+        if not value:
+            return
+        now = time.time()
+        self._remember(key, value, now)
+        if self._db is not None:
+            await asyncio.to_thread(self._put_disk, key, value, now)
+
+    def _put_disk(self, key: str, value: str, now: float) -> None:
+        with self._db_lock:
+            try:
+                self._db.execute("INSERT OR REPLACE INTO llm_cache (key, value, created) VALUES (?, ?, ?)", (key, value, now))
+            except sqlite3.Error:
+                self._count("errors")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+
+    def info(self) -> dict:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "size": len(self._mem),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "disk": self._db is not None,
+                "hit_rate": (self.stats["hits"] / total) if total else 0.0,
+                **self.stats,
+            }
+
+
+LLM_CACHE = LLMCache(
+    maxsize=int(os.getenv("LLM_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+    db_path=os.getenv("LLM_CACHE_DB") or None,
+    enabled=os.getenv("LLM_CACHE", "on").lower() not in ("off", "0", "false"),
+)
+
+
+def cached_chat(provider: str, model: Callable[[], str]):
+    """chat 関数（messages -> str）に応答キャッシュを被せる。同期・async・async ジェネレータ（ストリーム）に対応。"""
+    def deco(fn):
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen(messages: list[dict]):
+                if not LLM_CACHE.active():
+                    async for x in fn(messages):
+                        yield x
+                    return
+                key = LLM_CACHE.make_key(provider, model(), messages)
+                hit = await LLM_CACHE.aget(key)
+                if hit is not None:
+                    yield hit
+                    return
+                parts = []
+                async for x in fn(messages):
+                    parts.append(x)
+                    yield x
+                # 最後まで流れ切った時だけ保存
+                await LLM_CACHE.aput(key, "".join(parts))
+            return agen
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def acall(messages: list[dict]) -> str:
+                if not LLM_CACHE.active():
+                    return await fn(messages)
+                key = LLM_CACHE.make_key(provider, model(), messages)
+                hit = await LLM_CACHE.aget(key)
+                if hit is not None:
+                    return hit
+                out = await fn(messages)
+                if isinstance(out, str):
+                    await LLM_CACHE.aput(key, out)
+                return out
+            return acall
+
+        @functools.wraps(fn)
+        def call(messages: list[dict]) -> str:
+            if not LLM_CACHE.active():
+                return fn(messages)
+            key = LLM_CACHE.make_key(provider, model(), messages)
+            hit = LLM_CACHE.get(key)
+            if hit is not None:
+                return hit
+            out = fn(messages)
+            if isinstance(out, str):
+                LLM_CACHE.put(key, out)
+            return out
+        return call
+    return deco
@@ -0,0 +1,475 @@
+# backend/llm_provider.py
+# LLM プロバイダ（Groq / OpenAI 互換）の呼び出し口。llm.py の chat 関数はすべてここを通す。
+#   - クライアントはプロセスで使い回す（同期・非同期それぞれ httpx の接続プールを 1 つ共有し、TLS 接続を張り直さない）
+#   - 1 回の試行の timeout と、再試行・ヘッジを含めた 1 呼び出し全体の締め切り（deadline）
+#   - 429 / 5xx / 接続エラー・タイムアウトはジッター付き指数バックオフで再試行（Retry-After があればそれ以上待つ）
+#     SDK 側の再試行（max_retries）は二重になるので切る
+#   - プロバイダ×モデルごとのサーキットブレーカー：連続で失敗したら冷却時間の間は呼ばずに即失敗、明けたら 1 件だけ試す
+#   - ヘッジ：主系が LLM_HEDGE_AFTER 秒で返らなければ（先に失敗したらすぐ）副系にも同じ要求を投げ、先に返った方を使う
+#     ストリームは最初の差分が届くまでで比べる
+# 環境変数:
+#   LLM_TIMEOUT=20           1 回の試行の上限（秒）
+#   LLM_DEADLINE=45          再試行・ヘッジを含めた上限（秒）
+#   LLM_RETRIES=2            再試行の回数
+#   LLM_BACKOFF=0.25         バックオフの基準（秒）。n 回目の再試行は 0〜基準×2^n の一様乱数（上限 LLM_BACKOFF_MAX=4）
+#   LLM_BREAKER_FAILURES=5   サーキットを開く連続失敗数
+#   LLM_BREAKER_COOLDOWN=30  開いている時間（秒）
+#   LLM_HEDGE_AFTER=         秒。空ならヘッジしない
+#   LLM_HEDGE_PROVIDER=      副系のプロバイダ groq|openai（既定は主系と同じ）
+#   LLM_HEDGE_MODEL=         副系のモデル（既定は主系と同じモデル＝同じ要求をもう 1 本）
+#   GROQ_BASE_URL / OPENAI_BASE_URL  接続先（SDK がそのまま読む。ローカルのモックサーバで試す時など）
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+TIMEOUT = float(os.getenv("LLM_TIMEOUT", "20"))
+DEADLINE = float(os.getenv("LLM_DEADLINE", "45"))
+RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+BACKOFF = float(os.getenv("LLM_BACKOFF", "0.25"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "4"))
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER") or 0)
+HEDGE_PROVIDER = os.getenv("LLM_HEDGE_PROVIDER", "").lower().strip()
+HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "").strip()
+
+# Groq でモデル廃止（model_decommissioned）が返った時に順に試すモデル
+DECOMMISSIONED_FALLBACKS = ("llama-3.3-70b-versatile", "llama-3.1-8b-instant")
+
+
+def default_model(name: str) -> str:
+    if name == "openai":
+        return "gpt-5"  # OpenAI 互換は現状 gpt-5 固定で呼んでいる
+    return os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+
+
+class CircuitOpenError(RuntimeError):
+    """サーキットが開いているので呼ばなかった"""
+
+
+# ========== クライアント（プロセスで共有） ==========
+_CLIENTS: Dict[str, Any] = {}
+_clients_lock = threading.RLock()
+
+
+def _http_client(aio: bool):
+    import httpx
+    key = "async:http" if aio else "sync:http"
+    c = _CLIENTS.get(key)
+    if c is None:
+        cls = httpx.AsyncClient if aio else httpx.Client
+        c = _CLIENTS[key] = cls(
+            timeout=httpx.Timeout(TIMEOUT, connect=min(10.0, TIMEOUT)),
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+    return c
+
+
+def _client(name: str, aio: bool):
+    key = f"{'async' if aio else 'sync'}:{name}"
+    c = _CLIENTS.get(key)
+    if c is None:
+        with _clients_lock:
+            c = _CLIENTS.get(key)
+            if c is None:
+                http = _http_client(aio)
+                if name == "openai":
+                    from openai import AsyncOpenAI, OpenAI
+                    c = (AsyncOpenAI if aio else OpenAI)(api_key=os.getenv("OPENAI_API_KEY"), http_client=http, max_retries=0)
+                else:
+                    from groq import AsyncGroq, Groq
+                    c = (AsyncGroq if aio else Groq)(api_key=os.getenv("GROQ_API_KEY"), http_client=http, max_retries=0)
+                _CLIENTS[key] = c
+    return c
+
+
+async def aclose_clients() -> None:
+    with _clients_lock:
+        sync_http, async_http = _CLIENTS.get("sync:http"), _CLIENTS.get("async:http")
+        _CLIENTS.clear()
+    if sync_http is not None:
+        sync_http.close()
+    if async_http is not None:
+        await async_http.aclose()
+
+
+# ========== 失敗の分類 ==========
+def _transient_types() -> tuple:
+    import httpx
+    types = [TimeoutError, httpx.TransportError]
+    # 読み込み済みの SDK だけ見る（使っていない SDK の例外は来ないので、ここで import して待たない）
+    for mod in ("groq", "openai"):
+        if mod in sys.modules:
+            types.append(sys.modules[mod].APIConnectionError)  # APITimeoutError もこの下
+    return tuple(types)
+
+
+def _transient(e: BaseException) -> bool:
+    """待てば通るかもしれない失敗（429 / 5xx / 接続・タイムアウト）"""
+    status = getattr(e, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(e, _transient_types())
+
+
+def _retry_after(e: BaseException) -> float:
+    resp = getattr(e, "response", None)
+    v = resp.headers.get("retry-after") if resp is not None else None
+    try:
+        return float(v) if v else 0.0
+    except ValueError:
+        return 0.0  # HTTP 日付の形は使われていないので見ない
+
+
+def _decommissioned(e: BaseException) -> bool:
+    msg = str(e)
+    return getattr(e, "status_code", None) == 400 and ("model_decommissioned" in msg or "has been decommissioned" in msg)
+
+
+# ========== サーキットブレーカー ==========
+class CircuitBreaker:
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.name = name
+        self.failures, self.cooldown = failures, cooldown
+        self._fails = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True  # 半開：この 1 件の結果で閉じるか開き直すかを決める
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                log.info("circuit %s closed", self.name)
+            self._fails, self._opened_at, self._probing = 0, None, False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._fails += 1
+            if self._probing or (self._opened_at is None and self._fails >= self.failures):
+                log.warning("circuit %s open for %.0fs after %d failures", self.name, self.cooldown, self._fails)
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """結果が出ないまま終わった試行（ヘッジで取り消された等）。半開の試しを他に譲る"""
+        with self._lock:
+            self._probing = False
+
+
+# ========== プロバイダ×モデル ==========
+class Provider:
+    def __init__(self, name: str, model: str):
+        self.name, self.model = name, model
+        self.breaker = CircuitBreaker(f"{name}:{model}")
+
+    def __repr__(self) -> str:
+        return f"Provider({self.breaker.name})"
+
+    def _models(self) -> List[str]:
+        if self.name != "groq":
+            return [self.model]
+        return [self.model] + [m for m in DECOMMISSIONED_FALLBACKS if m != self.model]
+
+    def _request(self, client, model: str, messages: list[dict], timeout: float, stream: bool = False):
+        # プロバイダごとの違いはここと _text / _delta だけ（async クライアントならコルーチンが返る）
+        if self.name == "openai":
+            return client.responses.create(
+                model=model, input=messages, reasoning={"effort": "minimal"}, text={"verbosity": "low"},
+                stream=stream, timeout=timeout,
+            )
+        return client.chat.completions.create(model=model, messages=messages, temperature=0, stream=stream, timeout=timeout)
+
+    def _text(self, r) -> str:
+        return r.output_text if self.name == "openai" else r.choices[0].message.content
+
+    def _delta(self, chunk) -> str:
+        if self.name == "openai":
+            return chunk.delta if getattr(chunk, "type", "") == "response.output_text.delta" else ""
+        return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+
+    # --- 試行 1 回の前後 ---
+    def _begin(self, deadline: float) -> float:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise TimeoutError(f"LLM deadline exceeded ({self.breaker.name})")
+        if not self.breaker.allow():
+            metrics.LLM_CALLS.inc(self.breaker.name, "circuit_open")
+            raise CircuitOpenError(f"circuit open: {self.breaker.name}")
+        return min(TIMEOUT, left)
+
+    def _ok(self) -> None:
+        self.breaker.success()
+        metrics.LLM_CALLS.inc(self.breaker.name, "ok")
+
+    def _failed(self, e: Exception, attempt: int, deadline: float) -> float:
+        """失敗を記録し、再試行までに待つ秒数を返す。再試行しないなら e を投げ直す"""
+        if not _transient(e):
+            self.breaker.success()  # 応答は返っている（400 など）ので接続先の不調には数えない
+            metrics.LLM_CALLS.inc(self.breaker.name, "error")
+            raise e
+        self.breaker.failure()
+        delay = max(random.uniform(0.0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt)), _retry_after(e))
+        if attempt >= RETRIES or time.monotonic() + delay >= deadline or self.breaker.state != "closed":
+            metrics.LLM_CALLS.inc(self.breaker.name, "error")
+            raise e
+        metrics.LLM_CALLS.inc(self.breaker.name, "retry")
+        log.warning("%s failed (%s: %s), retry %d in %.2fs", self.breaker.name, type(e).__name__, e, attempt + 1, delay)
+        return delay
+
+    # --- 同期 ---
+    def _call(self, messages: list[dict], timeout: float) -> str:
+        client = _client(self.name, aio=False)
+        models = self._models()
+        for model in models:
+            try:
+                return self._text(self._request(client, model, messages, timeout))
+            except Exception as e:
+                if model == models[-1] or not _decommissioned(e):
+                    raise
+                log.warning("model %s decommissioned, trying next", model)
+        raise AssertionError("unreachable")
+
+    def chat(self, messages: list[dict], deadline: float) -> str:
+        attempt = 0
+        while True:
+            timeout = self._begin(deadline)
+            try:
+                out = self._call(messages, timeout)
+            except Exception as e:
+                delay = self._failed(e, attempt, deadline)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._ok()
+            return out
+
+    # --- 非同期 ---
+    async def _acall(self, messages: list[dict], timeout: float) -> str:
+        client = _client(self.name, aio=True)
+        models = self._models()
+        for model in models:
+            try:
+                return self._text(await self._request(client, model, messages, timeout))
+            except Exception as e:
+                if model == models[-1] or not _decommissioned(e):
+                    raise
+                log.warning("model %s decommissioned, trying next", model)
+        raise AssertionError("unreachable")
+
+    async def _aretry(self, fn: Callable[[float], Awaitable[Any]], deadline: float) -> Any:
+        attempt = 0
+        while True:
+            timeout = self._begin(deadline)
+            try:
+                # httpx の timeout は接続・読み取りの区切りごとなので、試行全体も timeout で打ち切る
+                out = await asyncio.wait_for(fn(timeout), timeout)
+            except Exception as e:
+                delay = self._failed(e, attempt, deadline)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._ok()
+            return out
+
+    async def achat(self, messages: list[dict], deadline: float) -> str:
+        return await self._aretry(lambda t: self._acall(messages, t), deadline)
+
+    async def aopen_stream(self, messages: list[dict], deadline: float) -> Tuple[str, Any, Any]:
+        """(最初の差分, 残りの差分の async イテレータ, stream)。最初の差分が届くまでは再試行する"""
+        async def open_(timeout: float):
+            stream = await self._request(_client(self.name, aio=True), self.model, messages, timeout, stream=True)
+            it = stream.__aiter__()
+            try:
+                while True:
+                    try:
+                        chunk = await it.__anext__()
+                    except StopAsyncIteration:
+                        return "", stream, it
+                    first = self._delta(chunk)
+                    if first:
+                        return first, stream, it
+            except BaseException:
+                await stream.close()
+                raise
+
+        first, stream, it = await self._aretry(open_, deadline)
+
+        async def rest():
+            async for chunk in it:
+                d = self._delta(chunk)
+                if d:
+                    yield d
+        return first, rest(), stream
+
+
+_PROVIDERS: Dict[Tuple[str, str], Provider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: str, model: Optional[str] = None) -> Provider:
+    key = (name, model or default_model(name))
+    p = _PROVIDERS.get(key)
+    if p is None:
+        with _providers_lock:
+            p = _PROVIDERS.setdefault(key, Provider(*key))
+    return p
+
+
+def circuit_states() -> Dict[str, str]:
+    return {p.breaker.name: p.breaker.state for p in list(_PROVIDERS.values())}
+
+
+def _pair(name: str, model: Optional[str]) -> Tuple[Provider, Optional[Provider]]:
+    primary = get_provider(name, model)
+    if HEDGE_AFTER <= 0:
+        return primary, None
+    backup_name = HEDGE_PROVIDER or name
+    backup_model = HEDGE_MODEL or (primary.model if backup_name == name else None)
+    return primary, get_provider(backup_name, backup_model)
+
+
+# ========== ヘッジ ==========
+_HEDGE_POOL: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _hedge_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _HEDGE_POOL
+    if _HEDGE_POOL is None:
+        with _providers_lock:
+            if _HEDGE_POOL is None:
+                _HEDGE_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+    return _HEDGE_POOL
+
+
+def _hedged(call: Callable[[Provider], Any], primary: Provider, backup: Provider, deadline: float) -> Any:
+    # 同期版。負けた方のスレッドは止められないので、試行の timeout まで走って結果を捨てる
+    pool = _hedge_pool()
+    first = pool.submit(call, primary)
+    try:
+        return first.result(timeout=HEDGE_AFTER)
+    except concurrent.futures.TimeoutError:
+        pass
+    except Exception as e:
+        log.warning("%s failed, hedging to %s: %s", primary.breaker.name, backup.breaker.name, e)
+    metrics.LLM_CALLS.inc(backup.breaker.name, "hedge")
+    errors: List[BaseException] = []
+    pending = {first: primary, pool.submit(call, backup): backup}
+    while pending:
+        done, _ = concurrent.futures.wait(
+            pending, timeout=max(0.0, deadline - time.monotonic()), return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        if not done:
+            break
+        for f in done:
+            p = pending.pop(f)
+            if f.exception() is None:
+                if p is backup:
+                    metrics.LLM_CALLS.inc(backup.breaker.name, "hedge_win")
+                return f.result()
+            errors.append(f.exception())
+    raise errors[0] if errors else TimeoutError("LLM deadline exceeded")
+
+
+async def _ahedged(
+    start: Callable[[Provider], Awaitable[Any]], primary: Provider, backup: Provider, deadline: float,
+    discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+) -> Any:
+    """主系が HEDGE_AFTER 秒で終わらなければ副系も走らせ、先に成功した方の結果を返す。負けた方は取り消す（済んでいれば discard）"""
+    tasks = {asyncio.ensure_future(start(primary)): primary}
+    errors: List[BaseException] = []
+    hedged = False
+    try:
+        while tasks:
+            timeout = max(0.0, deadline - time.monotonic()) if hedged else HEDGE_AFTER
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                p = tasks.pop(t)
+                if t.exception() is None:
+                    if p is backup:
+                        metrics.LLM_CALLS.inc(backup.breaker.name, "hedge_win")
+                    return t.result()
+                errors.append(t.exception())
+                log.warning("%s failed: %s", p.breaker.name, t.exception())
+            if not hedged:
+                hedged = True
+                metrics.LLM_CALLS.inc(backup.breaker.name, "hedge")
+                tasks[asyncio.ensure_future(start(backup))] = backup
+            elif not done:
+                break  # 締め切り
+        raise errors[0] if errors else TimeoutError("LLM deadline exceeded")
+    finally:
+        for t in tasks:
+            if t.done() and not t.cancelled() and t.exception() is None:
+                if discard is not None:
+                    await discard(t.result())
+            else:
+                t.cancel()
+
+
+# ========== llm.py から使う入口 ==========
+def chat(name: str, messages: list[dict], model: Optional[str] = None) -> str:
+    deadline = time.monotonic() + DEADLINE
+    primary, backup = _pair(name, model)
+    if backup is None:
+        return primary.chat(messages, deadline)
+    return _hedged(lambda p: p.chat(messages, deadline), primary, backup, deadline)
+
+
+async def achat(name: str, messages: list[dict], model: Optional[str] = None) -> str:
+    deadline = time.monotonic() + DEADLINE
+    primary, backup = _pair(name, model)
+    if backup is None:
+        return await primary.achat(messages, deadline)
+    return await _ahedged(lambda p: p.achat(messages, deadline), primary, backup, deadline)
+
+
+async def astream(name: str, messages: list[dict], model: Optional[str] = None):
+    """差分テキストを順に yield する。ヘッジ・再試行は最初の差分が届くまで"""
+    deadline = time.monotonic() + DEADLINE
+    primary, backup = _pair(name, model)
+    if backup is None:
+        first, rest, stream = await primary.aopen_stream(messages, deadline)
+    else:
+        first, rest, stream = await _ahedged(
+            lambda p: p.aopen_stream(messages, deadline), primary, backup, deadline,
+            discard=lambda r: r[2].close(),
+        )
+    try:
+        if first:
+            yield first
+        async for d in rest:
+            yield d
+    finally:
+        await stream.close()
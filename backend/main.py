@@ -1,14 +1,31 @@
 from __future__ import annotations
 from dotenv import load_dotenv
 load_dotenv()  # backend/.env を読み込む（最優先で読み込む）
+import logging
+import os
+import time
+# RAG_LOG_LEVEL=DEBUG でスコア配列などの詳細も出る（既定 INFO）
+logging.basicConfig(
+    level=os.getenv("RAG_LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
 from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from store import STORE
-from rag import answer_query
-from ingest_egov import DATA_DIR
-from pathlib import Path
-import json, re
+from rag import answer_query_async, answer_query_stream
+from llm import aclose_clients
+from llm_provider import circuit_states
+from llm_cache import LLM_CACHE, CACHE_BYPASS
+from semantic_cache import SEMANTIC_CACHE
+from ingest_egov import ingested_path
+from jobs import JOBS
+from jp_tokenize import token_cache_info
+import metrics
+import router
+import json
+
+log = logging.getLogger(__name__)
 
 
 app = FastAPI(title="CivilCode RAG")
@@ -19,79 +36,186 @@ app.add_middleware(
 )
 
 
+# /metrics で読む値（件数・キャッシュの命中数など）
+metrics.register_gauge("rag_index_docs", "Documents in the current index snapshot.", lambda: len(STORE))
+metrics.register_gauge("rag_index_generation", "Index snapshot generation.", lambda: STORE.generation)
+metrics.register_gauge(
+    "rag_llm_cache_events_total", "LLM response cache events.",
+    lambda: {k: v for k, v in LLM_CACHE.info().items() if k in LLM_CACHE.stats}, kind="counter",
+)
+metrics.register_gauge(
+    "rag_semantic_cache_events_total", "Semantic answer cache events.",
+    lambda: {k: v for k, v in SEMANTIC_CACHE.info().items() if k in SEMANTIC_CACHE.stats}, kind="counter",
+)
+metrics.register_gauge(
+    "rag_llm_circuit_open", "1 while the provider:model circuit breaker is open or half-open.",
+    lambda: {k: float(v != "closed") for k, v in circuit_states().items()},
+)
+metrics.register_gauge(
+    "rag_token_cache_events_total", "Query tokenization cache events.",
+    lambda: {k: v for k, v in token_cache_info().items() if k in ("hits", "misses")}, kind="counter",
+)
 
-DATA_FILE = Path(__file__).parent / "data" / "ingested" / "civilcode_egov.json"
 
-def normalize_query(q: str) -> dict:
-    q = (q or "").strip()
-    digits = re.findall(r"\d+", q)
-    num = digits[0] if digits else None
-    label = f"第{num}条" if num else q
-    return {"label": label, "num": num}
+@app.middleware("http")
+async def _observe_requests(request: Request, call_next):
+    # ルートのパス（/laws/{law} など）ごとの所要時間。ストリーミングはヘッダを返すまで
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", "<unmatched>")
+        metrics.REQUEST_SECONDS.observe(route, time.perf_counter() - t0)
+        metrics.REQUESTS.inc(route, str(status))
 
 
 @app.on_event("startup")
 def _startup():
     STORE.load()
+    if STORE.vector_index is not None:
+        # ルータの例文の埋め込みは最初の /search の中ではなくここで（キャッシュがあれば読むだけ）
+        router.warm()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    JOBS.shutdown()
+    await aclose_clients()
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "docs": len(STORE)}
+    return {"status": "ok", "docs": len(STORE), "generation": STORE.generation}
 """"
 @app.get("/search")
 def search(query: str = Query(..., description="自然言語の質問")):
     return answer_query(query)"""
 
 @app.get("/search")
-def search(
+async def search(
+    query: str = Query(..., description="自然言語の質問"),
+    mode: str | None = Query(None, description="empathetic|lawyer|neutral の将来拡張用"),
+    nocache: bool = Query(False, description="LLM 応答キャッシュ・意味キャッシュを使わない"),
+    timings: bool = Query(False, description="段ごとの所要時間（ms）を応答に含める"),
+):
+    CACHE_BYPASS.set(nocache)
+    # LLM 待ちの間はワーカーを解放（スレッドを占有しない）
+    with metrics.collect_timings(timings) as t:
+        result = await answer_query_async(query, mode=mode)
+    # result は意味キャッシュにも入っているので書き換えずに足す
+    return {**result, "timings": metrics.timings_ms(t)} if timings else result
+
+@app.get("/search/stream")
+async def search_stream(
     query: str = Query(..., description="自然言語の質問"),
-    mode: str | None = Query(None, description="empathetic|lawyer|neutral の将来拡張用")
+    mode: str | None = Query(None, description="empathetic|lawyer|neutral の将来拡張用"),
+    nocache: bool = Query(False, description="LLM 応答キャッシュ・意味キャッシュを使わない"),
+    timings: bool = Query(False, description="段ごとの所要時間（ms）を done イベントに含める"),
 ):
-    return answer_query(query, mode=mode)
+    # Server-Sent Events：検索結果（sources）を先に返し、回答は生成されたそばから流す
+    async def events():
+        CACHE_BYPASS.set(nocache)
+        try:
+            with metrics.collect_timings(timings) as t:
+                async for event, data in answer_query_stream(query, mode=mode):
+                    if event == "done" and timings:
+                        data = {**data, "timings": metrics.timings_ms(t)}
+                    yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            log.warning("search stream failed: %s", e)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/sources")
 def sources():
     # 現在ロードされている文書の一覧
-    return STORE.docs[:100]
-
-@app.get("/laws/civilcode")
-def get_civilcode(q: str = Query(..., description="例: 第二条 / 第2条 / 2条 / 第709条")):
-    if not DATA_FILE.exists():
-        return JSONResponse(status_code=404, content={"error": "data file not found"})
-
-    data = json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    norm = normalize_query(q)
-    label, num = norm["label"], norm["num"]
-
-    hit = None
-    if num:
-        hit = next((
-            d for d in data
-            if re.sub(r"\D", "", d.get("article_label","")) == str(num)
-            or d.get("id","").endswith(f":第{num}条")
-        ), None)
-    if not hit:
-        hit = next((
-            d for d in data
-            if d.get("article_label") == label
-            or d.get("article","").startswith(label)
-        ), None)
-
+    return [d.to_dict() for d in STORE.docs[:100]]
+
+@app.get("/laws/{law}")
+def get_article(law: str, q: str = Query(..., description="例: 第二条 / 第2条 / 2条 / 第709条")):
+    # law は法令キー（civilcode / commercialcode / landlease / consumercontract …）
+    snap = STORE.snapshot()
+    if not snap.article_index.get(law):
+        loaded = sorted(k for k, v in snap.article_index.items() if v)
+        return JSONResponse(status_code=404, content={"error": f"unknown law: {law}", "laws": loaded})
+
+    # 起動時（と /ingest/egov 後）に作った条番号索引を引くだけ
+    hit = snap.lookup_article(law, q)
     if not hit:
         return JSONResponse(status_code=404, content={"error": f"not found: {q}"})
     return hit
 
-@app.post("/ingest/egov")
-def ingest_from_egov():
-    # 事前に ingest_egov.py をCLIで実行しても同じ
-    from ingest_egov import fetch_civil_code_xml, parse_law_xml, save_json
-    xml_bytes = fetch_civil_code_xml()
-    docs = parse_law_xml(xml_bytes)
-    out = DATA_DIR / "civilcode_egov.json"
-    save_json(docs, out)
-    # 再ロード
+def _reload() -> dict:
     STORE.load()
-    return {"ingested": len(docs)}
+    # 条文が変わったので、古い索引で作った回答は言い換え再利用しない
+    SEMANTIC_CACHE.clear()
+    return STORE.last_load
+
+
+def _ingest_egov_job() -> dict:
+    from ingest_egov import fetch_civil_code_xml, ingest
+    xml_bytes = fetch_civil_code_xml()
+    out = ingested_path("civilcode")
+    diff = ingest(xml_bytes, out)
+    # 変わった条があった時だけ再ロード（変わっていない条のトークン・埋め込みは前回の索引から流用）
+    index = _reload() if diff["written"] else STORE.last_load
+    return {"ingested": diff["added"] + diff["changed"] + diff["unchanged"], **diff, "index": index}
+
+
+@app.post("/ingest/egov", status_code=202)
+def ingest_from_egov():
+    # 事前に ingest_egov.py をCLIで実行しても同じ（その場合は /reindex で読み直す）
+    # 取得・再構築はバックグラウンド。終わるまで検索は今の索引で応答し続け、完成したら参照ごと差し替える
+    return JOBS.submit("ingest_egov", _ingest_egov_job)
+
+
+def _ingest_laws_job(laws: list[str]) -> dict:
+    from bulk_ingest import bulk_ingest
+    res = bulk_ingest(laws)
+    res["index"] = _reload() if res["written"] else STORE.last_load
+    return res
+
+
+@app.post("/ingest/laws", status_code=202)
+def ingest_laws(laws: str = Query("", description="カンマ区切りの法令キー/法令ID（空なら登録済みの全法令）")):
+    names = [x.strip() for x in laws.split(",") if x.strip()]
+    return JOBS.submit("ingest_laws", lambda: _ingest_laws_job(names))
+
+
+@app.post("/reindex", status_code=202)
+def reindex():
+    return JOBS.submit("reindex", _reload)
+
+
+@app.get("/jobs")
+def list_jobs():
+    return JOBS.list()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"job not found: {job_id}"})
+    return job
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Prometheus のテキスト形式（段ごとの所要時間ヒストグラム・HTTP 遅延・キャッシュ命中数）
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/llm-cache")
+def debug_llm_cache():
+    # 命中率など（件数は /metrics にも出る）
+    return LLM_CACHE.info()
+
+@app.get("/debug/semantic-cache")
+def debug_semantic_cache():
+    return SEMANTIC_CACHE.info()
 
 @app.get("/debug/echo")
 def debug_echo(q: str = "", request: Request = None):
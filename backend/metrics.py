@@ -0,0 +1,167 @@
+# backend/metrics.py
+# 段ごとの所要時間（スパン）を Prometheus 形式のヒストグラムに貯め、/metrics で出す。
+#   with span("route"): ...            1 区間を計って rag_stage_seconds{stage="route"} に入れる
+#   @timed("llm_answer")               関数（同期・async どちらも）の呼び出しを 1 区間として計る
+#   observe("search.bm25", sec)        自前で計った秒数を入れる（search の段ごとの計測）
+#   with collect_timings() as t: ...   この中で計った区間をリクエスト単位でも集める（/search?timings=1 の応答用）
+# 依存を増やさないため prometheus_client は使わずテキスト形式を自前で出す。
+# 値はプロセスごと（uvicorn のワーカーを複数立てる場合はワーカーごとにスクレイプされる前提）。
+from __future__ import annotations
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# 秒。LLM 呼び出し（数秒）から検索の各段（1ms 未満）まで収まるように
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# リクエスト単位の段ごとの秒数（None なら集めない）。asyncio.to_thread に渡しても同じ dict を共有する
+REQUEST_TIMINGS: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._series: Dict[str, List[float]] = {}   # ラベル値 -> [各バケットの件数..., +Inf の件数, 合計]
+        self._lock = threading.Lock()
+
+    def observe(self, value: str, sec: float) -> None:
+        i = bisect.bisect_left(self.buckets, sec)
+        with self._lock:
+            s = self._series.get(value)
+            if s is None:
+                s = self._series[value] = [0.0] * (len(self.buckets) + 2)
+            s[i] += 1
+            s[-1] += sec
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, s in sorted(series.items()):
+            lab = f'{self.label}="{_escape(value)}"'
+            acc = 0.0
+            for le, c in zip(self.buckets, s):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{lab},le="{le}"}} {acc:g}')
+            acc += s[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{lab},le="+Inf"}} {acc:g}')
+            lines.append(f"{self.name}_sum{{{lab}}} {s[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{lab}}} {acc:g}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values: str, by: float = 1.0) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + by
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, v in sorted(values.items()):
+            lab = ",".join(f'{k}="{_escape(x)}"' for k, x in zip(self.labels, key))
+            lines.append(f"{self.name}{{{lab}}} {v:g}")
+        return lines
+
+
+def _escape(s: str) -> str:
+    return str(s).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each RAG pipeline stage.", "stage")
+REQUEST_SECONDS = Histogram("rag_http_request_seconds", "HTTP request latency by route.", "route")
+REQUESTS = Counter("rag_http_requests_total", "HTTP requests by route and status.", ("route", "status"))
+LLM_CALLS = Counter(
+    "rag_llm_calls_total", "LLM provider attempts by outcome (ok, retry, error, circuit_open, hedge, hedge_win).",
+    ("provider", "outcome"),
+)
+
+# /metrics を出す時に読む値（件数・キャッシュ命中数など）。name -> (help, type, 値を返す関数)
+_GAUGES: Dict[str, Tuple[str, str, Callable[[], Dict[str, float] | float]]] = {}
+
+
+def register_gauge(name: str, help: str, fn: Callable[[], Dict[str, float] | float], kind: str = "gauge") -> None:
+    """fn は数値か {ラベル値: 数値}（ラベル名は "kind"）を返す。"""
+    _GAUGES[name] = (help, kind, fn)
+
+
+def observe(stage: str, sec: float) -> None:
+    STAGE_SECONDS.observe(stage, sec)
+    t = REQUEST_TIMINGS.get()
+    if t is not None:
+        t[stage] = t.get(stage, 0.0) + sec
+
+
+@contextlib.contextmanager
+def span(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        sec = time.perf_counter() - t0
+        observe(stage, sec)
+        log.debug("span %s %.2fms", stage, sec * 1000)
+
+
+def timed(stage: str):
+    """関数の呼び出し 1 回を span(stage) で囲むデコレータ（async 関数にも使える）。"""
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+@contextlib.contextmanager
+def collect_timings(on: bool = True) -> Iterator[Dict[str, float]]:
+    """この中で計った区間を段ごとに足し込んだ dict を返す（on=False なら集めず空のまま）。"""
+    t: Dict[str, float] = {}
+    token = REQUEST_TIMINGS.set(t if on else None)
+    try:
+        yield t
+    finally:
+        REQUEST_TIMINGS.reset(token)
+
+
+def timings_ms(t: Dict[str, float]) -> Dict[str, float]:
+    return {k: round(v * 1000, 3) for k, v in t.items()}
+
+
+def render() -> str:
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render() + REQUESTS.render() + LLM_CALLS.render()
+    for name, (help, kind, fn) in sorted(_GAUGES.items()):
+        try:
+            v = fn()
+        except Exception as e:
+            log.warning("metric %s failed: %s", name, e)
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        if isinstance(v, dict):
+            lines += [f'{name}{{kind="{_escape(k)}"}} {float(x):g}' for k, x in sorted(v.items())]
+        else:
+            lines.append(f"{name} {float(v):g}")
+    return "\n".join(lines) + "\n"
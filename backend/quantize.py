@@ -0,0 +1,111 @@
+# backend/quantize.py
+# 文書埋め込みの圧縮保存と、圧縮したままの内積計算。
+#   float16 : そのまま半精度（1/2）
+#   int8    : 行ごとのスケール（max|x|/127）で対称量子化（1/4 ＋ 行あたり 4 バイト）
+# 採点はブロック単位で float32 に戻して BLAS に渡すので、一時メモリはブロック分だけで済む。
+# 上位候補だけ float32 原本（mmap）で採点し直す再ランクは vector_index.ExactIndex.search() 側で行う
+# （融合の全件スコアは圧縮行列だけ。再ランクは候補の行をばらばらに読むので、続けるうちに原本のページもほぼ常駐する。
+#   常駐を圧縮分だけにしたい時は RAG_RERANK_K=0）。
+# 環境変数:
+#   RAG_EMBED_DTYPE=float32|float16|int8   既定 float32（圧縮しない）
+#   RAG_RERANK_K=100                       float32 で採点し直す上位件数（0 で再ランクしない）
+from __future__ import annotations
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+EMBED_DTYPE = os.getenv("RAG_EMBED_DTYPE", "float32").lower()
+RERANK_K = int(os.getenv("RAG_RERANK_K", "100"))
+BLOCK_ROWS = 8192
+
+
+class QuantizedMatrix:
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.data = data        # (N, d) int8 / float16
+        self.scales = scales    # (N,) float32（int8 のみ）
+
+    @property
+    def kind(self) -> str:
+        return "int8" if self.scales is not None else "float16"
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @classmethod
+    def from_float(cls, x, kind: str) -> "QuantizedMatrix":
+        x = np.asarray(x, dtype=np.float32)
+        if kind == "float16":
+            return cls(x.astype(np.float16))
+        if kind != "int8":
+            raise ValueError(f"unknown embedding dtype: {kind}")
+        scales = np.abs(x).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(data, scales.astype(np.float32))
+
+    def __getitem__(self, rows) -> np.ndarray:
+        # 指定行を float32 に戻す（IVF のリスト内採点など）
+        block = self.data[rows].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows][..., None]
+        return block
+
+    def dot(self, q_vecs: np.ndarray) -> np.ndarray:
+        """(nq, d) のクエリとの内積を (nq, N) で。"""
+        q = np.atleast_2d(np.asarray(q_vecs, dtype=np.float32))
+        n = len(self.data)
+        out = np.empty((len(q), n), dtype=np.float32)
+        for lo in range(0, n, BLOCK_ROWS):
+            hi = min(lo + BLOCK_ROWS, n)
+            out[:, lo:hi] = q @ self.data[lo:hi].astype(np.float32).T
+        if self.scales is not None:
+            out *= self.scales[None, :]
+        return out
+
+    # ---------- 永続化 ----------
+    def save(self, d: Path) -> None:
+        np.save(d / f"embeddings-{self.kind}.npy", self.data)
+        if self.scales is not None:
+            np.save(d / "embeddings-int8-scale.npy", self.scales)
+
+    @classmethod
+    def load(cls, d: Path, kind: str) -> Optional["QuantizedMatrix"]:
+        path = d / f"embeddings-{kind}.npy"
+        if not path.exists():
+            return None
+        data = np.load(path, mmap_mode="r")
+        scales = np.load(d / "embeddings-int8-scale.npy", mmap_mode="r") if kind == "int8" else None
+        return cls(data, scales)
+
+
+if __name__ == "__main__":
+    # 手元確認用：python quantize.py で、乱数（またはロード済みコーパス）の埋め込みに対する
+    # 圧縮率・再現率@10（float32 厳密検索比）・1クエリあたりの遅延を表示
+    from vector_index import ExactIndex, measure_recall
+    from store import STORE
+    STORE.load()
+    emb = STORE.embeddings
+    if emb is None:
+        rng = np.random.default_rng(0)
+        emb = rng.normal(size=(20000, 384)).astype(np.float32)
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    emb = np.asarray(emb, dtype=np.float32)
+    rng = np.random.default_rng(1)
+    q = emb[rng.choice(len(emb), 200)] + rng.normal(scale=0.05, size=(200, emb.shape[1]))
+    q = (q / np.linalg.norm(q, axis=1, keepdims=True)).astype(np.float32)
+    print({"dtype": "float32", "bytes": emb.nbytes, **measure_recall(ExactIndex(emb), emb, q, 10)})
+    for kind in ("float16", "int8"):
+        qm = QuantizedMatrix.from_float(emb, kind)
+        for rerank in (0, RERANK_K):
+            idx = ExactIndex(emb, quantized=qm, rerank_k=rerank)
+            print({"dtype": kind, "rerank_k": rerank, "bytes": qm.nbytes, **measure_recall(idx, emb, q, 10)})
@@ -1,16 +1,56 @@
 from __future__ import annotations
+import asyncio
+import logging
 from typing import Dict, Any, List
-from llm import llm_route, llm_answer_from_context, llm_pick_used_articles
+from llm import llm_answer_from_context
+from llm import llm_searchtext_async, llm_answer_from_context_async
+from llm import llm_answer_from_context_stream
 from search import retrieve_candidates
 from risk import detect_risk_flags
+from citations import pick_used_articles, pick_used_articles_async
+from router import route_query, route_query_async
+from store import STORE
+from llm_cache import CACHE_BYPASS
+from semantic_cache import SEMANTIC_CACHE
+from metrics import span, timed
+
+log = logging.getLogger(__name__)
 
 
 CIVIL_ONLY_NOTE = "このサービスは民法に特化しています。刑事・行政の個別判断は対象外です。"
 
+SEMANTIC_PROBE_K = 8  # 意味キャッシュの候補一致判定に使う埋め込みの近傍の件数
+
+
+@timed("semantic_probe")
+def _semantic_probe(query: str):
+    """(質問ベクトル, 埋め込みの近傍上位id, 意味キャッシュ命中) を返す。埋め込み無し/無効時は全て None。"""
+    snap = STORE.snapshot()
+    if not SEMANTIC_CACHE.enabled or snap.vector_index is None or CACHE_BYPASS.get():
+        return None, None, None
+    from embeddings import embed
+    q_vec = embed([query])[0]
+    # 「同じ論点か」は埋め込みの近傍上位で確かめる（融合検索は命中しなければ捨てるので回さない）
+    rows, _ = snap.vector_index.search(q_vec[None, :], SEMANTIC_PROBE_K)
+    ids = [snap.docs.str_at("id", int(r)) for r in rows[0] if r >= 0]
+    return q_vec, ids, SEMANTIC_CACHE.lookup(q_vec, ids)
+
+
+def _from_semantic_hit(query: str, hit: dict) -> Dict[str, Any]:
+    res = dict(hit["result"])
+    res["warnings"] = _warnings(query, res.get("router", {}))  # 危険語フラグは今回の質問で出し直す
+    res["cache"] = {"semantic": True, "similarity": hit["similarity"], "matched_query": hit["query"]}
+    return res
+
+
 def answer_query(query: str, mode: str | None = None) -> Dict[str, Any]:
-    route = llm_route(query)
+    q_vec, probe_ids, hit = _semantic_probe(query)
+    if hit:
+        return _from_semantic_hit(query, hit)
+    # ローカルルータで足りなければ llm_route（router.py）
+    route = route_query(query, q_vec)
     domain = route.get("domain","other")
-    print("route : ",route)
+    log.debug("route: %s", route)
     """
     if domain in ("criminal","other"):
         msg = (
@@ -27,13 +67,74 @@ def answer_query(query: str, mode: str | None = None) -> Dict[str, Any]:
 """
     # 取得（ヒント優先 + RRF/MMR 補完）
     #hits = retrieve_candidates(query, route.get("law_hints", []))  # 8件程度
-    hits = retrieve_candidates(query, route.get("law_hints", []), route.get("search_terms", []), route.get("civil_topics", []))
+    hits = retrieve_candidates(query, route.get("law_hints", []), route.get("search_terms", []), route.get("civil_topics", []), query_vec=q_vec)
     # 回答
     answer = llm_answer_from_context(query, hits[:4])
-    # 使用条文の選定（id配列）
-    used_ids = llm_pick_used_articles(answer, hits)
+    # 使用条文の選定（id配列）。回答本文の出典表記から拾い、拾えない時だけ LLM（citations.py）
+    used_ids = pick_used_articles(answer, hits)
     ##print("hits : ", hits)
+    result = _build_result(query, route, hits, answer, used_ids)
+    if q_vec is not None:
+        SEMANTIC_CACHE.put(query, q_vec, probe_ids, result)
+    return result
+
+
+async def answer_query_async(query: str, mode: str | None = None) -> Dict[str, Any]:
+    """answer_query の非同期版。ルータと検索語拡張はどちらもクエリだけに依存するので並行に投げる。"""
+    q_vec, probe_ids, hit = await asyncio.to_thread(_semantic_probe, query)
+    if hit:
+        return _from_semantic_hit(query, hit)
+    route, kws_llm = await asyncio.gather(route_query_async(query, q_vec), llm_searchtext_async(query))
+    log.debug("route: %s", route)
+    # 検索は CPU 処理なのでイベントループを塞がないようスレッドへ
+    hits = await asyncio.to_thread(
+        retrieve_candidates, query, route.get("law_hints", []), route.get("search_terms", []),
+        route.get("civil_topics", []), llm_keywords=kws_llm, query_vec=q_vec,
+    )
+    answer = await llm_answer_from_context_async(query, hits[:4])
+    used_ids = await pick_used_articles_async(answer, hits)
+    result = _build_result(query, route, hits, answer, used_ids)
+    if q_vec is not None:
+        SEMANTIC_CACHE.put(query, q_vec, probe_ids, result)
+    return result
+
 
+async def answer_query_stream(query: str, mode: str | None = None):
+    """answer_query_async を段階ごとに (event, data) で流す（/search/stream 用）。
+    router → sources（検索が済んだ時点） → token（回答の差分）… → used_sources → done
+    """
+    q_vec, probe_ids, hit = await asyncio.to_thread(_semantic_probe, query)
+    if hit:
+        res = _from_semantic_hit(query, hit)
+        yield "router", res.get("router", {})
+        yield "sources", {"sources": res["sources"], "warnings": res["warnings"]}
+        yield "token", {"text": res["answer"]}
+        yield "used_sources", {"used_sources": res["used_sources"]}
+        yield "done", {"answer": res["answer"], "cache": res["cache"]}
+        return
+    route, kws_llm = await asyncio.gather(route_query_async(query, q_vec), llm_searchtext_async(query))
+    yield "router", route
+    hits = await asyncio.to_thread(
+        retrieve_candidates, query, route.get("law_hints", []), route.get("search_terms", []),
+        route.get("civil_topics", []), llm_keywords=kws_llm, query_vec=q_vec,
+    )
+    yield "sources", {"sources": hits, "warnings": _warnings(query, route)}
+
+    parts: List[str] = []
+    with span("llm_answer"):
+        async for delta in llm_answer_from_context_stream(query, hits[:4]):
+            parts.append(delta)
+            yield "token", {"text": delta}
+    answer = "".join(parts)
+
+    used_ids = await pick_used_articles_async(answer, hits)
+    yield "used_sources", {"used_sources": _used_sources(hits, used_ids)}
+    if q_vec is not None:
+        SEMANTIC_CACHE.put(query, q_vec, probe_ids, _build_result(query, route, hits, answer, used_ids))
+    yield "done", {"answer": answer}
+
+
+def _used_sources(hits: List[Dict[str, Any]], used_ids: List[str]) -> List[Dict[str, Any]]:
     # used_sources を構築（フロントがそれだけカード化できるように）
     used_map = {h["id"]: h for h in hits}
     #print("used_map : ", used_map)
@@ -48,22 +149,25 @@ def answer_query(query: str, mode: str | None = None) -> Dict[str, Any]:
                 "text": h.get("text",""),
                 "score": h.get("score", 0.0),
             })
+    return used_sources
 
-    #print("used sources : ", used_sources)
 
+def _warnings(query: str, route: dict) -> List[str]:
+    domain = route.get("domain","other")
     if domain in ("criminal","other"):
-        warnings = ["この内容は民法の範囲を超える可能性が高いです。他の法律を包括的に考える場合は別ツールの採用または弁護士への相談をしてください。", *detect_risk_flags(query)]
-    else:
-        warnings = ["AIの出力は法的助言ではない。個別事情は弁護士へ。", *detect_risk_flags(query)]
+        return ["この内容は民法の範囲を超える可能性が高いです。他の法律を包括的に考える場合は別ツールの採用または弁護士への相談をしてください。", *detect_risk_flags(query)]
+    return ["AIの出力は法的助言ではない。個別事情は弁護士へ。", *detect_risk_flags(query)]
+
+
+def _build_result(query: str, route: dict, hits: List[Dict[str, Any]], answer: str, used_ids: List[str]) -> Dict[str, Any]:
     return {
         "answer": answer,
-        "warnings": warnings,
+        "warnings": _warnings(query, route),
         "router": route,        # デバッグ用（不要なら削除可）
         "sources": hits,        # 取得した全候補（従来互換）
-        "used_sources": used_sources  # ← これだけをカード表示に使う
+        "used_sources": _used_sources(hits, used_ids)  # ← これだけをカード表示に使う
     }
 
-
 """
 def answer_query(query: str, k: int = 8) -> Dict[str, Any]:
     hits = hybrid_search(query, top_k=k)
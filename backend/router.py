@@ -0,0 +1,257 @@
+# backend/router.py
+# ローカルのクエリルータ（llm_route の前段の高速経路）。llm_route と同じ形
+# {"domain", "civil_topics", "law_hints", "search_terms"} を返し、自信が無い時だけ LLM に回す。
+#   1) 概念辞書（legal_concepts）: 口語 → 法的概念 → civil_topics / search_terms、概念 → 条番号 → law_hints
+#   2) ラベル付き例文（data/router_exemplars.jsonl）を (domain, law_hints) ごとのクラスにまとめ、一番近いクラスの
+#      domain / law_hints / civil_topics を採る。類似度は内容語と文字 2-gram の idf 重み付き cos、
+#      confidence は 1 位と 2 位の差。質問ベクトルがあれば例文の埋め込みの kNN 投票と混ぜてクラスを選ぶ
+#      （例文の埋め込みは起動時に warm() で作るかディスクから読む。リクエストの中では作らない）
+#   3) 刑事手続きの語（逮捕・被害届…）: criminal / mixed の判定
+# 環境変数:
+#   RAG_ROUTER=hybrid   ローカルで confidence が足りない時だけ llm_route（既定）
+#             =local    LLM を使わない
+#             =llm      常に llm_route（従来どおり）
+#   RAG_ROUTER_MIN_CONFIDENCE=0.5
+#   RAG_ROUTER_EXEMPLARS=パス
+# GROQ_API_KEY が無ければ hybrid でも LLM は呼ばない（回答も llm.py が抽出要約に切り替えるので、キー無しでも最後まで動く）。
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from jp_tokenize import ja_tokens, normalize_text
+from keyword_match import KeywordMatcher
+from legal_concepts import concept_articles, expand_concepts
+from llm import llm_route, llm_route_async
+from metrics import timed
+
+log = logging.getLogger(__name__)
+
+ROUTER_MODE = os.getenv("RAG_ROUTER", "hybrid").lower()
+MIN_CONFIDENCE = float(os.getenv("RAG_ROUTER_MIN_CONFIDENCE", "0.5"))
+EXEMPLARS_PATH = Path(os.getenv("RAG_ROUTER_EXEMPLARS") or Path(__file__).parent / "data" / "router_exemplars.jsonl")
+
+KNN_K = 5                 # 埋め込みの kNN 投票に使う近傍数（語彙側も上位 KNN_K クラスの割合にして揃える）
+VEC_WEIGHT = float(os.getenv("RAG_ROUTER_VEC_WEIGHT", "0.5"))   # 埋め込みの投票の重み（残りが語彙側）
+MARGIN_SCALE = 0.12       # 1 位と 2 位のクラスの類似度の差をこれで割ったものが confidence（下記の較正を参照）
+RULE_BONUS = 0.3          # 刑事手続きの語と kNN の判定が一致した時に足す（条を持たない criminal / other だけ）
+RULE_CONFIDENCE = 0.4     # 辞書・刑事語の判定や、埋め込みで語彙側の 1 位と別のクラスになった時の confidence の上限（既定の閾値未満 = LLM に回る）
+MAX_HINTS, MAX_TOPICS, MAX_TERMS = 4, 5, 8
+# 較正: 例文を 1 つずつ抜いて残りで引き直す（leave-one-out, 243 件）と、domain と条の先頭が正しい割合は
+# confidence >= 0.5（差 0.06 以上）で 96%、>= 0.4 で 91%、全体では 67%。差の小さいものは LLM に回す
+# （語彙だけの場合。埋め込みを混ぜた時も confidence は語彙側の差のままで、選ぶクラスが語彙側の 1 位と違えば上限を掛ける）
+
+# 刑事手続きの語。「罪」単独は「謝罪広告」に当たるので使わない
+_CRIMINAL_TERMS = [
+    "逮捕", "警察", "刑事", "起訴", "告訴", "被害届", "前科", "罰金", "懲役", "禁錮", "執行猶予",
+    "検挙", "書類送検", "犯罪", "有罪", "無罪", "万引き", "窃盗", "傷害罪", "詐欺罪", "通報",
+]
+_CRIMINAL = KeywordMatcher(_CRIMINAL_TERMS)
+_CONTENT_RE = re.compile(r"[一-龥々〆ァ-ヶーA-Za-z0-9０-９]")   # 助詞・助動詞だけのトークンは特徴にしない
+_WORD_RE = re.compile(r"[一-龥々〆ァ-ヶーA-Za-z0-9０-９ぁ-ん]")
+
+
+def _features(text: str) -> frozenset:
+    """内容語と文字 2-gram（「飼い犬」と「飼い主」のように形態素が割れても重なる所を拾う。かなだけの 2-gram は語尾なので除く）"""
+    norm = normalize_text(text)
+    feats = {("w", t) for t in ja_tokens(norm) if _CONTENT_RE.search(t)}
+    feats |= {("c", norm[i:i + 2]) for i in range(len(norm) - 1)
+              if _WORD_RE.match(norm[i]) and _WORD_RE.match(norm[i + 1]) and _CONTENT_RE.search(norm[i:i + 2])}
+    return frozenset(feats)
+
+
+def _label(row: Dict[str, Any]) -> tuple:
+    return (row.get("domain", "other"), tuple(str(h.get("article", "")) for h in row.get("law_hints", [])))
+
+
+class _Exemplars:
+    """例文を (domain, law_hints) が同じもの同士でクラスにまとめ、クラスごとの特徴（例文＋トピック・検索語・条の通称）を
+    idf ×（1 + log 出現した例文数）で重み付けして持つ。口語の言い換えと法律語の両方から当てるため"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+        self.classes: List[Dict[str, Any]] = []
+        index: Dict[tuple, int] = {}
+        self.row_class: List[int] = []
+        self.vecs: Optional[np.ndarray] = None   # 例文の埋め込み（warm() で入れる）
+        for r in rows:
+            key = _label(r)
+            if key not in index:
+                index[key] = len(self.classes)
+                self.classes.append({"domain": key[0], "law_hints": r.get("law_hints", []), "rows": [], "features": {}})
+            self.row_class.append(index[key])
+            c = self.classes[index[key]]
+            legal = r.get("civil_topics", []) + r.get("search_terms", []) + [h.get("alias", "") for h in r.get("law_hints", [])]
+            feats = _features(r["query"]).union(*(_features(t) for t in legal))
+            c["rows"].append((r, feats))
+            for f in feats:
+                c["features"][f] = c["features"].get(f, 0) + 1
+        df: Dict[tuple, int] = {}
+        for c in self.classes:
+            for f in c["features"]:
+                df[f] = df.get(f, 0) + 1
+        n = len(self.classes)
+        self._idf_default = float(np.log(n + 1) + 1.0)
+        self.idf = {f: float(np.log((n + 1) / (d + 1)) + 1.0) for f, d in df.items()}
+        for c in self.classes:
+            c["weights"] = {f: self.idf[f] * (1.0 + np.log(n_f)) for f, n_f in c["features"].items()}
+            c["norm"] = float(np.sqrt(sum(w * w for w in c["weights"].values())))
+
+    def class_sims(self, feats: frozenset) -> np.ndarray:
+        """質問とクラスの idf 重み付き cos（どのクラスにも無い語も質問側のノルムには入れる = 知らない話題ほど低い）"""
+        if not feats or not self.classes:
+            return np.zeros(len(self.classes))
+        q = {f: self.idf.get(f, self._idf_default) for f in feats}
+        qn = float(np.sqrt(sum(w * w for w in q.values())))
+        return np.asarray([sum(w * c["weights"][f] for f, w in q.items() if f in c["weights"]) / (qn * c["norm"]) if c["norm"] else 0.0
+                           for c in self.classes])
+
+    def nearest_row(self, c: Dict[str, Any], feats: frozenset) -> Dict[str, Any]:
+        """クラスの中で質問と重なる語の idf の和が一番大きい例文（トピック・検索語はこれから採る）"""
+        return max(c["rows"], key=lambda rf: sum(self.idf[f] for f in feats & rf[1]))[0]
+
+    def vec_shares(self, q_vec: np.ndarray) -> tuple:
+        """埋め込みの kNN 投票：(クラスごとの類似度の割合, 類似度順の例文の添字)"""
+        sims = self.vecs @ np.asarray(q_vec, dtype=np.float32)
+        order = np.argsort(-sims, kind="stable")
+        shares = np.zeros(len(self.classes))
+        w = np.clip(sims[order[:KNN_K]], 0.0, None)
+        for i, wi in zip(order[:KNN_K], w):
+            shares[self.row_class[int(i)]] += wi
+        return (shares / shares.sum() if shares.sum() > 0 else shares), order
+
+
+_EXEMPLARS: Optional[_Exemplars] = None
+_load_lock = threading.Lock()
+
+
+def warm() -> None:
+    """例文の埋め込みを用意する（起動時に 1 回。ディスクにあれば読むだけ）。失敗しても語彙だけで動く"""
+    ex = _exemplars()
+    if not ex.rows or ex.vecs is not None:
+        return
+    try:
+        from index_cache import load_or_embed
+        ex.vecs = load_or_embed("router_exemplars", [r["query"] for r in ex.rows])
+    except Exception as e:
+        log.warning("router exemplar embeddings not loaded: %s", e)
+
+
+def _top_shares(sims: np.ndarray) -> np.ndarray:
+    """上位 KNN_K クラスの類似度の割合（残りは 0）。埋め込みの投票と同じ尺度にして混ぜる"""
+    out = np.zeros(len(sims))
+    top = np.argsort(-sims, kind="stable")[:KNN_K]
+    w = np.clip(sims[top], 0.0, None)
+    if w.sum() > 0:
+        out[top] = w / w.sum()
+    return out
+
+
+def _exemplars() -> _Exemplars:
+    global _EXEMPLARS
+    if _EXEMPLARS is None:
+        with _load_lock:
+            if _EXEMPLARS is None:
+                try:
+                    lines = EXEMPLARS_PATH.read_text(encoding="utf-8").splitlines()
+                    rows = [json.loads(l) for l in lines if l.strip()]
+                except (OSError, ValueError) as e:
+                    log.warning("router exemplars not loaded: %s", e)
+                    rows = []
+                _EXEMPLARS = _Exemplars(rows)
+    return _EXEMPLARS
+
+
+@timed("route_local")
+def route_local(query: str, query_vec: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    ex = _exemplars()
+    concepts = expand_concepts(query)
+    criminal = bool(_CRIMINAL.find(normalize_text(query)))
+
+    # 語彙側の 1 位のクラスと、2 位との差から confidence。埋め込みがあれば kNN 投票と混ぜてクラスと例文を選び直す
+    best: Optional[Dict[str, Any]] = None
+    near: Dict[str, Any] = {}
+    knn_domain, knn_conf = "other", 0.0
+    if ex.classes:
+        feats = _features(query)
+        sims = ex.class_sims(feats)
+        order = np.argsort(-sims, kind="stable")
+        lex_top = int(order[0])
+        chosen = lex_top if sims[lex_top] > 0 else None
+        if chosen is not None:
+            margin = float(sims[lex_top] - (sims[order[1]] if len(order) > 1 else 0.0))
+            knn_conf = min(1.0, margin / MARGIN_SCALE)
+        vec_order = None
+        if query_vec is not None and ex.vecs is not None:
+            shares, vec_order = ex.vec_shares(query_vec)
+            blend = (1.0 - VEC_WEIGHT) * _top_shares(sims) + VEC_WEIGHT * shares
+            if blend.max() > 0:
+                chosen = int(np.argmax(blend))
+                if chosen != lex_top:
+                    knn_conf = min(knn_conf, RULE_CONFIDENCE)
+        if chosen is not None:
+            best = ex.classes[chosen]
+            knn_domain = best["domain"]
+            if vec_order is not None:
+                near = ex.rows[next(int(i) for i in vec_order if ex.row_class[int(i)] == chosen)]
+            else:
+                near = ex.nearest_row(best, feats)
+
+    # 辞書の判定（概念語が当たれば民事、刑事手続きの語もあれば mixed。民事側は kNN の判定でもよい）
+    civil = bool(concepts) or knn_domain in ("civil", "mixed")
+    rule_domain = ("mixed" if civil else "criminal") if criminal else ("civil" if concepts else None)
+    if rule_domain is None:
+        domain, confidence = knn_domain, knn_conf
+    elif rule_domain == knn_domain:
+        # 民事は概念語が当たっても条が合っているとは限らないので足さない
+        domain, confidence = rule_domain, knn_conf if rule_domain == "civil" else min(1.0, knn_conf + RULE_BONUS)
+    else:
+        domain, confidence = rule_domain, RULE_CONFIDENCE * (1.0 - knn_conf)
+
+    route: Dict[str, Any] = {"domain": domain, "civil_topics": [], "law_hints": [], "search_terms": []}
+    if domain in ("civil", "mixed"):
+        # 条：1 位のクラスの law_hints ＋概念辞書の条（空きがあれば）
+        hints = list(best["law_hints"]) if best and best["domain"] in ("civil", "mixed") else []
+        have = {str(h.get("article", "")) for h in hints}
+        hints += [{"article": a, "alias": ""} for a in concept_articles(concepts) if a not in have]
+        route["law_hints"] = hints[:MAX_HINTS]
+        route["civil_topics"] = list(dict.fromkeys(near.get("civil_topics", []) + concepts[:3]))[:MAX_TOPICS]
+        route["search_terms"] = list(dict.fromkeys(concepts + near.get("search_terms", [])))[:MAX_TERMS]
+    route["router"] = "local"
+    route["confidence"] = round(float(confidence), 3)
+    return route
+
+
+def _llm_enabled(local: Dict[str, Any]) -> bool:
+    if ROUTER_MODE == "local" or not os.getenv("GROQ_API_KEY"):
+        return False
+    return ROUTER_MODE == "llm" or local["confidence"] < MIN_CONFIDENCE
+
+
+def route_query(query: str, query_vec: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    local = route_local(query, query_vec)
+    if not _llm_enabled(local):
+        return local
+    try:
+        return {**llm_route(query), "router": "llm"}
+    except Exception as e:
+        log.warning("llm_route failed, using local route: %s", e)
+        return local
+
+
+async def route_query_async(query: str, query_vec: Optional[np.ndarray] = None) -> Dict[str, Any]:
+    local = await asyncio.to_thread(route_local, query, query_vec)
+    if not _llm_enabled(local):
+        return local
+    try:
+        return {**(await llm_route_async(query)), "router": "llm"}
+    except Exception as e:
+        log.warning("llm_route failed, using local route: %s", e)
+        return local
@@ -4,8 +4,18 @@ import numpy as np
 #from embeddings import embed
 from store import STORE
 from llm import llm_searchtext
-from jp_tokenize import ja_tokens, normalize_text
-from legal_concepts import expand_concepts, literal_risk_tokens
+from jp_tokenize import ja_tokens, ja_tokens_batch, normalize_text
+from legal_concepts import expand_concepts, concept_tokens, literal_risk_tokens
+from article_num import parse_article, article_code
+from bm25 import weighted_terms, topk
+from vector_index import ANN_TOPK
+from crossref import PAIR
+from metrics import observe, timed
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
 
 # 民法本文での異表記を吸収するための簡易正規化
 LEGAL_CANON = {
@@ -15,17 +25,14 @@ LEGAL_CANON = {
     "ストーカー": "つきまとい"  # 参考（表記差）
 }
 
-PAIR_BONUS = {
-    709: [710, 723, 719],  # 不法行為 → 慰謝料・名誉回復・共同不法行為
-    710: [709, 723],
-    723: [709, 710],
-}
+# 置換先のトークン列は固定なので起動時に一度だけ解析
+_CANON_TOKENS = {k: ja_tokens(v) for k, v in LEGAL_CANON.items()}
 
 def expand_canonical(tokens: list[str]) -> list[str]:
     out = list(tokens)
-    for t in list(tokens):
-        if t in LEGAL_CANON:
-            out.extend(ja_tokens(LEGAL_CANON[t]))
+    for t in tokens:
+        if t in _CANON_TOKENS:
+            out.extend(_CANON_TOKENS[t])
     return out
 
 # Hybrid scoring: cosine(sim) + bm25 (min-max正規化) の和
@@ -39,11 +46,10 @@ def _minmax(x):
 
 #この関数は現在未使用
 def hybrid_search(query: str, top_k: int = 8) -> List[Dict[str, Any]]:
-    print("func : hybrid search")
-    #assert STORE.embeddings is not None and STORE.bm25 is not None
-    assert STORE.bm25 is not None
-
-    bm = STORE.bm25.get_scores(ja_tokens(normalize_text(query)))
+    log.debug("hybrid search: %s", query)
+    snap = STORE.snapshot()
+    #assert snap.embeddings is not None and snap.bm25 is not None
+    assert snap.bm25 is not None
 
     raw = llm_searchtext(query)
     # normalize and drop empties
@@ -57,9 +63,13 @@ def hybrid_search(query: str, top_k: int = 8) -> List[Dict[str, Any]]:
 
     # Tokenize LLM-expanded query with Sudachi as well
     bm2_tokens = ja_tokens(normalize_text(" \n".join(kws)))
-    bm2 = STORE.bm25.get_scores(bm2_tokens) if bm2_tokens else np.zeros_like(bm)
-    print("bm : ", bm)
-    print("bm2 : ", bm2)
+    # 原文と LLM 拡張の 2 チャネルを一度に採点
+    bm, bm2 = snap.bm25.score_many([
+        weighted_terms((ja_tokens(normalize_text(query)), 1)),
+        weighted_terms((bm2_tokens, 1)),
+    ])
+    log.debug("bm: %s", bm)
+    log.debug("bm2: %s", bm2)
 
     bm_n = _minmax(bm)
     bm2_n = _minmax(bm2)
@@ -67,212 +77,293 @@ def hybrid_search(query: str, top_k: int = 8) -> List[Dict[str, Any]]:
     #score = 0.6 * cos_n + 0.4 * bm_n
 
         # 埋め込みがあれば加点。なければ BM25 のみ。
-    if STORE.embeddings is not None:
-        print("embeddings used")
+    if snap.embeddings is not None:
         from embeddings import embed
         q_vec = embed([query])[0]
-        cos = (STORE.embeddings @ q_vec)
+        cos = (snap.embeddings @ q_vec)
         cos_n = _minmax(cos)
         score = 0.6 * cos_n + 0.28 * bm_n + 0.12 * bm2_n
     else:
-        print("embeddings are not used")
         score = 0.7 * bm_n + 0.3 * bm2_n
 
-    idx = np.argsort(score)[::-1][:top_k]
+    idx = topk(score, top_k)
 
     results = []
     for i in idx:
-        d = STORE.docs[int(i)].copy()
+        d = snap.docs[int(i)].to_dict(full=False)
         d["score"] = float(score[int(i)])
         results.append(d)
     return results
 
 # 追加：条文ヒントに基づく強制取得＋BM25補完
-import re
 
-def _match_by_article_hints(hints: list[dict]) -> list[int]:
+def _match_by_article_hints(hints: list[dict], snap) -> list[int]:
     """hints: [{'article':'709','alias':'不法行為'}, ...]
-       号や別名でも拾えるよう、article文字列の数字を優先マッチ。
+       条番号（算用数字/漢数字/「の二」）は整数化して二分探索。番号で引けない時だけ別名を条見出しと照合。
     """
     idxs = []
-    numbers = set()
-    aliases = set()
     for h in hints or []:
-        a = str(h.get("article","")).strip()
-        if a:
-            m = re.search(r"\d+", a)
-            if m: numbers.add(m.group(0))
-        al = str(h.get("alias","")).strip()
-        if al: aliases.add(al)
-    for i, d in enumerate(STORE.docs):
-        art = str(d.get("article",""))
-        text = d.get("text","")
-        ok = False
-        for n in numbers:
-            if n and n in art:
-                ok = True; break
-        if not ok and aliases:
-            for al in aliases:
-                if al and (al in art or al in text):
-                    ok = True; break
-        if ok:
-            idxs.append(i)
-    return idxs
-
-def retrieve_candidates(query: str, law_hints: list[dict], search_terms: list[str] | None = None, civil_topics: list[str] | None = None, top_k: int = 30):
-    print("func : retrieve candidates")
-    # 1) ヒントで直取り
-    hinted = _match_by_article_hints(law_hints)
-    hinted_set = set(hinted)
-
-    # === 検索語の優先度設計 ===
-    # 1) 原文（口語）
-    base_tokens = ja_tokens(normalize_text(query))
-
-    # 2) ルータの search_terms（最優先：法的語彙を想定）
-    router_terms = [normalize_text(str(x)).strip(",") for x in (search_terms or []) if x]
-    router_tokens = ja_tokens(normalize_text(" ".join(router_terms))) if router_terms else []
-
-    # 3) ルータの civil_topics（概念語：優先）
-    topic_terms = [normalize_text(str(x)).strip(",") for x in (civil_topics or []) if x]
-    topic_tokens = ja_tokens(normalize_text(" ".join(topic_terms))) if topic_terms else []
-
-    # 4) 口語→法的概念展開（静的辞書）：優先
-    concept_terms = expand_concepts(query)
-    concept_tokens = ja_tokens(normalize_text(" ".join(concept_terms))) if concept_terms else []
-
-    # 5) リテラル危険語（例："死ね"）は、概念語が得られた場合は重みを下げる
-    risk_literals = literal_risk_tokens(query)
-    risk_tokens = ja_tokens(" ".join(risk_literals)) if risk_literals else []
-
-    # === 重み付け（BM25に重みを反映する簡便法：トークンの繰り返し回数で擬似的に重み付け） ===
-    def repeat(tokens, k):
-        out = []
-        for t in tokens:
-            out.extend([t]*k)
-        return out
-
-    # 原文は1x、Router語は3x、トピック/概念は2x、危険リテラルは0x（除外）
-    q_tokens_weighted = []
-    q_tokens_weighted += repeat(router_tokens, 3)
-    q_tokens_weighted += repeat(topic_tokens, 2)
-    q_tokens_weighted += repeat(concept_tokens, 2)
-    q_tokens_weighted += repeat([t for t in base_tokens if t not in risk_tokens], 1)
-
-    # BM25 スコア（重み付き）
-    bm = STORE.bm25.get_scores(q_tokens_weighted) if q_tokens_weighted else np.zeros(len(STORE.docs))
-    print("bm", bm)
-
-    # 参考チャネル：Routerのみ（強優先）、LLM拡張（補助）
-    if router_tokens:
-        bm_router = STORE.bm25.get_scores(repeat(router_tokens, 3))
-    else:
-        bm_router = np.zeros_like(bm)
-
-    raw = llm_searchtext(query)
-    kws_llm = [normalize_text(str(x)).strip(",") for x in (raw or []) if x]
-    print("kws_llm", kws_llm)
-    llm_joined = normalize_text(" ".join(kws_llm)) if kws_llm else ""
-    llm_tokens_raw = ja_tokens(llm_joined) if llm_joined else []
+        nums = parse_article(str(h.get("article","")))
+        found = list(snap.find_articles(article_code(nums))) if nums else []
+        if not found:
+            al = str(h.get("alias","")).strip()
+            if al:
+                found = [i for i, cap in enumerate(snap.captions) if cap and al in cap]
+        idxs.extend(int(i) for i in found)
+    return list(dict.fromkeys(idxs))
+
+# === 検索語の優先度設計 ===
+# 原文は1x、Router語は3x、トピック/概念は2x、危険リテラルは0x（除外）
+W_ROUTER, W_TOPIC, W_CONCEPT, W_BASE = 3, 2, 2, 1
+W_ROUTER_CH, W_LLM_CH = 3, 2
+K = 60  # RRF
+# RRF のチャネル重み：重み付き統合 / Router語（最優先）/ LLM拡張（補助）/ 埋め込み
+RRF_WEIGHTS = (1.0, 1.2, 0.6, 1.2)
+HINT_BONUS = 0.5   # 係数は好みで
+# BM25 チャネルで順位を付ける深さ。これより下は同順位（RRF の寄与はほぼ 0 なので、全件を並べ替えない）
+FUSION_DEPTH = int(os.getenv("RAG_FUSION_DEPTH", "500"))
+# 手で張った 709/710/723/719 の辺。本文の参照では拾えない組（709↔723・709↔719）を補う分だけの重み
+# （0.4 だと参照辺の 40 倍で、不法行為と無関係の質問にも 709/710 を押し込んでいた。bench で 0.02 が最良）
+PAIR_WEIGHT = 0.02
+# 参照グラフの加点：上位 GRAPH_SEEDS 件から辺を辿り、行き先に辺の種類ごとの重みを足す
+# 種類は crossref.REF（参照している条）/ BACKREF（参照されている条）/ PAIR（store.PAIR_BONUS）
+REF_WEIGHT, BACKREF_WEIGHT = 0.01, 0.005
+EDGE_WEIGHTS = np.array([REF_WEIGHT, BACKREF_WEIGHT, PAIR_WEIGHT])
+GRAPH_SEEDS = 50
+GRAPH_HOPS = int(os.getenv("RAG_GRAPH_HOPS", "1"))   # 2 なら 1 歩目で届いた条からもう 1 歩（PAIR は辿らない）
+HOP2_DECAY = 0.5
+
+
+def _terms(xs) -> list[str]:
+    return [normalize_text(str(x)).strip(",") for x in (xs or []) if x]
+
+
+def _query_texts(query: str, search_terms, civil_topics, llm_keywords) -> dict:
+    """1クエリ分の「トークン化すべき文字列」をチャネルごとに作る（トークン化は後でまとめて）。"""
+    router_terms = _terms(search_terms)   # ルータの search_terms（最優先：法的語彙を想定）
+    topic_terms = _terms(civil_topics)    # ルータの civil_topics（概念語：優先）
+    concept_terms = expand_concepts(query)  # 口語→法的概念展開（静的辞書）：優先
+    risk_literals = literal_risk_tokens(query)  # リテラル危険語（例："死ね"）は除外用
+    kws_llm = _terms(llm_keywords)
+    log.debug("kws_llm: %s", kws_llm)
+    return {
+        "base": normalize_text(query),
+        "router": normalize_text(" ".join(router_terms)) if router_terms else "",
+        "topic": normalize_text(" ".join(topic_terms)) if topic_terms else "",
+        "concept": concept_terms,   # 文字列ではなく語のリスト（トークンは事前計算済みの表から引く）
+        "risk": " ".join(risk_literals) if risk_literals else "",
+        "llm": normalize_text(" ".join(kws_llm)) if kws_llm else "",
+    }
+
+
+def _query_channels(texts: dict, tok: dict, vocab=None) -> list[dict]:
+    """トークン化済みの文字列から BM25 の 3 チャネル（{語: 重み}）を作る。"""
+    toks = lambda key: tok.get(texts[key], []) if texts[key] else []
+    base_tokens, router_tokens = toks("base"), toks("router")
+    risk_tokens = toks("risk")
+
+    q_weighted = weighted_terms(
+        (router_tokens, W_ROUTER),
+        (toks("topic"), W_TOPIC),
+        (concept_tokens(texts["concept"]), W_CONCEPT),
+        ([t for t in base_tokens if t not in risk_tokens], W_BASE),
+    )
+
+    llm_joined = texts["llm"]
     # 異表記を吸収
-    llm_tokens = expand_canonical(llm_tokens_raw)
+    llm_tokens = expand_canonical(toks("llm"))
     # 危険リテラルを LLM チャネルからも除外
     llm_tokens = [t for t in llm_tokens if t not in risk_tokens]
     # フォールバック：それでも空なら全文字（BM25語彙と当たりやすくする）
     if not llm_tokens and llm_joined:
         llm_tokens = list(llm_joined)
     # 語彙オーバーラップをログ
-    try:
-        if hasattr(STORE, "vocab") and STORE.vocab is not None:
-            ov = [t for t in set(llm_tokens) if t in STORE.vocab]
-            print(f"llm_tokens overlap with bm25 vocab: {len(ov)} -> {ov[:20]}")
-    except Exception:
-        pass
-    bm_llm = STORE.bm25.get_scores(repeat(llm_tokens, 2)) if llm_tokens else np.zeros_like(bm)
-    print("bm_llm", bm_llm)
-    print("bm llm shape", bm_llm.shape)
-    # 3) RRF 融合（埋込があれば併用）
-    def _minmax(x):
-        x = np.asarray(x)
-        return np.zeros_like(x) if x.size==0 or x.max()-x.min()<1e-12 else (x-x.min())/(x.max()-x.min())
-    def _ranks(a):
-        o = np.argsort(a)[::-1]
-        r = np.empty_like(o)
-        r[o] = np.arange(len(a))
-        return r
-
-    K = 60
-    parts = []
-    parts.append(1.0/(K+_ranks(_minmax(bm))))          # 重み付き統合クエリ
-    parts.append(1.2/(K+_ranks(_minmax(bm_router))))   # Router語（最優先）
-    parts.append(0.6/(K+_ranks(_minmax(bm_llm))))      # LLM拡張（補助）
-
-    use_mmr = False
-    cos = None
-    if STORE.embeddings is not None:
+    if vocab is not None and log.isEnabledFor(logging.DEBUG):
+        ov = [t for t in set(llm_tokens) if t in vocab]
+        log.debug("llm_tokens overlap with bm25 vocab: %d -> %s", len(ov), ov[:20])
+
+    return [q_weighted, weighted_terms((router_tokens, W_ROUTER_CH)), weighted_terms((llm_tokens, W_LLM_CH))]
+
+
+def _minmax_rows(x: np.ndarray) -> np.ndarray:
+    lo = x.min(axis=-1, keepdims=True)
+    span = x.max(axis=-1, keepdims=True) - lo
+    flat = span < 1e-12
+    return np.where(flat, 0.0, (x - lo) / np.where(flat, 1.0, span))
+
+
+def _top_rows(a: np.ndarray, k: int) -> np.ndarray:
+    """行ごとの上位 k 件の添字を降順で（argpartition で k 件に絞ってから並べる。同点は添字の大きい方が先）"""
+    n = a.shape[-1]
+    k = min(k, n)
+    part = np.argpartition(a, n - k, axis=-1)[..., n - k:] if k < n else np.broadcast_to(np.arange(n), a.shape).copy()
+    vals = np.take_along_axis(a, part, axis=-1)
+    order = np.lexsort((-part, -vals), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def _ranks_rows(a: np.ndarray, depth: int = 0) -> np.ndarray:
+    """行ごとの降順順位（0 始まり）。depth を渡すと上位 depth 件だけ順位を付け、残りは同順位 depth（RRF の寄与は頭打ち）。
+    行の最小値のまま（BM25 で一語も当たらない等）の文書も同順位 depth：同点の並びで加点が変わらないように。"""
+    n = a.shape[-1]
+    depth = min(depth or n, n)
+    o = _top_rows(a, depth)
+    r = np.full(a.shape, depth, dtype=np.int64)
+    np.put_along_axis(r, o, np.arange(depth), axis=-1)
+    r[a <= a.min(axis=-1, keepdims=True)] = depth
+    return r
+
+
+def _cos_ranks(snap, q_vecs: np.ndarray, n: int) -> np.ndarray:
+    """埋め込みチャネルの (nq, n) 順位。exact は全件、近似索引は上位 ANN_TOPK 件だけ順位を付け、残りは同順位 ANN_TOPK。"""
+    index = snap.vector_index
+    if index is None or index.exact:
+        cos = index.scores(q_vecs) if index is not None else q_vecs @ np.asarray(snap.embeddings).T    # (nq, n)
+        return _ranks_rows(_minmax_rows(cos), FUSION_DEPTH)
+    k = min(ANN_TOPK, n)
+    ids, _ = index.search(q_vecs, k)
+    ranks = np.full((len(ids), n), k, dtype=np.int64)
+    for qi, row in enumerate(ids):
+        row = row[row >= 0]
+        ranks[qi, row] = np.arange(len(row))
+    return ranks
+
+
+def _graph_bonus(snap, rrf: np.ndarray) -> np.ndarray:
+    """各行の上位 GRAPH_SEEDS 件を起点に参照グラフを 1〜2 歩辿った加点（辺の取り出しと scatter だけ）。
+    参照辺は起点の強さ（行の最高点に対する比）を掛け、行き先ごとに最大の 1 本だけ効かせる
+    （多くの条から参照される条が、下位の起点の寄せ集めで浮かないように）。PAIR の辺は従来どおり本数分足す。"""
+    bonus = np.zeros_like(rrf)
+    g = snap.graph
+    if g is None or not g.nnz:
+        return bonus
+    nq, n = rrf.shape
+    k = min(GRAPH_SEEDS, n)
+    seeds = np.argpartition(rrf, n - k, axis=1)[:, n - k:].ravel()
+    q = np.repeat(np.arange(nq), k)
+    strength = rrf[q, seeds] / np.maximum(rrf.max(axis=1), 1e-12)[q]
+    at, dst, kind = g.gather(seeds)
+    pair = kind == PAIR
+    np.add.at(bonus, (q[at[pair]], dst[pair]), EDGE_WEIGHTS[PAIR])
+    ref = np.zeros_like(rrf)
+    np.maximum.at(ref, (q[at[~pair]], dst[~pair]), EDGE_WEIGHTS[kind[~pair]] * strength[at[~pair]])
+    if GRAPH_HOPS >= 2:
+        # 1 歩目で届いた条（起点を除く）から、届いた強さに比例してもう 1 歩
+        reached = ref.copy()
+        reached[q, seeds] = 0
+        fq, fd = np.nonzero(reached)
+        at, dst, kind = g.gather(fd)
+        keep = kind != PAIR
+        w = HOP2_DECAY * EDGE_WEIGHTS[kind[keep]] * reached[fq, fd][at[keep]] / REF_WEIGHT
+        np.maximum.at(ref, (fq[at[keep]], dst[keep]), w)
+    return bonus + ref
+
+
+def _dedup_rows(snap, rrf: np.ndarray, pool_size: int, limit: int) -> list[np.ndarray]:
+    """各行の上位 pool_size 件から、同じ条番号（グループ）を先勝ちで一つにまとめ、先頭 limit 件を返す。"""
+    pool = _top_rows(rrf, pool_size)
+    keys = snap.group_ids[pool]
+    order = np.argsort(keys, axis=1, kind="stable")
+    sk = np.take_along_axis(keys, order, axis=1)
+    first_sorted = np.ones_like(sk, dtype=bool)
+    first_sorted[:, 1:] = sk[:, 1:] != sk[:, :-1]
+    first = np.empty_like(first_sorted)
+    np.put_along_axis(first, order, first_sorted, axis=1)
+    return [pool[q][first[q]][:limit] for q in range(len(pool))]
+
+
+def retrieve_candidates_batch(
+    queries: list[str],
+    law_hints: list[list[dict]] | None = None,
+    search_terms: list[list[str] | None] | None = None,
+    civil_topics: list[list[str] | None] | None = None,
+    llm_keywords: list[list[str] | None] | None = None,
+    top_k: int = 30,
+    query_vecs: np.ndarray | None = None,
+    timings: dict | None = None,
+) -> list[list[Dict[str, Any]]]:
+    """複数クエリをまとめて検索する。トークン化・BM25・埋め込み・RRF を (クエリ × 文書) 行列で一括処理。
+    llm_keywords を省略したクエリだけ llm_searchtext を呼ぶ（評価やFAQ事前計算では固定値を渡す）。
+    query_vecs を渡せばクエリの埋め込みは再計算しない。段ごとの所要秒数は metrics（search.<段>）に入れ、
+    timings を渡せばそこにも足し込む（bench/run.py 用）。
+    """
+    laps: dict[str, float] = {}
+    t0 = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t0
+        t1 = time.perf_counter()
+        laps[stage] = laps.get(stage, 0.0) + t1 - t0
+        t0 = t1
+    snap = STORE.snapshot()   # 途中で再構築が差し替わっても、このリクエストは最後までこの版を使う
+    nq, n = len(queries), len(snap.docs)
+    if nq == 0:
+        return []
+    per_query = lambda xs: list(xs) if xs is not None else [None] * nq
+    law_hints, search_terms, civil_topics, llm_keywords = map(per_query, (law_hints, search_terms, civil_topics, llm_keywords))
+    llm_keywords = [kw if kw is not None else llm_searchtext(q) for q, kw in zip(queries, llm_keywords)]
+    lap("llm")
+
+    # 1) トークン化：全クエリの全チャネル文字列を重複除去して一括
+    texts = [_query_texts(q, st, ct, kw) for q, st, ct, kw in zip(queries, search_terms, civil_topics, llm_keywords)]
+    uniq = list(dict.fromkeys(t for tx in texts for k, t in tx.items() if t and k != "concept"))
+    tok = dict(zip(uniq, ja_tokens_batch(uniq)))
+    lap("tokenize")
+
+    # 2) BM25：全クエリ × 3 チャネルを 1 回の疎行列積で (nq, 3, n)
+    channels = [ch for tx in texts for ch in _query_channels(tx, tok, snap.vocab)]
+    bm = snap.bm25.score_many(channels).reshape(nq, 3, n)
+    log.debug("bm: %s", bm[:, 0])
+    log.debug("bm_llm: %s", bm[:, 2])
+    lap("bm25")
+
+    # 3) RRF 融合（埋込があれば併用）。順位は行ごとに一括計算
+    weights = np.asarray(RRF_WEIGHTS[:3])[None, :, None]
+    rrf = (weights / (K + _ranks_rows(_minmax_rows(bm), FUSION_DEPTH))).sum(axis=1)
+    if snap.embeddings is not None:
         from embeddings import embed
-        q_vec = embed([query])[0]
-        cos = (STORE.embeddings @ q_vec)
-        cos_n = _minmax(cos)
-        parts.append(1.2/(K+_ranks(cos_n)))
-        use_mmr = True
+        lap("fusion")
+        q_vecs = query_vecs if query_vecs is not None else embed(list(queries))  # 1 バッチで encode
+        lap("embed")
+        rrf = rrf + RRF_WEIGHTS[3] / (K + _cos_ranks(snap, q_vecs, n))
+        lap("vector")
 
-    rrf = np.sum(parts, axis=0)
     # ヒント命中はボーナス加点
-    if hinted:
-        bonus = np.zeros_like(rrf, dtype=float)
-        bonus[list(hinted_set)] = 0.5  # 係数は好みで
-        rrf = rrf + bonus
-
-    print("rrf",rrf)
-
-
-    try:
-    # 候補ごとに article_num を引く
-        article_nums = []
-        for i, d in enumerate(STORE.docs):
-            n = d.get("article_num")
-            article_nums.append(int(n) if isinstance(n, (int, float, str)) and str(n).isdigit() else None)
-
-    # 上位に 709/710/723 が居たら、対応ペアにボーナス
-        bonus = np.zeros_like(rrf, dtype=float)
-        top_pre = np.argsort(rrf)[::-1][:50]  # 上位50を見て関係を張る
-        present = set([article_nums[j] for j in top_pre if article_nums[j] is not None])
-
-        for base in list(present):
-            neighbors = PAIR_BONUS.get(base, [])
-            for nb in neighbors:
-            # その条文番号のインデックス（複数ありうるが通常1件）
-                for j, n in enumerate(article_nums):
-                    if n == nb:
-                        bonus[j] += 0.4  # 係数は適宜。0.3〜0.6で手応えを見て
-        rrf = rrf + bonus
-    except Exception:
-        pass
-
-    cand = np.argsort(rrf)[::-1][:max(top_k, 8)]
+    for qi, hints in enumerate(law_hints):
+        hinted = _match_by_article_hints(hints, snap)
+        if hinted:
+            rrf[qi, hinted] += HINT_BONUS
+    log.debug("rrf: %s", rrf)
+
+    # 上位の条から参照グラフを辿って加点（709/710/723 のペアも PAIR の辺としてここに入っている）
+    rrf += _graph_bonus(snap, rrf)
 
     # MMR を使わず、単純な上位選択 + 条文番号での重複除外に切り替え
     # より安定・低遅延で、法令ドキュメントでは重複（同条異片）を抑えやすい
-    # 上位候補を広めにとってから、article_num でユニーク化
-    pool = list(np.argsort(rrf)[::-1][:max(top_k * 4, 32)])
-    final_idx = []
-    seen_nums = set()
-    for j in pool:
-        num = STORE.docs[j].get("article_num")
-        # article_num が同じものは一つにまとめる（なければ id でフォールバック）
-        key = int(num) if isinstance(num, (int, float, str)) and str(num).isdigit() else STORE.docs[j].get("id")
-        if key in seen_nums:
-            continue
-        seen_nums.add(key)
-        final_idx.append(j)
-        if len(final_idx) >= max(8, top_k):
-            break
+    # 上位候補を広めにとってから、article_code（枝番込みの条番号）でユニーク化
+    finals = _dedup_rows(snap, rrf, max(top_k * 4, 32), max(8, top_k))
+    lap("fusion")
+
+    out = []
+    for qi, final_idx in enumerate(finals):
+        results = []
+        for i in final_idx:
+            d = snap.docs[int(i)].to_dict(full=False)
+            d["score"] = float(rrf[qi, int(i)])
+            results.append(d)
+        out.append(results)
+    log.debug("results: %s", out)
+    lap("results")
+    for stage, sec in laps.items():
+        observe(f"search.{stage}", sec)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + sec
+    return out
 
-    results = []
-    for i in final_idx:
-        d = STORE.docs[int(i)].copy()
-        d["score"] = float(rrf[int(i)])
-        results.append(d)
-    print("results",results)
-    return results
+
+@timed("retrieve")
+def retrieve_candidates(query: str, law_hints: list[dict], search_terms: list[str] | None = None, civil_topics: list[str] | None = None, top_k: int = 30, llm_keywords: list[str] | None = None, query_vec: np.ndarray | None = None):
+    return retrieve_candidates_batch(
+        [query], [law_hints], [search_terms], [civil_topics], [llm_keywords], top_k=top_k,
+        query_vecs=None if query_vec is None else np.asarray(query_vec)[None, :],
+    )[0]
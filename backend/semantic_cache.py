@@ -0,0 +1,107 @@
+# backend/semantic_cache.py
+# 言い換え質問（「友達に死ねと言われた」≒「友人から死ねって言われた」）に過去の回答を再利用する。
+# 質問ベクトル（embeddings.embed の正規化済みベクトル）の cos 類似度が閾値以上で、
+# かつ埋め込みの近傍上位（ベクトル索引の top-k の id）が十分一致した時だけ命中とする。
+# 環境変数:
+#   SEMANTIC_CACHE=off              使わない
+#   SEMANTIC_CACHE_THRESHOLD=0.92   cos 類似度の下限
+#   SEMANTIC_CACHE_AGREEMENT=0.5    上位候補 id 集合の Jaccard 係数の下限
+#   SEMANTIC_CACHE_SIZE=1024        保持件数（超えたら最終利用が最も古いものから捨てる）
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticCache:
+    def __init__(self, capacity: int = 1024, threshold: float = 0.92, agreement: float = 0.5, enabled: bool = True):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.agreement = agreement
+        self.enabled = enabled
+        self._vecs: Optional[np.ndarray] = None   # (capacity, dim) float32。最初の put で確保
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "rejected_by_agreement": 0, "evictions": 0}
+
+    @staticmethod
+    def _jaccard(a: frozenset, b: frozenset) -> float:
+        if not a and not b:
+            return 1.0
+        return len(a & b) / len(a | b)
+
+    def lookup(self, q_vec: np.ndarray, cand_ids: List[str]) -> Optional[Dict[str, Any]]:
+        """命中すれば {"query", "result", "similarity"} を返す。"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if self._vecs is None or not self._alive.any():
+                self.stats["misses"] += 1
+                return None
+            sims = self._vecs @ np.asarray(q_vec, dtype=np.float32)
+            sims[~self._alive] = -1.0
+            cands = set(cand_ids)
+            # 類似度の高い順に数件だけ候補一致を確かめる
+            for slot in np.argsort(sims)[::-1][:3]:
+                sim = float(sims[slot])
+                if sim < self.threshold:
+                    break
+                e = self._entries[slot]
+                if self._jaccard(e["cand_ids"], frozenset(cands)) < self.agreement:
+                    self.stats["rejected_by_agreement"] += 1
+                    continue
+                self._last_used[slot] = time.time()
+                self.stats["hits"] += 1
+                return {"query": e["query"], "result": e["result"], "similarity": sim}
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, query: str, q_vec: np.ndarray, cand_ids: List[str], result: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        q_vec = np.asarray(q_vec, dtype=np.float32)
+        with self._lock:
+            if self._vecs is None or self._vecs.shape[1] != q_vec.shape[0]:
+                self._vecs = np.zeros((self.capacity, q_vec.shape[0]), dtype=np.float32)
+                self._alive[:] = False
+            free = np.flatnonzero(~self._alive)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))   # LRU で追い出す
+                self.stats["evictions"] += 1
+            self._vecs[slot] = q_vec
+            self._alive[slot] = True
+            self._last_used[slot] = time.time()
+            self._entries[slot] = {"query": query, "cand_ids": frozenset(cand_ids), "result": result}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._alive[:] = False
+            self._entries = [None] * self.capacity
+
+    def info(self) -> dict:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "size": int(self._alive.sum()),
+                "capacity": self.capacity,
+                "threshold": self.threshold,
+                "agreement": self.agreement,
+                "hit_rate": (self.stats["hits"] / total) if total else 0.0,
+                **self.stats,
+            }
+
+
+SEMANTIC_CACHE = SemanticCache(
+    capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", "1024")),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+    agreement=float(os.getenv("SEMANTIC_CACHE_AGREEMENT", "0.5")),
+    enabled=os.getenv("SEMANTIC_CACHE", "on").lower() not in ("off", "0", "false"),
+)
@@ -1,62 +1,298 @@
 from __future__ import annotations
 import json
-from jp_tokenize  import ja_tokens, normalize_text
+import logging
+from jp_tokenize  import ja_tokens_corpus, normalize_text, TOKENIZER_VERSION
 from pathlib import Path
 from typing import List, Dict, Any
-from rank_bm25 import BM25Okapi
+from bm25 import SparseBM25
 import numpy as np
 import os
+import threading
+from corpus import Corpus
+from crossref import RefGraph
+from index_cache import corpus_key, load_index, load_latest_index, load_tokens, save_index, load_embeddings, load_quantized, load_vector_index
+from ingest_egov import content_hash
+from article_num import parse_article, parse_article_title, article_code
+from metrics import span
+
+log = logging.getLogger(__name__)
 DISABLE_EMBEDDINGS = os.getenv("RAG_EMBEDDINGS", "on").lower() in ("off", "0", "false")
 
 DATA_DIR = Path(__file__).parent / "data"
 #SEED_PATH = DATA_DIR / "civilcode_seed.json"
-INGESTED_DIR = DATA_DIR / "ingested"
+INGESTED_DIR = Path(os.getenv("RAG_INGESTED_DIR") or DATA_DIR / "ingested")
+LAW_STRIDE = 10 ** 10   # group_ids で法令ごとに条番号の値域をずらす幅（article_code は 10^10 未満）
+# 上位に現れた本条 → 一緒に出したい相手の条（民法）。本文の参照（crossref）では繋がらない組を補うため、
+# 参照グラフに PAIR の辺として足す（加点の重みは search.PAIR_WEIGHT。参照辺と同じ桁）
+PAIR_BONUS = {
+    709: [710, 723, 719],  # 不法行為 → 慰謝料・名誉回復・共同不法行為
+    710: [709, 723],
+    723: [709, 710],
+}
+
+
+def law_key(doc: Dict[str, Any]) -> str:
+    # id は "civilcode:第七百九条" 形式。先頭が法令キー
+    return str(doc.get("id", "")).split(":", 1)[0]
+
+
+def _ensure_article_fields(d: Dict[str, Any]) -> None:
+    # 旧形式（article_num/article_code 無し）の取り込みファイルは読み込み時に補う
+    if "article_code" in d:
+        return
+    nums = parse_article_title(d.get("article_label") or str(d.get("article", "")).split("（")[0])
+    d["article_num"] = nums[0] if nums else None
+    d["article_code"] = article_code(nums) if nums else None
+
+
+def _match_prev_rows(prev, ids: List[str], hashes: List[str]) -> np.ndarray:
+    """新しい各文書について、前回の索引で id と内容ハッシュが一致する行番号（無ければ -1）。"""
+    rows = np.full(len(ids), -1, dtype=np.int64)
+    if prev is None:
+        return rows
+    pc = prev["corpus"]
+    old = {(i, h): r for r, (i, h) in enumerate(zip(pc.column("id"), pc.column("hash")))}
+    for j, key in enumerate(zip(ids, hashes)):
+        rows[j] = old.get(key, -1)
+    return rows
+
+
+def _embed_incremental(texts: List[str], prev, prev_rows) -> np.ndarray:
+    from embeddings import embed, MODEL_NAME
+    if prev is None or prev["embeddings"] is None or prev["meta"].get("model") != MODEL_NAME:
+        return embed(texts)
+    reuse = prev_rows >= 0
+    out = np.empty((len(texts), prev["embeddings"].shape[1]), dtype=np.float32)
+    out[reuse] = prev["embeddings"][prev_rows[reuse]]
+    todo = np.flatnonzero(~reuse)
+    if len(todo):
+        out[todo] = embed([texts[i] for i in todo])
+    log.info("embedded %d / reused %d docs", len(todo), int(reuse.sum()))
+    return out
+
+
+def _read_docs(paths: List[Path]) -> List[Dict[str, Any]]:
+    """取り込み JSON を読み、削除済み（tombstone）を除いて id で先勝ち重複除去する。"""
+    docs = []
+    for p in paths:
+        docs.extend(json.loads(p.read_text(encoding="utf-8")))
+    #if SEED_PATH.exists():
+        #docs.extend(json.loads(SEED_PATH.read_text(encoding="utf-8")))
+    # de-dup by id
+    seen = set()
+    out = []
+    for d in docs:
+        if d.get("deleted"): continue  # 差分取り込みで消えた条（tombstone）
+        if d["id"] in seen: continue
+        seen.add(d["id"])
+        out.append(d)
+    for d in out:
+        _ensure_article_fields(d)
+    return out
+
+
+def _build_article_sorted(corpus: Corpus):
+    """法令キーごとに (昇順の article_code 配列, 対応する docs 添字) を作る。searchsorted 用。"""
+    codes = np.asarray(corpus.int_column("article_code"), dtype=np.int64)
+    out = {}
+    for j, law in enumerate(corpus.laws):
+        idx = np.flatnonzero((corpus.law == j) & (codes >= 0))
+        order = idx[np.lexsort((idx, codes[idx]))]   # 条番号順、同じ番号は先に出た文書から
+        out[law] = (codes[order], order)
+    return out
+
+
+def _build_article_index(corpus: Corpus) -> Dict[str, Dict[str, int]]:
+    """法令キーごとに {条見出し / 表記ゆれ文字列: docs の添字} を作る。条番号での引き当ては article_sorted の二分探索。"""
+    index: Dict[str, Dict[str, int]] = {law: {} for law in corpus.laws}
+    laws = corpus.law
+    for i, (art, label, cap) in enumerate(zip(corpus.column("article"), corpus.column("article_label"), corpus.column("caption"))):
+        idx = index[corpus.laws[laws[i]]]
+        for key in (art, label):
+            if key:
+                idx.setdefault(key, i)
+        if cap:
+            idx.setdefault(cap, i)
+            idx.setdefault(f"（{cap}）", i)
+    return index
+
+
+def _pair_edges(snap: "IndexSnapshot"):
+    """PAIR_BONUS を文書間の辺（元, 先）にする。"""
+    src, dst = [], []
+    for base, nbs in PAIR_BONUS.items():
+        for i in snap.find_articles(article_code((base,))):
+            for nb in nbs:
+                targets = snap.find_articles(article_code((nb,)))
+                src.extend([int(i)] * len(targets))
+                dst.extend(targets.tolist())
+    return src, dst
+
+
+class IndexSnapshot:
+    """ある時点のコーパスと索引一式。build() で組み上げたら以後は書き換えない（読み取り専用として共有する）。"""
 
-class DocStore:
     def __init__(self):
-        self.docs: List[Dict[str, Any]] = []
-        self.texts: List[str] = []
+        self.docs: Corpus = Corpus.from_docs([])   # 列指向コーパス（corpus.py）。self.docs[i] は DocRecord
         self.embeddings = None
+        self.embeddings_q = None   # 圧縮した埋め込み（RAG_EMBED_DTYPE=float16|int8 の時。quantize.py）
+        self.vector_index = None   # 埋め込みチャネルの探索用（vector_index.py）
         self.bm25 = None
         self.tokenized_docs = None
         self.vocab = None
+        self.article_index: Dict[str, Dict[Any, int]] = {}
+        self.article_sorted: Dict[str, tuple] = {}
+        self.article_codes = np.zeros(0, dtype=np.int64)   # docs と同じ並び。番号なしは -1
+        self.group_ids = np.zeros(0, dtype=np.int64)       # 重複除外のキー（条番号。番号なしは文書ごとに固有の負数）
+        self.captions: List[str] = []
+        self.graph: RefGraph | None = None   # 条文の参照グラフ（逆向き・PAIR_BONUS の辺込み）
+        self.last_load: Dict[str, Any] = {}   # 直近の load で何件作り直したか（/ingest/egov の応答用）
 
-    def load(self):
-        docs = []
-        if INGESTED_DIR.exists():
-            for p in sorted(INGESTED_DIR.glob("*.json")):
-                docs.extend(json.loads(p.read_text(encoding="utf-8")))
-        #if SEED_PATH.exists():
-            #docs.extend(json.loads(SEED_PATH.read_text(encoding="utf-8")))
-        # de-dup by id
-        seen = set()
-        out = []
-        for d in docs:
-            if d["id"] in seen: continue
-            seen.add(d["id"])
-            out.append(d)
-        self.docs = out
-        self.texts = [d["text"] for d in self.docs]
+    def build(self) -> "IndexSnapshot":
+        paths = sorted(INGESTED_DIR.glob("*.json")) if INGESTED_DIR.exists() else []
+        # 内容ハッシュが一致する索引があれば、取り込み JSON は読まずに列指向コーパス（mmap）から開く
+        key = corpus_key(paths) if paths else None
+        cached = load_index(key) if key else None
+        raw = None
+        if cached is not None:
+            self.docs = cached["corpus"]
+        else:
+            raw = _read_docs(paths)
+            self.docs = Corpus.from_docs(raw, [d.get("hash") or content_hash(d) for d in raw])
+        # 条番号→文書 の索引は作り終えてから一度に差し替える
+        self.article_index = _build_article_index(self.docs)
+        self.article_sorted = _build_article_sorted(self.docs)
+        self.article_codes = np.asarray(self.docs.int_column("article_code"), dtype=np.int64)   # -1 = 番号なし
+        # 法令が違えば同じ条番号でも別グループ（法令の通し番号 × LAW_STRIDE ＋ 条番号）
+        law_ids = self.docs.law.astype(np.int64)
+        self.group_ids = np.where(self.article_codes >= 0, law_ids * LAW_STRIDE + self.article_codes, -1 - np.arange(len(self.docs)))
+        self.captions = self.docs.column("caption")
+        # 本文から拾った参照辺は索引に保存済み（無ければここで拾う）。逆向きと PAIR_BONUS の辺は毎回足す
+        ref_graph = cached["graph"] if cached is not None else RefGraph.build(self.docs, self.article_sorted)
+        self.graph = ref_graph.with_edges(*_pair_edges(self))
         # vector + bm25
-        if self.texts:
-            #self.embeddings = embed(self.texts)
-            tokenized = [ja_tokens(normalize_text(d["text"])) for d in self.docs]
-            self.bm25 = BM25Okapi(tokenized)
+        if len(self.docs):
+            prev, prev_rows = None, None
+            if cached is not None:
+                self.bm25 = cached["bm25"]
+                tokenized = None   # ヒット時は読まない（必要なら index_cache.load_tokens(key)）
+                log.info("index cache hit: %s", key)
+            else:
+                # 前回の索引と内容ハッシュが一致する文書はトークン・埋め込みを流用し、変わった文書だけ作り直す
+                prev = load_latest_index(exclude=key)
+                prev_rows = _match_prev_rows(prev, self.docs.column("id"), self.docs.column("hash"))
+                tokenized = [None] * len(self.docs)
+                reuse_tokens = prev is not None and prev["meta"].get("tokenizer") == TOKENIZER_VERSION and (prev_rows >= 0).any()
+                if reuse_tokens:
+                    prev_tokens = load_tokens(prev["key"])
+                    for i, r in enumerate(prev_rows):
+                        if r >= 0:
+                            tokenized[i] = prev_tokens[r]
+                todo = [i for i, t in enumerate(tokenized) if t is None]
+                for i, toks in zip(todo, ja_tokens_corpus([normalize_text(raw[i]["text"]) for i in todo])):
+                    tokenized[i] = toks
+                # BM25 は前回のポスティングを流用し、変わった文書だけ数え直す（IDF・平均文書長・寄与値は全体で引き直し）。
+                # 1 条の改正で全件 build() すると民法だけで約 50ms と、その 1 条のトークン化（1ms 未満）より重い（bench/amend.py）
+                self.bm25 = SparseBM25.update(prev["bm25"], tokenized, prev_rows) if reuse_tokens else SparseBM25.build(tokenized)
+                log.info("index cache miss: %s (tokenized %d / reused %d docs)", key, len(todo), len(tokenized) - len(todo))
             self.tokenized_docs = tokenized
-            self.vocab = set(sum(tokenized, []))
-            print("embeddings are used : ",DISABLE_EMBEDDINGS)
+            self.vocab = self.bm25.vocab
+            log.info("embeddings disabled: %s", DISABLE_EMBEDDINGS)
              # 埋め込みは「任意」。失敗しても落ちない
+            self.embeddings = None
             if not DISABLE_EMBEDDINGS:
+                if cached is not None and cached["embeddings"] is not None:
+                    self.embeddings = cached["embeddings"]  # mmap（読み取り専用）
+                else:
+                    try:
+                        self.embeddings = _embed_incremental(self.docs.column("text"), prev, prev_rows)
+                    except Exception as e:
+                        # 起動を止めない：ログだけ残し、ベクトル無しで運転
+                        log.warning("embeddings disabled due to error: %s", e)
+                        self.embeddings = None
+            if cached is None or (self.embeddings is not None and cached["embeddings"] is None):
                 try:
-                    from embeddings import embed
-                    self.embeddings = embed(self.texts)
-                    print("embed success!")
-                except Exception as e:
-                    # 起動を止めない：ログだけ残し、ベクトル無しで運転
-                    print(f"[WARN] embeddings disabled due to error: {e}")
-                    self.embeddings = None
+                    save_index(key, self.docs, tokenized, self.bm25, ref_graph, self.embeddings)
+                except OSError as e:
+                    # 書けなくても検索はできる
+                    log.warning("index cache not saved: %s", e)
+            self.embeddings_q = None
+            self.vector_index = None
+            if self.embeddings is not None:
+                if cached is None or cached["embeddings"] is None:
+                    # 作りたての行列は手放し、保存済みファイルを mmap で開き直す
+                    mm = load_embeddings(key)
+                    if mm is not None:
+                        self.embeddings = mm
+                # 圧縮時も float32 の mmap は開いたまま（読むのは search() の再ランクだけ。触らないページは常駐しない）
+                self.embeddings_q = load_quantized(key, self.embeddings)
+                reuse = (prev["key"], prev_rows) if prev is not None else None
+                self.vector_index = load_vector_index(key, self.embeddings, quantized=self.embeddings_q, prev=reuse)
+            self.last_load = {
+                "key": key,
+                "docs": len(self.docs),
+                "cache_hit": cached is not None,
+                "reused": int((prev_rows >= 0).sum()) if prev_rows is not None else (len(self.docs) if cached is not None else 0),
+            }
+        for a in (self.article_codes, self.group_ids, self.graph.indptr, self.graph.indices, self.graph.kind):
+            a.flags.writeable = False
+        return self
+
+    def lookup_article(self, law: str, q: str) -> Dict[str, Any] | None:
+        """「第709条」「七百九」「第三百九十八条の二」「不法行為による損害賠償」などから条文を引く。"""
+        idx = self.article_index.get(law)
+        if not idx:
+            return None
+        q = (q or "").strip()
+        i = idx.get(q)
+        if i is None:
+            nums = parse_article(q)
+            found = self.find_articles(article_code(nums), law) if nums else ()
+            i = int(found[0]) if len(found) else None
+        return self.docs[i].to_dict() if i is not None else None
+
+    def find_articles(self, code: int, law: str = "civilcode") -> np.ndarray:
+        """article_code が一致する文書の添字（二分探索）。"""
+        codes, order = self.article_sorted.get(law, (None, None))
+        if codes is None:
+            return np.zeros(0, dtype=np.int64)
+        lo = np.searchsorted(codes, code, side="left")
+        hi = np.searchsorted(codes, code, side="right")
+        return order[lo:hi]
 
     def __len__(self):
         return len(self.docs)
 
+
+class DocStore:
+    """現在の IndexSnapshot への参照だけを持つ。再構築は新しいスナップショットを作ってから参照を差し替えるので、
+    検索中のリクエストは最初に掴んだスナップショットを最後まで使い、作りかけの索引は見えない。"""
+
+    def __init__(self):
+        self._snap = IndexSnapshot()
+        self._build_lock = threading.Lock()   # 再構築は同時に一つだけ
+        self.generation = 0
+
+    def snapshot(self) -> IndexSnapshot:
+        # 1 リクエストの中で docs と索引の組を揃えたい時は、これを一度だけ呼んで使い回す
+        return self._snap
+
+    def load(self) -> IndexSnapshot:
+        with self._build_lock:
+            with span("index_build"):
+                snap = IndexSnapshot().build()
+            snap.last_load["generation"] = self.generation + 1
+            self._snap = snap   # 参照の代入一回で切り替え
+            self.generation += 1
+        return snap
+
+    def __getattr__(self, name):
+        # STORE.docs / STORE.bm25 などは現在のスナップショットに委譲
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._snap, name)
+
+    def __len__(self):
+        return len(self._snap)
+
 STORE = DocStore()
\ No newline at end of file
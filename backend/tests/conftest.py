@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+# backend/ のモジュールはフラットに import しているので、tests/ からも見えるようにする（bench/run.py と同じ）
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
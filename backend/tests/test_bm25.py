@@ -0,0 +1,70 @@
+# backend/tests/test_bm25.py
+# BM25 の差分構築（update）が、同じトークン列から build し直したものと同じ点数になること
+from __future__ import annotations
+
+import numpy as np
+
+from bm25 import SparseBM25
+
+WORDS = [f"w{i}" for i in range(60)] + ["の", "は", "を"]
+
+
+def _docs(n, seed):
+    rng = np.random.default_rng(seed)
+    # 先頭の数語は半数超の文書に出る（IDF の下限が効く）
+    return [["の", "は"] + list(rng.choice(WORDS, size=rng.integers(3, 30))) for _ in range(n)]
+
+
+def _scores(bm: SparseBM25):
+    channels = [{w: 1.0} for w in WORDS + ["new1", "new2"]] + [{"w1": 2.0, "の": 1.0, "new1": 0.5}]
+    return bm.score_many(channels)
+
+
+def test_update_matches_build():
+    old = _docs(200, 0)
+    prev = SparseBM25.build(old)
+    # 改正：10 件変更・5 件削除・3 件追加・並び替え（新しい語も入れる）
+    new, prev_rows = [], []
+    for r in np.random.default_rng(1).permutation(200):
+        if r < 5:
+            continue
+        if r < 15:
+            new.append(old[r] + ["new1"])
+            prev_rows.append(-1)
+        else:
+            new.append(old[r])
+            prev_rows.append(r)
+    for toks in _docs(3, 2):
+        new.append(toks + ["new2"])
+        prev_rows.append(-1)
+
+    upd = SparseBM25.update(prev, new, np.asarray(prev_rows))
+    full = SparseBM25.build(new)
+    np.testing.assert_allclose(_scores(upd), _scores(full), rtol=1e-5, atol=1e-6)
+    assert upd.avgdl == full.avgdl and np.array_equal(upd.doc_len, full.doc_len)
+
+    # 差分の差分（消えた語が df=0 で残っていても変わらない）
+    newer = new[:-1]
+    upd2 = SparseBM25.update(upd, newer, np.arange(len(newer)))
+    np.testing.assert_allclose(_scores(upd2), _scores(SparseBM25.build(newer)), rtol=1e-5, atol=1e-6)
+
+
+def test_update_round_trips_through_save(tmp_path):
+    old = _docs(50, 3)
+    SparseBM25.build(old).save(tmp_path)
+    prev = SparseBM25.load(tmp_path)
+    new = old[1:] + [["w1", "w2", "new1"]]
+    rows = np.r_[np.arange(1, 50), -1]
+    np.testing.assert_allclose(_scores(SparseBM25.update(prev, new, rows)), _scores(SparseBM25.build(new)),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_update_without_tf_falls_back_to_build(tmp_path):
+    old = _docs(30, 4)
+    SparseBM25.build(old).save(tmp_path)
+    (tmp_path / "bm25_tf.npy").unlink()   # tf を持たない古い索引
+    prev = SparseBM25.load(tmp_path)
+    assert prev.tf is None
+    new = old + [["new1"]]
+    np.testing.assert_allclose(_scores(SparseBM25.update(prev, new, np.r_[np.arange(30), -1])),
+                               _scores(SparseBM25.build(new)), rtol=1e-5, atol=1e-6)
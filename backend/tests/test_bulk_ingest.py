@@ -0,0 +1,140 @@
+# backend/tests/test_bulk_ingest.py
+# 一括取り込み（bulk_ingest.py）をネットワーク無しで確かめる。e-Gov は httpx.MockTransport の台本で代用する
+from __future__ import annotations
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+import pytest
+
+import bulk_ingest as bi
+import ingest_egov
+
+LAW_ID = ingest_egov.LAWS["civilcode"]
+
+
+def law_xml(text: str = "損害を賠償する責任を負う。") -> bytes:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<DataRoot><ApplData><LawFullText><Law><LawBody><LawTitle>民法</LawTitle><MainProvision>
+<Chapter><ChapterTitle>第五章　不法行為</ChapterTitle>
+<Article Num="709"><ArticleCaption>（不法行為による損害賠償）</ArticleCaption><ArticleTitle>第七百九条</ArticleTitle>
+<Paragraph Num="1"><ParagraphSentence><Sentence>{text}</Sentence></ParagraphSentence></Paragraph></Article>
+</Chapter></MainProvision></LawBody></Law></LawFullText></ApplData></DataRoot>""".encode("utf-8")
+
+
+class FakeEgov:
+    """法令ID ごとに応答の台本を持つ e-Gov の代用。台本が尽きたら ETag 付きの 200（If-None-Match が合えば 304）"""
+
+    def __init__(self, body: bytes, etag: str = '"v1"'):
+        self.body, self.etag = body, etag
+        self.scripts: Dict[str, List[httpx.Response]] = {}
+        self.requests: List[httpx.Request] = []
+
+    def script(self, law_id: str, *responses: httpx.Response) -> None:
+        self.scripts.setdefault(law_id, []).extend(responses)
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        law_id = request.url.path.rsplit("/", 1)[-1]
+        if self.scripts.get(law_id):
+            return self.scripts[law_id].pop(0)
+        if request.headers.get("If-None-Match") == self.etag:
+            return httpx.Response(304)
+        return httpx.Response(200, content=self.body, headers={"ETag": self.etag})
+
+
+@pytest.fixture
+def egov(monkeypatch, tmp_path):
+    """bulk_ingest の AsyncClient を MockTransport に差し替え、生 XML・取り込み先を一時ディレクトリに、待ち時間を記録だけにする"""
+    fake = FakeEgov(law_xml())
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(bi.httpx, "AsyncClient", lambda **kw: real_client(transport=httpx.MockTransport(fake.handler), **kw))
+    monkeypatch.setattr(bi, "BASE_URL", "http://egov.test/api/1/lawdata")
+    monkeypatch.setattr(bi, "RAW_DIR", tmp_path / "raw")
+    monkeypatch.setattr(ingest_egov, "DATA_DIR", tmp_path / "ingested")
+    (tmp_path / "ingested").mkdir()
+    fake.sleeps = []
+
+    async def no_sleep(s):
+        fake.sleeps.append(s)
+
+    monkeypatch.setattr(bi.asyncio, "sleep", no_sleep)
+    return fake
+
+
+def _law(out: dict, key: str = "civilcode") -> dict:
+    return next(r for r in out["laws"] if r["law"] == key)
+
+
+def test_retries_503_then_succeeds(egov):
+    egov.script(LAW_ID, httpx.Response(503), httpx.Response(503))
+    out = bi.bulk_ingest(["civilcode"], workers=1)
+    r = _law(out)
+    assert r["status"] == "fetched"
+    assert len(egov.requests) == 3 and len(egov.sleeps) == 2
+    # Retry-After が無ければ指数バックオフ（0.5 * 2**attempt にジッタ 0.5〜1.5 倍）
+    assert 0.25 <= egov.sleeps[0] <= 0.75 and 0.5 <= egov.sleeps[1] <= 1.5
+    assert r["diff"]["added"] == 1 and out["written"]
+    docs = json.loads(ingest_egov.ingested_path("civilcode").read_text(encoding="utf-8"))
+    assert [d["id"] for d in docs] == ["civilcode:第七百九条"]
+
+
+def test_honors_retry_after(egov):
+    egov.script(LAW_ID, httpx.Response(429, headers={"Retry-After": "7"}))
+    r = _law(bi.bulk_ingest(["civilcode"], workers=1))
+    assert r["status"] == "fetched"
+    assert egov.sleeps == [7.0]
+
+
+def test_gives_up_after_retries(egov):
+    egov.script(LAW_ID, *[httpx.Response(503) for _ in range(3)])
+    out = bi.bulk_ingest(["civilcode"], retries=2, workers=1)
+    r = _law(out)
+    assert r["status"] == "failed" and r["error"] == "HTTP 503"
+    assert len(egov.requests) == 3 and not out["written"]
+    assert not ingest_egov.ingested_path("civilcode").exists()
+
+
+def test_not_modified_rerun_skips_parsing(egov, monkeypatch):
+    parsed = []
+    real_parse = bi._parse_one
+    monkeypatch.setattr(bi, "_parse_one", lambda k, p: parsed.append(k) or real_parse(k, p))
+
+    assert _law(bi.bulk_ingest(["civilcode"], workers=1))["status"] == "fetched"
+    assert parsed == ["civilcode"]
+    meta = json.loads((bi.RAW_DIR / f"{LAW_ID}.meta.json").read_text(encoding="utf-8"))
+    assert meta["etag"] == egov.etag
+
+    out = bi.bulk_ingest(["civilcode"], workers=1)
+    assert egov.requests[-1].headers["If-None-Match"] == egov.etag
+    assert _law(out)["status"] == "not_modified" and not out["written"]
+    assert parsed == ["civilcode"]
+
+    # --force なら 304 でも解析し直す（中身は同じなので書き換えない）
+    out = bi.bulk_ingest(["civilcode"], workers=1, force=True)
+    assert parsed == ["civilcode", "civilcode"]
+    assert _law(out)["diff"]["unchanged"] == 1 and not out["written"]
+
+
+def test_fixtures_cli_writes_ingested_json(tmp_path):
+    fixtures = tmp_path / "xml"
+    fixtures.mkdir()
+    (fixtures / f"{LAW_ID}.xml").write_bytes(law_xml())
+    ingested = tmp_path / "ingested"
+    env = {**os.environ, "RAG_INGESTED_DIR": str(ingested), "EGOV_RAW_DIR": str(tmp_path / "raw"),
+           "EGOV_BASE_URL": "http://127.0.0.1:9"}  # 取得に行けば失敗する
+    backend = Path(bi.__file__).resolve().parent
+    p = subprocess.run([sys.executable, str(backend / "bulk_ingest.py"), "--fixtures", str(fixtures), "--workers", "1",
+                        "civilcode", "landlease"], cwd=backend, env=env, capture_output=True, text=True, timeout=120)
+    assert p.returncode == 0, p.stderr
+    lines = {l.split()[0]: l for l in p.stdout.splitlines()}
+    assert "fixture" in lines["civilcode"] and "failed" in lines["landlease"]
+    docs = json.loads((ingested / "civilcode_egov.json").read_text(encoding="utf-8"))
+    assert docs[0]["article"] == "第七百九条" and "損害を賠償する" in docs[0]["text"]
+    assert not (ingested / "landlease_egov.json").exists()
+    assert not (tmp_path / "raw").exists()
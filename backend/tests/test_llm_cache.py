@@ -0,0 +1,85 @@
+# backend/tests/test_llm_cache.py
+# 応答キャッシュの async 経路：メモリはその場で、SQLite の読み書きはイベントループの外（スレッド）で行うこと
+from __future__ import annotations
+
+import asyncio
+import threading
+
+import pytest
+
+import llm_cache as lc
+
+MSGS = [{"role": "system", "content": "sys"}, {"role": "user", "content": "敷金は返ってきますか"}]
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    """SQLite 付きのキャッシュに差し替え、ディスク側を呼んだスレッドを記録する"""
+    c = lc.LLMCache(db_path=str(tmp_path / "llm_cache.db"))
+    threads = []
+    for name in ("_get_disk", "_put_disk"):
+        orig = getattr(c, name)
+
+        def spy(*a, _orig=orig, _name=name):
+            threads.append((_name, threading.get_ident()))
+            return _orig(*a)
+
+        monkeypatch.setattr(c, name, spy)
+    monkeypatch.setattr(lc, "LLM_CACHE", c)
+    c.threads = threads
+    return c
+
+
+def test_async_call_reads_and_writes_disk_off_the_loop(cache):
+    calls = []
+
+    @lc.cached_chat("groq", lambda: "m")
+    async def chat(messages):
+        calls.append(1)
+        return "回答"
+
+    async def main():
+        loop_thread = threading.get_ident()
+        assert await chat(MSGS) == "回答"
+        # メモリを空にしてディスクから引かせる
+        cache._mem.clear()
+        assert await chat(MSGS) == "回答"
+        # 2 回目はメモリ命中でディスクに行かない
+        n = len(cache.threads)
+        assert await chat(MSGS) == "回答"
+        assert len(cache.threads) == n
+        return loop_thread
+
+    loop_thread = asyncio.run(main())
+    assert calls == [1]
+    assert [n for n, _ in cache.threads] == ["_get_disk", "_put_disk", "_get_disk"]
+    assert all(t != loop_thread for _, t in cache.threads)
+    assert cache.stats["disk_hits"] == 1 and cache.stats["memory_hits"] == 1 and cache.stats["misses"] == 1
+
+
+def test_async_stream_saves_only_when_finished(cache):
+    @lc.cached_chat("groq", lambda: "m")
+    async def stream(messages):
+        yield "敷金は"
+        yield "返ります"
+
+    async def collect(n=None):
+        out = []
+        async for x in stream(MSGS):
+            out.append(x)
+            if n is not None and len(out) == n:
+                break
+        return out
+
+    async def main():
+        loop_thread = threading.get_ident()
+        assert await collect(1) == ["敷金は"]
+        assert cache.info()["size"] == 0
+        assert await collect() == ["敷金は", "返ります"]
+        cache._mem.clear()
+        assert await collect() == ["敷金は返ります"]
+        return loop_thread
+
+    loop_thread = asyncio.run(main())
+    assert "_put_disk" in [n for n, _ in cache.threads]
+    assert all(t != loop_thread for _, t in cache.threads)
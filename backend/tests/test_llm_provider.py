@@ -0,0 +1,372 @@
+# backend/tests/test_llm_provider.py
+# llm_provider の再試行・サーキットブレーカー・ヘッジ・締め切りをネットワーク無しで確かめる。
+# Groq SDK の下の httpx に MockTransport を差し込み、モデル名ごとに台本どおりの応答（503 → 200 など）を返す。
+# SDK の例外の作り分け（429 → RateLimitError、Retry-After ヘッダ等）も本物を通る。
+#   cd backend && python -m pytest -q tests
+from __future__ import annotations
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+import pytest
+
+import llm_provider as lp
+import metrics
+
+MESSAGES = [{"role": "user", "content": "質問"}]
+
+
+@dataclass
+class Step:
+    """1 回の要求への応答。status が 200 なら deltas をつないだ本文（stream なら差分ごとの SSE）。
+    delay は応答ヘッダまで、stall は stream の role だけの chunk と最初の差分の間に待つ秒数"""
+    status: int = 200
+    deltas: List[str] = field(default_factory=lambda: ["ok"])
+    delay: float = 0.0
+    stall: float = 0.0
+    headers: Dict[str, str] = field(default_factory=dict)
+    message: str = "mock error"
+
+    def response(self, body: dict) -> httpx.Response:
+        if self.status != 200:
+            return httpx.Response(self.status, headers=self.headers,
+                                  json={"error": {"message": self.message, "type": "mock", "code": self.message}})
+        model = body["model"]
+        if not body.get("stream"):
+            return httpx.Response(200, json={
+                "id": "c", "object": "chat.completion", "created": 0, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(self.deltas)},
+                             "finish_reason": "stop"}],
+            })
+        # 実物と同じく最初の chunk は role だけ（空の差分）
+        chunks = [{"role": "assistant", "content": ""}] + [{"content": d} for d in self.deltas]
+        lines = [
+            "data: " + json.dumps({"id": "c", "object": "chat.completion.chunk", "created": 0, "model": model,
+                                   "choices": [{"index": 0, "delta": c, "finish_reason": None}]}) + "\n\n"
+            for c in chunks
+        ]
+        lines.append("data: [DONE]\n\n")
+        if not self.stall:
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content="".join(lines).encode())
+
+        async def body():
+            yield lines[0].encode()
+            await asyncio.sleep(self.stall)
+            for line in lines[1:]:
+                yield line.encode()
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=body())
+
+
+def ok(*deltas: str, delay: float = 0.0, stall: float = 0.0) -> Step:
+    return Step(deltas=list(deltas) or ["ok"], delay=delay, stall=stall)
+
+
+def err(status: int, retry_after: Optional[str] = None, message: str = "mock error") -> Step:
+    return Step(status=status, headers={"retry-after": retry_after} if retry_after else {}, message=message)
+
+
+class FakeGroq:
+    """モデル名 → 応答の台本。最後の 1 つは尽きずに繰り返す。要求の数と、取り消された要求をモデル名ごとに記録する"""
+
+    def __init__(self):
+        self.scripts: Dict[str, List[Step]] = {}
+        self.calls: Dict[str, int] = {}
+        self.cancelled: List[str] = []
+        self._lock = threading.Lock()
+
+    def script(self, model: str, *steps: Step) -> None:
+        self.scripts[model] = list(steps)
+
+    def _next(self, request: httpx.Request):
+        body = json.loads(request.content)
+        with self._lock:
+            self.calls[body["model"]] = self.calls.get(body["model"], 0) + 1
+            steps = self.scripts.setdefault(body["model"], [ok()])
+            return (steps.pop(0) if len(steps) > 1 else steps[0]), body
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        step, body = self._next(request)
+        time.sleep(step.delay)
+        return step.response(body)
+
+    async def ahandler(self, request: httpx.Request) -> httpx.Response:
+        step, body = self._next(request)
+        try:
+            await asyncio.sleep(step.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(body["model"])
+            raise
+        return step.response(body)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    f = FakeGroq()
+    monkeypatch.setenv("GROQ_API_KEY", "test")
+    monkeypatch.setattr(lp, "_CLIENTS", {
+        "sync:http": httpx.Client(transport=httpx.MockTransport(f.handler)),
+        "async:http": httpx.AsyncClient(transport=httpx.MockTransport(f.ahandler)),
+    })
+    monkeypatch.setattr(lp, "_PROVIDERS", {})
+    monkeypatch.setattr(lp, "TIMEOUT", 5.0)
+    monkeypatch.setattr(lp, "DEADLINE", 5.0)
+    monkeypatch.setattr(lp, "RETRIES", 2)
+    monkeypatch.setattr(lp, "BACKOFF", 0.01)
+    monkeypatch.setattr(lp, "HEDGE_AFTER", 0.0)
+    monkeypatch.setattr(lp, "HEDGE_PROVIDER", "")
+    monkeypatch.setattr(lp, "HEDGE_MODEL", "")
+    return f
+
+
+@pytest.fixture
+def hedge(fake, monkeypatch):
+    """副系は同じ Groq の backup モデル"""
+    monkeypatch.setattr(lp, "HEDGE_AFTER", 0.1)
+    monkeypatch.setattr(lp, "HEDGE_MODEL", "backup")
+    return fake
+
+
+def outcomes(model: str) -> Dict[str, float]:
+    name = f"groq:{model}"
+    return {k[1]: v for k, v in dict(metrics.LLM_CALLS._values).items() if k[0] == name}
+
+
+def delta(before: Dict[str, float], model: str) -> Dict[str, float]:
+    after = outcomes(model)
+    return {k: after[k] - before.get(k, 0.0) for k in after if after[k] != before.get(k, 0.0)}
+
+
+async def collect(agen) -> List[str]:
+    return [d async for d in agen]
+
+
+# ========== 再試行 ==========
+def test_retries_5xx_then_succeeds(fake):
+    fake.script("m-retry", err(503), err(502), ok("答え"))
+    before = outcomes("m-retry")
+    assert lp.chat("groq", MESSAGES, model="m-retry") == "答え"
+    assert fake.calls["m-retry"] == 3
+    assert delta(before, "m-retry") == {"retry": 2, "ok": 1}
+    assert lp.get_provider("groq", "m-retry").breaker.state == "closed"
+
+
+def test_gives_up_after_retries(fake):
+    fake.script("m-down", err(503))
+    with pytest.raises(Exception) as ei:
+        lp.chat("groq", MESSAGES, model="m-down")
+    assert getattr(ei.value, "status_code", None) == 503
+    assert fake.calls["m-down"] == lp.RETRIES + 1
+
+
+def test_client_error_is_not_retried_nor_counted_by_breaker(fake):
+    fake.script("m-400", err(400))
+    with pytest.raises(Exception) as ei:
+        lp.chat("groq", MESSAGES, model="m-400")
+    assert getattr(ei.value, "status_code", None) == 400
+    assert fake.calls["m-400"] == 1
+    assert lp.get_provider("groq", "m-400").breaker._fails == 0
+
+
+def test_retry_after_is_honoured(fake):
+    fake.script("m-429", err(429, retry_after="0.3"), ok())
+    t = time.monotonic()
+    assert lp.chat("groq", MESSAGES, model="m-429") == "ok"
+    assert time.monotonic() - t >= 0.3
+    assert fake.calls["m-429"] == 2
+
+
+def test_retry_after_past_deadline_fails_now(fake, monkeypatch):
+    monkeypatch.setattr(lp, "DEADLINE", 1.0)
+    fake.script("m-429", err(429, retry_after="30"), ok())
+    t = time.monotonic()
+    with pytest.raises(Exception) as ei:
+        lp.chat("groq", MESSAGES, model="m-429")
+    assert getattr(ei.value, "status_code", None) == 429
+    assert time.monotonic() - t < 0.5   # 待っても締め切りに間に合わないので待たない
+    assert fake.calls["m-429"] == 1
+
+
+def test_decommissioned_model_falls_back(fake):
+    fake.script("m-old", err(400, message="model_decommissioned"))
+    fake.script(lp.DECOMMISSIONED_FALLBACKS[0], ok("新しいモデル"))
+    assert lp.chat("groq", MESSAGES, model="m-old") == "新しいモデル"
+    assert fake.calls == {"m-old": 1, lp.DECOMMISSIONED_FALLBACKS[0]: 1}
+
+
+def test_async_retries_5xx_then_succeeds(fake):
+    fake.script("m-retry", err(503), ok("答え"))
+    assert asyncio.run(lp.achat("groq", MESSAGES, model="m-retry")) == "答え"
+    assert fake.calls["m-retry"] == 2
+
+
+# ========== 締め切り ==========
+def test_expired_deadline_does_not_call(fake):
+    p = lp.get_provider("groq", "m")
+    with pytest.raises(TimeoutError):
+        p.chat(MESSAGES, time.monotonic() - 1)
+    assert fake.calls == {}
+
+
+def test_async_deadline_cuts_slow_attempt(fake, monkeypatch):
+    monkeypatch.setattr(lp, "DEADLINE", 0.3)
+    fake.script("m-slow", ok(delay=5.0))
+    t = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(lp.achat("groq", MESSAGES, model="m-slow"))
+    assert time.monotonic() - t < 1.0
+    assert fake.cancelled == ["m-slow"]
+
+
+# ========== サーキットブレーカー ==========
+def test_breaker_open_half_open_reopen_close():
+    b = lp.CircuitBreaker("t", failures=2, cooldown=0.05)
+    b.failure()
+    assert b.state == "closed" and b.allow()
+    b.failure()
+    assert b.state == "open" and not b.allow()
+    time.sleep(0.06)
+    assert b.state == "half_open"
+    assert b.allow()          # 試しの 1 件
+    assert not b.allow()      # 結果が出るまで他は通さない
+    b.failure()               # 試しが失敗したら開き直す
+    assert b.state == "open" and not b.allow()
+    time.sleep(0.06)
+    assert b.allow()
+    b.release()               # 結果が出ないまま終わった試しは譲る
+    assert b.allow()
+    b.success()
+    assert b.state == "closed" and b.allow()
+
+
+def test_open_breaker_fails_fast_without_calling(fake, monkeypatch):
+    monkeypatch.setattr(lp, "RETRIES", 0)
+    fake.script("m-down", err(503))
+    p = lp.get_provider("groq", "m-down")
+    p.breaker.failures, p.breaker.cooldown = 2, 0.1
+    for _ in range(2):
+        with pytest.raises(Exception):
+            lp.chat("groq", MESSAGES, model="m-down")
+    before = outcomes("m-down")
+    with pytest.raises(lp.CircuitOpenError):
+        lp.chat("groq", MESSAGES, model="m-down")
+    assert fake.calls["m-down"] == 2
+    assert delta(before, "m-down") == {"circuit_open": 1}
+    assert lp.circuit_states()["groq:m-down"] == "open"
+
+    time.sleep(0.11)
+    fake.script("m-down", ok("復旧"))
+    assert lp.chat("groq", MESSAGES, model="m-down") == "復旧"
+    assert p.breaker.state == "closed"
+
+
+def test_retries_stop_once_breaker_opens(fake, monkeypatch):
+    monkeypatch.setattr(lp, "RETRIES", 5)
+    fake.script("m-down", err(503))
+    lp.get_provider("groq", "m-down").breaker.failures = 2
+    with pytest.raises(Exception) as ei:
+        lp.chat("groq", MESSAGES, model="m-down")
+    assert getattr(ei.value, "status_code", None) == 503   # 開いた後に待って CircuitOpenError にはしない
+    assert fake.calls["m-down"] == 2
+
+
+# ========== ヘッジ ==========
+def test_hedge_backup_wins_when_primary_is_slow(hedge):
+    hedge.script("primary", ok("主系", delay=0.8))
+    hedge.script("backup", ok("副系"))
+    before = outcomes("backup")
+    t = time.monotonic()
+    assert lp.chat("groq", MESSAGES, model="primary") == "副系"
+    assert time.monotonic() - t < 0.6
+    assert delta(before, "backup") == {"hedge": 1, "hedge_win": 1, "ok": 1}
+
+
+def test_hedge_primary_wins_when_fast(hedge):
+    hedge.script("primary", ok("主系"))
+    assert lp.chat("groq", MESSAGES, model="primary") == "主系"
+    assert "backup" not in hedge.calls
+
+
+def test_hedge_starts_at_once_when_primary_fails(hedge, monkeypatch):
+    monkeypatch.setattr(lp, "HEDGE_AFTER", 2.0)
+    hedge.script("primary", err(400))
+    hedge.script("backup", ok("副系"))
+    t = time.monotonic()
+    assert lp.chat("groq", MESSAGES, model="primary") == "副系"
+    assert time.monotonic() - t < 1.0
+
+
+def test_async_hedge_cancels_loser_and_releases_probe(hedge):
+    hedge.script("primary", ok("主系", delay=2.0))
+    hedge.script("backup", ok("副系"))
+    primary = lp.get_provider("groq", "primary")
+    primary.breaker._opened_at = time.monotonic() - 100   # 半開：主系の要求がその試しになる
+
+    async def run():
+        out = await lp.achat("groq", MESSAGES, model="primary")
+        await asyncio.sleep(0.05)   # 取り消しが負けた方のタスクに届くまで（asyncio.run の後片付けより前に見る）
+        return out, list(hedge.cancelled)
+
+    t = time.monotonic()
+    assert asyncio.run(run()) == ("副系", ["primary"])
+    assert time.monotonic() - t < 1.0
+    assert primary.breaker.allow()   # 取り消された試しは次に譲られている
+
+
+def test_async_hedge_on_open_primary_circuit(hedge, monkeypatch):
+    monkeypatch.setattr(lp, "HEDGE_AFTER", 2.0)
+    hedge.script("backup", ok("副系"))
+    primary = lp.get_provider("groq", "primary")
+    primary.breaker._opened_at = time.monotonic()
+    t = time.monotonic()
+    assert asyncio.run(lp.achat("groq", MESSAGES, model="primary")) == "副系"
+    assert time.monotonic() - t < 1.0
+    assert "primary" not in hedge.calls
+
+
+def test_async_hedge_both_fail_raises_first_error(hedge):
+    hedge.script("primary", err(400))
+    hedge.script("backup", err(400))
+    with pytest.raises(Exception) as ei:
+        asyncio.run(lp.achat("groq", MESSAGES, model="primary"))
+    assert getattr(ei.value, "status_code", None) == 400
+
+
+# ========== ストリーム ==========
+def test_stream_yields_deltas(fake):
+    fake.script("m", ok("こん", "にち", "は"))
+    assert asyncio.run(collect(lp.astream("groq", MESSAGES, model="m"))) == ["こん", "にち", "は"]
+
+
+def test_stream_retries_before_first_delta(fake):
+    fake.script("m", err(503), ok("再", "試行"))
+    before = outcomes("m")
+    assert asyncio.run(collect(lp.astream("groq", MESSAGES, model="m"))) == ["再", "試行"]
+    assert fake.calls["m"] == 2
+    assert delta(before, "m") == {"retry": 1, "ok": 1}
+
+
+def test_stream_hedge_uses_first_to_start(hedge):
+    hedge.script("primary", ok("主系", delay=2.0))
+    hedge.script("backup", ok("副", "系"))
+
+    async def run():
+        out = await collect(lp.astream("groq", MESSAGES, model="primary"))
+        await asyncio.sleep(0.05)
+        return out, list(hedge.cancelled)
+
+    t = time.monotonic()
+    assert asyncio.run(run()) == (["副", "系"], ["primary"])
+    assert time.monotonic() - t < 1.0
+
+
+def test_stream_hedge_waits_for_first_delta_not_headers(hedge):
+    # 主系はヘッダと role だけの chunk はすぐ返すが、本文が来ない。最初の差分で比べるので副系が勝つ
+    hedge.script("primary", ok("主系", stall=2.0))
+    hedge.script("backup", ok("副", "系"))
+    t = time.monotonic()
+    assert asyncio.run(collect(lp.astream("groq", MESSAGES, model="primary"))) == ["副", "系"]
+    assert time.monotonic() - t < 1.0
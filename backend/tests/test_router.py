@@ -0,0 +1,104 @@
+# backend/tests/test_router.py
+# ローカルルータの埋め込み側（kNN 投票の混ぜ方・起動時の例文の埋め込みとそのキャッシュ）を、モデル無しの作った埋め込みで確かめる
+from __future__ import annotations
+
+import numpy as np
+import pytest
+
+import embeddings
+import index_cache
+import router
+
+
+@pytest.fixture
+def ex(monkeypatch):
+    """例文ごとに直交するベクトルを入れた _Exemplars（元に戻す）"""
+    e = router._exemplars()
+    monkeypatch.setattr(e, "vecs", np.eye(len(e.rows), dtype=np.float32))
+    return e
+
+
+def _query_for(e, c: int) -> str:
+    """語彙だけでクラス c が 1 位になる例文"""
+    for row, cls in zip(e.rows, e.row_class):
+        if cls == c:
+            e_vecs, e.vecs = e.vecs, None
+            try:
+                if router.route_local(row["query"])["law_hints"] == e.classes[c]["law_hints"][: router.MAX_HINTS]:
+                    return row["query"]
+            finally:
+                e.vecs = e_vecs
+    pytest.skip("no lexically separable exemplar")
+
+
+def _vec_towards(e, c: int) -> np.ndarray:
+    """クラス c の例文だけに向いた質問ベクトル"""
+    v = np.zeros(len(e.rows), dtype=np.float32)
+    rows = [i for i, cls in enumerate(e.row_class) if cls == c]
+    v[rows[: router.KNN_K]] = 1.0
+    return v / np.linalg.norm(v)
+
+
+def _civil_classes(e):
+    return [i for i, c in enumerate(e.classes) if c["domain"] == "civil" and c["law_hints"]]
+
+
+def test_vote_agrees_keeps_lexical_confidence(ex):
+    c = _civil_classes(ex)[0]
+    q = _query_for(ex, c)
+    vecs, ex.vecs = ex.vecs, None
+    lexical = router.route_local(q)
+    ex.vecs = vecs
+    routed = router.route_local(q, _vec_towards(ex, c))
+    assert routed["law_hints"] == lexical["law_hints"]
+    assert routed["confidence"] == lexical["confidence"]
+
+
+def test_vote_picks_class_and_caps_confidence(ex, monkeypatch):
+    monkeypatch.setattr(router, "VEC_WEIGHT", 0.75)
+    a, b = _civil_classes(ex)[:2]
+    q = _query_for(ex, a)
+    routed = router.route_local(q, _vec_towards(ex, b))
+    # 条・トピックは埋め込みで選んだクラスとその中の最近傍の例文から
+    assert routed["law_hints"][: len(ex.classes[b]["law_hints"])] == ex.classes[b]["law_hints"][: router.MAX_HINTS]
+    topics = list(dict.fromkeys(ex.rows[ex.row_class.index(b)].get("civil_topics", [])))[: router.MAX_TOPICS]
+    assert routed["civil_topics"][: len(topics)] == topics
+    assert routed["confidence"] <= router.RULE_CONFIDENCE
+
+
+def test_no_embedding_inside_request(monkeypatch):
+    e = router._exemplars()
+    monkeypatch.setattr(e, "vecs", None)
+    monkeypatch.setattr(embeddings, "embed", lambda texts: pytest.fail("embedded during a request"))
+    route = router.route_local("隣の家の木の枝が越境してきた", np.ones(8, dtype=np.float32) / np.sqrt(8))
+    assert route["router"] == "local"
+
+
+def test_warm_embeds_once_and_caches_to_disk(monkeypatch, tmp_path):
+    e = router._exemplars()
+    monkeypatch.setattr(e, "vecs", None)
+    monkeypatch.setattr(index_cache, "INDEX_DIR", tmp_path)
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(len(texts))
+        return np.eye(len(texts), dtype=np.float32)
+
+    monkeypatch.setattr(embeddings, "embed", fake_embed)
+    router.warm()
+    assert calls == [len(e.rows)] and e.vecs.shape == (len(e.rows), len(e.rows))
+    cached = list(tmp_path.glob("router_exemplars-*.npy"))
+    assert len(cached) == 1
+
+    # 次の起動はファイルを読むだけ
+    e.vecs = None
+    router.warm()
+    assert calls == [len(e.rows)]
+    np.testing.assert_array_equal(e.vecs, np.eye(len(e.rows), dtype=np.float32))
+
+    # モデル名が変われば作り直して古いものは消す
+    e.vecs = None
+    monkeypatch.setattr(index_cache, "MODEL_NAME", "other-model")
+    router.warm()
+    assert calls == [len(e.rows)] * 2
+    assert list(tmp_path.glob("router_exemplars-*.npy")) != cached and len(list(tmp_path.glob("router_exemplars-*.npy"))) == 1
@@ -0,0 +1,55 @@
+# backend/tests/test_vector_index.py
+# 圧縮埋め込みの厳密索引：融合に渡す全件スコアは圧縮行列の尺度だけ、float32 の再ランクは search() の上位の中だけ
+from __future__ import annotations
+
+import numpy as np
+
+from quantize import QuantizedMatrix
+from vector_index import ExactIndex
+
+
+class Spy:
+    """float32 原本への読み出し（行の添字）を記録する"""
+
+    def __init__(self, a: np.ndarray):
+        self.a, self.reads = a, []
+
+    def __getitem__(self, rows):
+        self.reads.append(np.asarray(rows))
+        return self.a[rows]
+
+    def __len__(self):
+        return len(self.a)
+
+
+def _data(n=2000, d=32, nq=4, seed=0):
+    rng = np.random.default_rng(seed)
+    e = rng.normal(size=(n, d)).astype(np.float32)
+    e /= np.linalg.norm(e, axis=1, keepdims=True)
+    q = e[rng.choice(n, nq)] + rng.normal(scale=0.1, size=(nq, d)).astype(np.float32)
+    return e, (q / np.linalg.norm(q, axis=1, keepdims=True)).astype(np.float32)
+
+
+def test_scores_stay_on_the_quantized_scale():
+    e, q = _data()
+    qm = QuantizedMatrix.from_float(e, "int8")
+    spy = Spy(e)
+    sc = ExactIndex(spy, qm, rerank_k=50).scores(q)
+    np.testing.assert_array_equal(sc, qm.dot(q))
+    assert spy.reads == []
+
+
+def test_search_reranks_within_the_pool():
+    e, q = _data()
+    qm = QuantizedMatrix.from_float(e, "int8")
+    spy = Spy(e)
+    rows, sc = ExactIndex(spy, qm, rerank_k=50).search(q, 10)
+    exact = q @ e.T
+    for qi in range(len(q)):
+        np.testing.assert_allclose(sc[qi], exact[qi, rows[qi]], rtol=1e-5)
+        assert (np.diff(sc[qi]) <= 0).all()
+        pool = np.argsort(-qm.dot(q[qi:qi + 1])[0], kind="stable")[:50]
+        assert set(rows[qi].tolist()) <= set(pool.tolist())
+    # 原本から読むのは上位 rerank_k 件だけ
+    assert all(len(r) == 50 for r in spy.reads)
+    assert np.array_equal(rows, ExactIndex(e).search(q, 10)[0])
@@ -0,0 +1,320 @@
+# backend/vector_index.py
+# 埋め込みチャネル用のベクトル索引。
+#   exact : NumPy の全件内積（既定。民法だけなら十分速い）
+#   ivf   : リポジトリ内実装の IVF（球面 k-means でクラスタ分割し、近い nprobe 個のリストだけ内積）
+#   faiss : faiss があれば HNSW（無ければ exact にフォールバック）
+#   hnsw  : hnswlib があれば HNSW（無ければ exact にフォールバック）
+# 環境変数:
+#   RAG_VECTOR_INDEX=exact|ivf|faiss|hnsw
+#   RAG_ANN_NLIST   IVF のリスト数（既定 √N）
+#   RAG_ANN_NPROBE  IVF で見るリスト数（既定 8。大きいほど再現率↑・遅延↑）
+#   RAG_ANN_EF      HNSW の探索幅 ef（既定 64）
+#   RAG_ANN_TOPK    近似索引から取る件数（RRF の埋め込みチャネルに入る候補数。既定 200）
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from quantize import RERANK_K
+
+log = logging.getLogger(__name__)
+
+VECTOR_INDEX_KIND = os.getenv("RAG_VECTOR_INDEX", "exact").lower()
+ANN_TOPK = int(os.getenv("RAG_ANN_TOPK", "200"))
+
+
+def _topk_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """行ごとの降順上位 k（argpartition → 上位だけ並べ替え）"""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    ps = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-ps, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(ps, order, axis=1)
+
+
+class ExactIndex:
+    kind = "exact"
+    exact = True
+
+    def __init__(self, embeddings, quantized=None, rerank_k: int = 0):
+        self.embeddings = embeddings    # float32（mmap 可）。圧縮時は search() の再ランクでしか読まない
+        self.quantized = quantized      # quantize.QuantizedMatrix があればこちらで全件採点
+        self.rerank_k = rerank_k        # 圧縮採点の上位だけ float32 原本で採点し直す件数
+
+    def scores(self, q_vecs: np.ndarray) -> np.ndarray:
+        """全件の (nq, N) 類似度。圧縮時は圧縮行列の採点だけ（融合の正規化・順位付けに使うので、
+        一部の行だけ float32 の値に差し替えて尺度を混ぜない）"""
+        q = np.atleast_2d(np.asarray(q_vecs, dtype=np.float32))
+        if self.quantized is None:
+            return q @ np.asarray(self.embeddings).T
+        return self.quantized.dot(q)
+
+    def search(self, q_vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """上位 k。圧縮時は上位 max(k, rerank_k) 件を float32 原本で採点し直し、その中で並べ直す"""
+        q = np.atleast_2d(np.asarray(q_vecs, dtype=np.float32))
+        sc = self.scores(q)
+        if self.quantized is None or self.rerank_k <= 0:
+            return _topk_rows(sc, k)
+        pool, _ = _topk_rows(sc, max(k, self.rerank_k))
+        pool = np.sort(pool, axis=1)  # mmap を前から順に読む
+        exact = np.empty(pool.shape, dtype=np.float32)
+        for qi, rows in enumerate(pool):
+            exact[qi] = np.asarray(self.embeddings[rows], dtype=np.float32) @ q[qi]
+        top, tsc = _topk_rows(exact, k)
+        return np.take_along_axis(pool, top, axis=1), tsc
+
+    def save(self, d: Path) -> None:
+        pass
+
+
+class IVFIndex:
+    """転置ファイル索引。セントロイドとの内積で近いリストを nprobe 個選び、その中だけ厳密に内積を取る。"""
+    kind = "ivf"
+    exact = False
+
+    def __init__(self, embeddings, centroids: np.ndarray, indptr: np.ndarray, ids: np.ndarray, nprobe: int = 8):
+        self.embeddings = embeddings
+        self.centroids = centroids   # (nlist, d) float32
+        self.indptr = indptr         # (nlist+1,) リストごとの範囲
+        self.ids = ids               # (N,) リスト順に並べた文書id
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, nlist: Optional[int] = None, nprobe: int = 8, iters: int = 15, seed: int = 0) -> "IVFIndex":
+        x = np.asarray(embeddings, dtype=np.float32)
+        n = len(x)
+        nlist = max(1, min(n, nlist or int(math.sqrt(n))))
+        rng = np.random.default_rng(seed)
+        cent = x[rng.choice(n, nlist, replace=False)].copy()
+        assign = np.zeros(n, dtype=np.int64)
+        for _ in range(iters):
+            assign = np.argmax(x @ cent.T, axis=1)
+            sums = np.zeros_like(cent)
+            np.add.at(sums, assign, x)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空クラスタは適当な点で作り直す
+                sums[empty] = x[rng.choice(n, int(empty.sum()), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            cent = sums / np.maximum(norms, 1e-12)
+        assign = np.argmax(x @ cent.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        indptr = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=indptr[1:])
+        return cls(embeddings, cent.astype(np.float32), indptr, order.astype(np.int64), nprobe)
+
+    def search(self, q_vecs: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.atleast_2d(np.asarray(q_vecs, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probe, _ = _topk_rows(q @ self.centroids.T, nprobe)
+        out_ids = np.full((len(q), k), -1, dtype=np.int64)
+        out_sc = np.full((len(q), k), -np.inf, dtype=np.float32)
+        emb = self.embeddings
+        for qi in range(len(q)):
+            cand = np.concatenate([self.ids[self.indptr[l]:self.indptr[l + 1]] for l in probe[qi]])
+            if len(cand) == 0:
+                continue
+            sc = np.asarray(emb[cand], dtype=np.float32) @ q[qi]
+            top, tsc = _topk_rows(sc[None, :], k)
+            out_ids[qi, :top.shape[1]] = cand[top[0]]
+            out_sc[qi, :top.shape[1]] = tsc[0]
+        return out_ids, out_sc
+
+    def remap(self, embeddings, prev_rows: np.ndarray) -> "IVFIndex":
+        """コーパス差し替え後の索引。前回から残った行はリストをそのまま引き継ぎ、新しい行だけ最寄りのセントロイドへ。
+        prev_rows[i] は新しい行 i の前回の行番号（新規・変更は -1）。セントロイドは学習し直さない。
+        """
+        old_assign = np.empty(len(self.ids), dtype=np.int64)
+        for l in range(self.nlist):
+            old_assign[self.ids[self.indptr[l]:self.indptr[l + 1]]] = l
+        prev_rows = np.asarray(prev_rows, dtype=np.int64)
+        assign = np.where(prev_rows >= 0, old_assign[np.maximum(prev_rows, 0)], -1)
+        fresh = np.flatnonzero(assign < 0)
+        if len(fresh):
+            assign[fresh] = np.argmax(np.asarray(embeddings[fresh], dtype=np.float32) @ self.centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        indptr = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=self.nlist), out=indptr[1:])
+        return IVFIndex(embeddings, self.centroids, indptr, order.astype(np.int64), self.nprobe)
+
+    def save(self, d: Path) -> None:
+        np.save(d / "centroids.npy", self.centroids)
+        np.save(d / "indptr.npy", self.indptr)
+        np.save(d / "ids.npy", self.ids)
+
+    @classmethod
+    def load(cls, d: Path, embeddings, nprobe: int = 8) -> "IVFIndex":
+        arr = lambda name: np.load(d / name, mmap_mode="r")
+        return cls(embeddings, np.asarray(arr("centroids.npy")), arr("indptr.npy"), arr("ids.npy"), nprobe)
+
+
+class FaissHNSWIndex:
+    kind = "faiss"
+    exact = False
+
+    def __init__(self, index, ef: int = 64):
+        self.index = index
+        self.index.hnsw.efSearch = ef
+
+    @classmethod
+    def build(cls, embeddings, m: int = 32, ef: int = 64) -> "FaissHNSWIndex":
+        import faiss
+        x = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index = faiss.IndexHNSWFlat(x.shape[1], m, faiss.METRIC_INNER_PRODUCT)
+        index.add(x)
+        return cls(index, ef)
+
+    def search(self, q_vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        sc, ids = self.index.search(np.ascontiguousarray(np.atleast_2d(q_vecs), dtype=np.float32), k)
+        return ids.astype(np.int64), sc
+
+    def save(self, d: Path) -> None:
+        import faiss
+        faiss.write_index(self.index, str(d / "faiss.index"))
+
+    @classmethod
+    def load(cls, d: Path, ef: int = 64) -> "FaissHNSWIndex":
+        import faiss
+        return cls(faiss.read_index(str(d / "faiss.index")), ef)
+
+
+class HnswlibIndex:
+    kind = "hnsw"
+    exact = False
+
+    def __init__(self, index, ef: int = 64):
+        self.index = index
+        self.index.set_ef(ef)
+
+    @classmethod
+    def build(cls, embeddings, m: int = 32, ef: int = 64) -> "HnswlibIndex":
+        import hnswlib
+        x = np.ascontiguousarray(embeddings, dtype=np.float32)
+        index = hnswlib.Index(space="ip", dim=x.shape[1])
+        index.init_index(max_elements=len(x), M=m, ef_construction=200)
+        index.add_items(x, np.arange(len(x)))
+        return cls(index, ef)
+
+    def search(self, q_vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        self.index.set_ef(max(k, self.index.ef))
+        labels, dist = self.index.knn_query(np.atleast_2d(q_vecs).astype(np.float32), k=min(k, self.index.get_current_count()))
+        return labels.astype(np.int64), (1.0 - dist).astype(np.float32)  # ip 空間の距離は 1 - 内積
+
+    def save(self, d: Path) -> None:
+        self.index.save_index(str(d / "hnsw.bin"))
+
+    @classmethod
+    def load(cls, d: Path, dim: int, n: int, ef: int = 64) -> "HnswlibIndex":
+        import hnswlib
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.load_index(str(d / "hnsw.bin"), max_elements=n)
+        return cls(index, ef)
+
+
+def ivf_nprobe() -> int:
+    return int(os.getenv("RAG_ANN_NPROBE", "8"))
+
+
+def _params(kind: str, n: int) -> dict:
+    if kind == "ivf":
+        return {"nlist": int(os.getenv("RAG_ANN_NLIST") or max(1, int(math.sqrt(n)))), "nprobe": ivf_nprobe()}
+    if kind in ("faiss", "hnsw"):
+        return {"m": 32, "ef": int(os.getenv("RAG_ANN_EF", "64"))}
+    return {}
+
+
+def index_tag(kind: str, n: int) -> str:
+    """永続化ディレクトリ名（構築パラメータが変われば別物として作り直す。探索時パラメータは含めない）"""
+    p = _params(kind, n)
+    build = {k: v for k, v in p.items() if k in ("nlist", "m")}
+    return "vector-" + kind + "".join(f"-{k}{v}" for k, v in sorted(build.items()))
+
+
+def build_index(embeddings, kind: str = VECTOR_INDEX_KIND, quantized=None):
+    """quantized（圧縮行列）を渡すと exact/ivf はそれで採点する（exact は上位 RERANK_K を float32 で再採点）。"""
+    n = len(embeddings)
+    p = _params(kind, n)
+    try:
+        if kind == "ivf":
+            index = IVFIndex.build(embeddings, nlist=p["nlist"], nprobe=p["nprobe"])
+            if quantized is not None:
+                index.embeddings = quantized
+            return index
+        if kind == "faiss":
+            return FaissHNSWIndex.build(embeddings, m=p["m"], ef=p["ef"])
+        if kind == "hnsw":
+            return HnswlibIndex.build(embeddings, m=p["m"], ef=p["ef"])
+    except ImportError as e:
+        log.warning("vector index '%s' unavailable (%s); falling back to exact", kind, e)
+    return ExactIndex(embeddings, quantized, RERANK_K if quantized is not None else 0)
+
+
+def load_index(d: Path, embeddings, kind: str = VECTOR_INDEX_KIND, quantized=None):
+    """保存済み索引を開く。無い/読めない場合は None（呼び出し側で build_index）。"""
+    n = len(embeddings)
+    p = _params(kind, n)
+    try:
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+        if meta.get("n") != n:
+            return None
+        if kind == "ivf":
+            return IVFIndex.load(d, quantized if quantized is not None else embeddings, nprobe=p["nprobe"])
+        if kind == "faiss":
+            return FaissHNSWIndex.load(d, ef=p["ef"])
+        if kind == "hnsw":
+            return HnswlibIndex.load(d, dim=embeddings.shape[1], n=n, ef=p["ef"])
+    except (OSError, ValueError, ImportError, RuntimeError):
+        return None
+    return None
+
+
+def save_index(index, d: Path, n: int) -> None:
+    index.save(d)
+    (d / "meta.json").write_text(json.dumps({"kind": index.kind, "n": n}), encoding="utf-8")
+
+
+def measure_recall(index, embeddings, queries: np.ndarray, k: int = 10) -> dict:
+    """exact の上位 k に対する再現率と 1 クエリあたりの遅延（ms）"""
+    exact_ids, _ = ExactIndex(embeddings).search(queries, k)
+    t = time.perf_counter()
+    ids, _ = index.search(queries, k)
+    ms = (time.perf_counter() - t) * 1000 / max(1, len(queries))
+    hit = sum(len(set(a.tolist()) & set(b.tolist())) for a, b in zip(exact_ids, ids))
+    return {"kind": index.kind, "k": k, "recall": hit / (k * len(queries)), "ms_per_query": ms}
+
+
+if __name__ == "__main__":
+    # 手元確認用：python vector_index.py で、ロード済みコーパス（埋め込みが無ければ乱数）に対する再現率/遅延を表示
+    import sys
+    from store import STORE
+    STORE.load()
+    emb = STORE.embeddings
+    if emb is None:
+        rng = np.random.default_rng(0)
+        emb = rng.normal(size=(len(STORE.docs) or 2000, 384)).astype(np.float32)
+        emb /= np.linalg.norm(emb, axis=1, keepdims=True)
+    rng = np.random.default_rng(1)
+    q = np.asarray(emb)[rng.choice(len(emb), 200)] + rng.normal(scale=0.05, size=(200, emb.shape[1]))
+    q = (q / np.linalg.norm(q, axis=1, keepdims=True)).astype(np.float32)
+    kinds = sys.argv[1:] or ["exact", "ivf"]
+    for kind in kinds:
+        idx = build_index(emb, kind)
+        for nprobe in ((1, 4, 8, 16) if kind == "ivf" else (None,)):
+            if nprobe:
+                idx.nprobe = nprobe
+            print({**measure_recall(idx, emb, q, 10), "nprobe": nprobe})
@@ -1,21 +1,45 @@
 "use client";
-import { useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import AnswerCard from "../components/AnswerCard";
 
 export default function Page() {
   const [q, setQ] = useState("");
   const [loading, setLoading] = useState(false);
   const [data, setData] = useState<any>(null);
+  // 実行中のストリーム。次の検索・アンマウントの前に閉じる（閉じないと 2 つの回答が混ざる）
+  const esRef = useRef<EventSource | null>(null);
+
+  useEffect(() => () => esRef.current?.close(), []);
 
   const doSearch = async () => {
     if (!q) return;
     setLoading(true);
     setData(null);
     const endpoint = process.env.NEXT_PUBLIC_BACKEND_URL || "http://localhost:8000";
-    const res = await fetch(`${endpoint}/search?query=${encodeURIComponent(q)}`);
-    const json = await res.json();
-    setData(json);
-    setLoading(false);
+    // /search/stream（SSE）：出典 → 回答本文（逐次） → 使用条文 の順に届いたものから表示
+    esRef.current?.close();
+    const es = new EventSource(`${endpoint}/search/stream?query=${encodeURIComponent(q)}`);
+    esRef.current = es;
+    const merge = (patch: any) => setData((prev: any) => ({ ...(prev || {}), ...patch }));
+    es.addEventListener("router", (e) => merge({ router: JSON.parse((e as MessageEvent).data) }));
+    es.addEventListener("sources", (e) => merge(JSON.parse((e as MessageEvent).data)));
+    es.addEventListener("token", (e) => {
+      const { text } = JSON.parse((e as MessageEvent).data);
+      setData((prev: any) => ({ ...(prev || {}), answer: (prev?.answer || "") + text }));
+    });
+    es.addEventListener("used_sources", (e) => merge(JSON.parse((e as MessageEvent).data)));
+    es.addEventListener("done", (e) => {
+      merge(JSON.parse((e as MessageEvent).data));
+      es.close();
+      setLoading(false);
+    });
+    es.addEventListener("error", (e) => {
+      const raw = (e as MessageEvent).data;
+      // sources と一緒に届いた注意書き（危険語フラグなど）は残して足す
+      if (raw) setData((prev: any) => ({ ...(prev || {}), warnings: [...(prev?.warnings || []), JSON.parse(raw).error] }));
+      es.close();
+      setLoading(false);
+    });
   };
 
   return (